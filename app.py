@@ -1,17 +1,24 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from langchain_ollama import ChatOllama
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
 import logging
-from typing import Dict
-import os, glob
-from modules.DocLoader import DocumentLoader
-from modules.TaskHandler import TaskHandler
-from modules.ContextQA import ContextQA
+from typing import AsyncIterator, List
+import os, json, time
+from modules.TaskHandler import TaskHandler, get_route_cache
 from modules.Summarize import DocumentSummarizer
 from modules.WebSearch import WebSearchAgent
+from modules.Clients import init_clients, get_clients, close_clients
+from modules.Workspace import WorkspaceManager
+from modules.IngestQueue import IngestQueue, IngestQueueFull
+from modules.SessionMemory import SessionMemoryStore
+from modules.WebCache import get_web_cache
+from modules.Scheduler import SchedulerBusy, current_session
+from modules.AnswerCache import get_answer_cache
+from modules.Metrics import (METRICS_SERVER_TIMING, current_trace, finish_trace, get_metrics, observe_stage,
+                             record_cache, stage, start_trace)
+from contextlib import asynccontextmanager
 import asyncio
 from modules.WebSearch import WebSearchAgent
 
@@ -20,7 +27,38 @@ from modules.WebSearch import WebSearchAgent
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# UVICORN_WORKERS > 1 ではワーカーごとにプロセスが分かれる（会話履歴はSESSION_STOREで共有）
+UVICORN_WORKERS = int(os.environ.get("UVICORN_WORKERS", "1"))
+
+# セッションごとのアップロード・解析結果・検索インデックス
+workspaces = WorkspaceManager(root="uploads")
+# アップロード時に解析・埋め込み・インデックス構築を済ませておくバックグラウンドのジョブ
+# （ジョブの状態とインデックスはプロセスごとのため、複数ワーカーでは使わず最初の質問時に構築する）
+ingest = IngestQueue(workspaces, enabled=UVICORN_WORKERS <= 1)
+
+async def evict_workspaces_periodically(interval: float = 60.0):
+    # リクエストがなくてもアイドル状態の作業領域と期限切れの会話履歴を解放する
+    while True:
+        await asyncio.sleep(interval)
+        workspaces.evict()
+        try:
+            await memories.evict()
+        except Exception as e:
+            logger.warning(f"Failed to evict sessions: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # モデル・検索クライアントはアプリ起動時に一度だけ作成し、全リクエストで共有
+    init_clients()
+    janitor = asyncio.create_task(evict_workspaces_periodically())
+    ingest.start()
+    yield
+    janitor.cancel()
+    await ingest.close()
+    await memories.close()
+    await close_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORSの設定
 app.add_middleware(
@@ -31,103 +69,110 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# メモリーをセッションごとに管理
-sessions: Dict[str, ConversationBufferMemory] = {}
-
-def get_or_create_memory(session_id: str) -> ConversationBufferMemory:
-    if session_id not in sessions:
-        sessions[session_id] = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-    return sessions[session_id]
-
-def check_files_in_directory(directory):
-    for root, dirs, files in os.walk(directory):
-        if files:  
-            return True
-    return False
-
-def delete_files_in_folder(folder_path):
-    files = glob.glob(os.path.join(folder_path, '*'))
-    for file in files:
-        try:
-            os.remove(file)
-            logger.info("Files cleaned up")
-        except Exception as e:
-            print(f'Error deleting files: {e}')
+# メモリーをセッションごとに管理（セッション数・保持期間・履歴のトークン数に上限あり）
+# 複数ワーカーで動かす場合はSESSION_STORE=sqlite/redisで履歴を共有する
+memories = SessionMemoryStore()
+
+async def stream_response(query: str, session_id: str) -> AsyncIterator[str]:
+    # 以降のモデル呼び出しはこのセッションの分としてスケジューリングされる
+    current_session.set(session_id)
+    # セッション専用の作業領域で、新規・変更ファイルのみを解析する（解析はプロセスプールで実行）
+    workspace = workspaces.get(session_id)
+    with stage("prepare"):
+        async with workspace.lock:
+            temp_file_path = await workspace.prepare()
+
+    clients = get_clients()
+    handler = TaskHandler(directory=workspace.directory, clients=clients)
+    with stage("route"):
+        task = await handler.aprocess_query(query)
+    logger.info(f"Task type determined: {task}")
+    trace = current_trace.get()
+    if trace is not None:
+        trace.task = task
+
+    # 同じ文書（またはWeb検索）への同じ・よく似た質問には保存済みの回答を返す
+    answers = get_answer_cache()
+    documents_key = workspace.documents_key if temp_file_path else None
+    cacheable = answers.enabled(task) and (task == "task4" or documents_key is not None)
+    if cacheable:
+        with stage("answer_cache"):
+            cached = await answers.lookup(task, documents_key, query)
+        record_cache("answer", cached is not None)
+        if cached is not None:
+            yield cached
+            await memories.add_turn(session_id, query, cached)
+            return
+
+    stream = None
+    if task == "task1":
+        llm = clients.chat("elyza:jp8b", temperature=0)
+        
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "あなたは誠実で優秀なAIアシスタントです。ユーザーとの会話履歴を考慮しながら、丁寧に日本語で回答してください。"),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}")
+        ])
+        
+        chain = prompt | llm
+        chat_history = await memories.history(session_id)
+        
+        async def chat_stream():
+            async with clients.limit("elyza:jp8b"):
+                async for chunk in chain.astream({
+                    "input": query,
+                    "chat_history": chat_history
+                }):
+                    yield chunk.content
+
+        stream = chat_stream()
+
+    elif task == "task2":
+        # 構築済みのインデックスは同じセッションの以降の質問でも使い回す
+        async with workspace.lock:
+            context_qa = workspace.context_qa()
+            await context_qa.asetup_qa_chain()
+        stream = context_qa.astream_answer(query)
+
+    elif task == "task3":
+        summarizer = DocumentSummarizer(temp_file_path)
+        stream = summarizer.astream_summary(query)
+    
+    elif task == "task4":
+        web_search_agent = WebSearchAgent()
+        stream = web_search_agent.astream_answer(query)
+
+    if stream is None:
+        raise ValueError("No response generated")
+
+    # 最初のトークンまでの時間（検索・キューの待ちを含む）と生成完了までの時間を記録
+    chunks = []
+    start = time.perf_counter()
+    async for chunk in stream:
+        if chunk:
+            if not chunks:
+                observe_stage("first_token", time.perf_counter() - start)
+            chunks.append(chunk)
+            yield chunk
+    observe_stage("generate", time.perf_counter() - start)
+
+    response = "".join(chunks)
+    if not response:
+        raise ValueError("No response generated")
+
+    # ストリーム完了後に一度だけresponseをメモリに保存
+    with stage("memory"):
+        await memories.add_turn(session_id, query, response)
+    if cacheable:
+        await answers.store(task, documents_key, query, response)
 
 async def generate_response(query: str, session_id: str) -> str:
-    temp_file_path = None
-    response = None
     try:
-        memory = get_or_create_memory(session_id)
-
-        dir_files = check_files_in_directory("uploads")
-        if dir_files == True:
-            doc_loader = DocumentLoader(directory_path="uploads")
-            temp_file_path = doc_loader.create_temp_file()
-            if temp_file_path is not None:
-              temp_file_path = "uploads/temp_combined.txt"
-
-        handler = TaskHandler()
-        task = handler.process_query(query)
-        logger.info(f"Task type determined: {task}")
-
-        if task == "task1":
-            llm = ChatOllama(
-                model="elyza:jp8b",
-                temperature=0,
-                timeout=30
-            )
-            
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "あなたは誠実で優秀なAIアシスタントです。ユーザーとの会話履歴を考慮しながら、丁寧に日本語で回答してください。"),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("human", "{input}")
-            ])
-            
-            chain = prompt | llm
-            
-            ai_messages = await chain.ainvoke({
-                "input": query,
-                "chat_history": memory.chat_memory.messages
-            })
-            response = ai_messages.content
-
-        elif task == "task2":
-            context_qa = ContextQA(temp_file_path)
-            response = context_qa.get_answer(query) 
-
-        elif task == "task3":
-            summarizer = DocumentSummarizer(temp_file_path)
-            response = summarizer.summarize(query) 
-        
-        elif task == "task4":
-            web_search_agent = WebSearchAgent()
-            response = web_search_agent.answer_query(query)
-
-        # responseをメモリに保存
-        if response is not None:
-            memory.chat_memory.add_user_message(query)
-            memory.chat_memory.add_ai_message(response)
-            
-            # responseのコピーを作成
-            final_response = response
-
-            # ファイル削除を実行
-            if dir_files:
-                try:
-                    folder_path = 'uploads'
-                    delete_files_in_folder(folder_path)
-                    logger.info(f"Cleaned up files for session {session_id}")
-                except Exception as cleanup_error:
-                    logger.error(f"Error during cleanup: {cleanup_error}")
-
-            return final_response
-        else:
-            raise ValueError("No response generated")
+        chunks = [chunk async for chunk in stream_response(query, session_id)]
+        return "".join(chunks)
 
+    except SchedulerBusy:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         raise HTTPException(status_code=500, detail=f"エラーが発生しました: {str(e)}")
@@ -139,19 +184,149 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     reply: str
 
+# 混雑時はすぐに429/503とRetry-Afterを返し、クライアントに再試行を任せる
+BUSY_MESSAGE = "現在混雑しています。しばらくしてから再度お試しください。"
+
+def busy_exception(e: SchedulerBusy) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=BUSY_MESSAGE, headers={"Retry-After": str(e.retry_after)})
+
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_response: Response):
+    trace = start_trace()
+    status = "error"
     try:
         if not request.message:
             raise HTTPException(status_code=400, detail="メッセージが空です")
             
         response = await generate_response(request.message, request.session_id)
+        status = "ok"
+        if METRICS_SERVER_TIMING:
+            # 処理段階ごとの内訳（ブラウザの開発者ツールやcurl -iで確認できる）
+            http_response.headers["Server-Timing"] = trace.server_timing()
         return ChatResponse(reply=response)
     
+    except SchedulerBusy as e:
+        status = "busy"
+        raise busy_exception(e)
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail="サーバーエラーが発生しました")
+    finally:
+        finish_trace(trace, "chat", status)
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    if not request.message:
+        raise HTTPException(status_code=400, detail="メッセージが空です")
+
+    # ストリーム開始後はステータスコードを返せないため、受け付け可否を先に確認する
+    try:
+        get_clients().scheduler.check_admission("elyza:jp8b", request.session_id)
+    except SchedulerBusy as e:
+        raise busy_exception(e)
+
+    # 1行1JSONのNDJSON形式でトークンを逐次返す
+    async def event_stream():
+        # ヘッダーは送信済みのため、処理時間の内訳は完了イベントに含める
+        trace = start_trace()
+        status = "error"
+        try:
+            async for chunk in stream_response(request.message, request.session_id):
+                yield json.dumps({"type": "token", "content": chunk}, ensure_ascii=False) + "\n"
+            status = "ok"
+            done = {"type": "done"}
+            if METRICS_SERVER_TIMING:
+                done["timings"] = trace.timings()
+            yield json.dumps(done) + "\n"
+        except SchedulerBusy as e:
+            status = "busy"
+            yield json.dumps({"type": "error", "message": BUSY_MESSAGE, "retry_after": e.retry_after}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}")
+            yield json.dumps({"type": "error", "message": "サーバーエラーが発生しました"}, ensure_ascii=False) + "\n"
+        finally:
+            finish_trace(trace, "chat_stream", status)
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+class IngestRequest(BaseModel):
+    session_id: str = "default"
+    filenames: List[str] = []
+
+@app.post("/api/files/ingest", status_code=202)
+async def ingest_files(request: IngestRequest):
+    # server.jsがアップロード直後に呼ぶ（最初の質問までにインデックスを構築しておく）
+    if not ingest.enabled:
+        return Response(status_code=204)
+    try:
+        job = ingest.submit(request.session_id, request.filenames)
+    except IngestQueueFull:
+        raise HTTPException(status_code=503, detail=BUSY_MESSAGE, headers={"Retry-After": "5"})
+    return job.to_dict()
+
+@app.get("/api/files/{job_id}/status")
+async def ingest_status(job_id: str):
+    job = ingest.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job.to_dict()
+
+@app.delete("/api/files/{filename}")
+async def delete_file(filename: str, session_id: str = "default"):
+    # server.jsがファイルを削除した後に呼ぶ: 処理中のジョブを取り消し、残りのファイルで作り直す
+    if not ingest.enabled:
+        return {"cancelled": [], "job": None}
+    cancelled = ingest.cancel(session_id)
+    try:
+        job = ingest.submit(session_id, [])
+    except IngestQueueFull:
+        # 作り直しは次の質問時に行われる
+        job = None
+    return {
+        "cancelled": [cancelled_job.id for cancelled_job in cancelled],
+        "job": job.to_dict() if job else None,
+    }
+
+@app.get("/api/health")
+async def health():
+    status = await get_clients().health_check()
+    status["route_cache"] = get_route_cache().stats()
+    status["workspaces"] = workspaces.stats()
+    status["sessions"] = memories.stats()
+    status["web_cache"] = get_web_cache().stats()
+    status["scheduler"] = get_clients().scheduler.stats()
+    status["answer_cache"] = get_answer_cache().stats()
+    status["ingest"] = ingest.stats()
+    return status
+
+# Prometheusのテキスト形式で各段階の処理時間・トークン数・キャッシュのヒット数を返す
+metrics = get_metrics()
+LLM_IN_FLIGHT = metrics.gauge("elyza_llm_in_flight", "Model calls currently running.", ("model",))
+LLM_QUEUED = metrics.gauge("elyza_llm_queued", "Model calls waiting for a slot.", ("model", "priority"))
+WORKSPACE_SESSIONS = metrics.gauge("elyza_workspace_sessions", "Sessions with an open workspace.")
+WORKSPACE_MEMORY = metrics.gauge("elyza_workspace_memory_bytes", "Memory held by loaded search indexes.")
+ANSWER_CACHE_ENTRIES = metrics.gauge("elyza_answer_cache_entries", "Live entries in the answer cache.")
+INGEST_JOBS = metrics.gauge("elyza_ingest_jobs", "Upload pre-indexing jobs by state.", ("state",))
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    for model, queue in get_clients().scheduler.stats().items():
+        LLM_IN_FLIGHT.set(queue["in_flight"], model=model)
+        for priority, depth in queue["queued"].items():
+            LLM_QUEUED.set(depth, model=model, priority=priority)
+    workspace_stats = workspaces.stats()
+    WORKSPACE_SESSIONS.set(workspace_stats["sessions"])
+    WORKSPACE_MEMORY.set(workspace_stats["memory_bytes"])
+    ANSWER_CACHE_ENTRIES.set(get_answer_cache().stats()["entries"])
+    ingest_stats = ingest.stats()
+    INGEST_JOBS.set(ingest_stats["queued"], state="queued")
+    INGEST_JOBS.set(ingest_stats["running"], state="running")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8501)
+    if UVICORN_WORKERS > 1 and memories.backend.stats()["backend"] == "memory":
+        logger.warning("In-memory session store is not shared between workers; set SESSION_STORE=sqlite or redis")
+    if UVICORN_WORKERS > 1:
+        logger.warning("Background ingestion is disabled with multiple workers; indexes are built at the first question")
+    uvicorn.run("app:app", host="127.0.0.1", port=8501, workers=UVICORN_WORKERS)
@@ -0,0 +1,129 @@
+"""
+Lookup latency and hit rate of modules.AnswerCache for exact repeats, paraphrased repeats
+(punctuation / politeness changes), near-duplicates that differ only in a number or name
+(第3条 vs 第4条) and unrelated questions, with the cache filled to --entries answers, per
+threshold and for the exact-match-only default. wrong_rate is the share of lookups that
+returned another question's answer. Hashed n-gram embeddings stand in for nomic-embed-text,
+so the run is offline; pass --embeddings to use the real model through Ollama.
+
+    python benchmarks/answer_cache_benchmark.py
+    python benchmarks/answer_cache_benchmark.py --entries 2000 --thresholds 0.9 0.95 --embeddings
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from chunker_benchmark import NgramEmbeddings, build_corpus
+from modules.AnswerCache import AnswerCache
+
+
+# 番号や固有名詞だけが異なり、答えも異なる質問の組（キャッシュ済み, 問い合わせ）
+NEAR_DUPLICATES = [
+    ("第3条の内容を教えてください", "第4条の内容を教えてください"),
+    ("第2章の要点は何ですか", "第12章の要点は何ですか"),
+    ("2023年度の売上高はいくらですか", "2024年度の売上高はいくらですか"),
+    ("東京支店の従業員数を教えてください", "大阪支店の従業員数を教えてください"),
+    ("製品Aの保証期間はどれくらいですか", "製品Bの保証期間はどれくらいですか"),
+    ("田中部長の担当業務は何ですか", "佐藤部長の担当業務は何ですか"),
+    ("最大消費電力は何ワットですか", "最小消費電力は何ワットですか"),
+    ("契約の解約条件を教えてください", "契約の更新条件を教えてください"),
+    ("返品は購入後何日以内まで可能ですか", "交換は購入後何日以内まで可能ですか"),
+    ("設定温度が30度を超えた場合の対応は", "設定温度が50度を超えた場合の対応は"),
+]
+
+
+def shift_number(query):
+    # 主語の番号を1つずらす（第3工場 → 第4工場）
+    return re.sub(r"\d+", lambda m: str(int(m.group()) + 1), query, count=1)
+
+
+def paraphrase(query):
+    # 正規化では吸収されない表記の揺れ（漢字・かなと句点）を加える
+    return query.replace("教えてください", "教えて下さい。")
+
+
+async def measure(cache, queries, documents_key, answers=None):
+    # answersを渡した場合は、正しい回答が返った割合（correct、Noneは返らないのが正しい）と
+    # 別の質問の回答が返った割合（wrong）も数える
+    latencies, hits, correct, wrong = [], 0, 0, 0
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        answer = await cache.lookup("task2", documents_key, query)
+        latencies.append(time.perf_counter() - start)
+        hits += answer is not None
+        correct += answers is not None and answer == answers[i]
+        wrong += answers is not None and answer is not None and answer != answers[i]
+    return {
+        "hit_rate": round(hits / len(queries), 3),
+        "correct_rate": round(correct / len(queries), 3) if answers is not None else None,
+        "wrong_rate": round(wrong / len(queries), 3) if answers is not None else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+    }
+
+
+async def main(args):
+    _, questions = build_corpus(args.entries + args.queries, args.seed)
+    cached, unseen = questions[:args.entries], questions[args.entries:]
+
+    if args.embeddings:
+        from modules.Clients import get_clients
+        embeddings = get_clients().embeddings("nomic-embed-text")
+    else:
+        embeddings = NgramEmbeddings()
+    # 埋め込みを保存するため、閾値を設定した状態で埋める
+    cache = AnswerCache(embeddings=embeddings, threshold=min(args.thresholds),
+                        max_entries=args.entries + len(NEAR_DUPLICATES))
+
+    documents_key = "manual-v1"
+    stored = {}
+    start = time.perf_counter()
+    for question in cached:
+        stored[question["query"]] = f"{question['answer']}です。"
+    for i, (query, _) in enumerate(NEAR_DUPLICATES):
+        stored[query] = f"手入力の回答{i}です。"
+    for query, answer in stored.items():
+        await cache.store("task2", documents_key, query, answer)
+    fill_s = time.perf_counter() - start
+
+    sample = cached[:args.queries]
+    expected = [stored[q["query"]] for q in sample]
+    # 番号をずらした質問がキャッシュ済みの別の質問と一致する場合は、その回答が正しい
+    near = [shift_number(q["query"]) for q in sample] + [probe for _, probe in NEAR_DUPLICATES]
+    near_expected = [stored.get(query) for query in near]
+    report = {"entries": args.entries, "fill_s": round(fill_s, 2), "thresholds": {}}
+    for threshold in [None] + args.thresholds:
+        cache.threshold = threshold
+        report["thresholds"]["exact_only" if threshold is None else str(threshold)] = {
+            "exact": await measure(cache, [q["query"] for q in sample], documents_key, expected),
+            "paraphrased": await measure(cache, [paraphrase(q["query"]) for q in sample], documents_key, expected),
+            "near_duplicates": await measure(cache, near, documents_key, near_expected),
+            "hand_written_pairs": await measure(cache, [probe for _, probe in NEAR_DUPLICATES], documents_key,
+                                                [None] * len(NEAR_DUPLICATES)),
+            "unrelated": await measure(cache, [q["query"] for q in unseen], documents_key),
+            "other_documents": await measure(cache, [q["query"] for q in sample], "manual-v2"),
+        }
+    report["stats"] = cache.stats()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Semantic answer cache benchmark")
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.85, 0.9, 0.95])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embeddings", action="store_true", help="use nomic-embed-text via Ollama")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,138 @@
+"""
+Compares the shared JapaneseChunker with the previous RecursiveCharacterTextSplitter(200, 20).
+
+Reports chunk counts, split time, indexing time and retrieval quality (hit@k: a retrieved
+chunk contains the whole sentence holding the answer). The default run uses a synthetic
+Japanese corpus and an offline character n-gram embedding; pass --embeddings to index with
+nomic-embed-text through Ollama, or --input to chunk your own UTF-8 text file.
+
+    python benchmarks/chunker_benchmark.py
+    python benchmarks/chunker_benchmark.py --facts 500 --embeddings
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from modules.Chunker import JapaneseChunker, TASK_CHUNK_SETTINGS
+
+SUBJECTS = ["第{}工場", "{}号館", "プロジェクト{}", "支店{}", "製品モデル{}"]
+ATTRIBUTES = [("稼働開始年", "{}年"), ("従業員数", "{}人"), ("年間売上", "{}億円"), ("責任者", "担当者{}"), ("所在地", "{}番地")]
+FILLER = [
+    "この取り組みは社内の複数部門と連携して進められている。",
+    "詳細については別紙の資料を参照してください。",
+    "なお、記載の数値は前年度末時点のものである。",
+    "関係者への聞き取り調査も並行して実施された。",
+    "今後の計画は次回の会議で改めて検討される予定だ。",
+    "品質管理の手順は従来の基準に沿って運用されている。",
+]
+
+
+class NgramEmbeddings(Embeddings):
+    """
+    Offline stand-in for an embedding model: hashed character bigram counts.
+    """
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            vector[zlib.crc32(text[i:i + 2].encode("utf-8")) % self.dim] += 1.0
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def embed_documents(self, texts):
+        return [self._vector(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text).tolist()
+
+
+def build_corpus(facts: int, seed: int):
+    rng = random.Random(seed)
+    paragraphs, questions = [], []
+    for i in range(facts):
+        subject = rng.choice(SUBJECTS).format(i)
+        attribute, value = rng.choice(ATTRIBUTES)
+        value = value.format(rng.randint(10, 9999))
+        fact = f"{subject}の{attribute}は{value}です。"
+        sentences = rng.sample(FILLER, 3)
+        sentences.insert(rng.randint(0, 3), fact)
+        paragraphs.append("".join(sentences))
+        questions.append({"query": f"{subject}の{attribute}を教えてください", "answer": fact})
+    return "\n".join(paragraphs), questions
+
+
+def evaluate(name, splitter, text, questions, embeddings, k):
+    start = time.perf_counter()
+    chunks = splitter.split_text(text)
+    split_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    index_seconds = time.perf_counter() - start
+
+    hits = 0
+    for question in questions:
+        query = np.asarray(embeddings.embed_query(question["query"]), dtype=np.float32)
+        top = np.argsort(-(matrix @ query))[:k]
+        hits += any(question["answer"] in chunks[i] for i in top)
+
+    lengths = [len(chunk) for chunk in chunks]
+    return {
+        "splitter": name,
+        "chunks": len(chunks),
+        "mean_chars": round(float(np.mean(lengths)), 1),
+        "split_ms": round(split_seconds * 1000, 2),
+        "index_ms": round(index_seconds * 1000, 2),
+        f"hit@{k}": round(hits / len(questions), 3) if questions else None,
+    }
+
+
+def main(args):
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+        questions = []
+    else:
+        text, questions = build_corpus(args.facts, args.seed)
+
+    if args.embeddings:
+        from modules.Clients import get_clients
+        embeddings = get_clients().embeddings("nomic-embed-text")
+    else:
+        embeddings = NgramEmbeddings()
+
+    splitters = [("recursive_200_20", RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=20))]
+    for task in args.tasks:
+        splitters.append((f"japanese_{task}", JapaneseChunker(**TASK_CHUNK_SETTINGS[task])))
+
+    results = [evaluate(name, splitter, text, questions, embeddings, args.k) for name, splitter in splitters]
+    report = {"characters": len(text), "questions": len(questions), "results": results}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunker comparison benchmark")
+    parser.add_argument("--input", help="UTF-8 text file to chunk instead of the synthetic corpus")
+    parser.add_argument("--facts", type=int, default=300, help="number of facts in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--tasks", nargs="+", default=["qa", "summarize"], choices=sorted(TASK_CHUNK_SETTINGS))
+    parser.add_argument("--embeddings", action="store_true", help="use nomic-embed-text via Ollama")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+"""
+Load test for the FastAPI chat endpoint.
+
+Sends the same message from N concurrent clients and reports throughput and
+latency for each concurrency level, so the effect of the async pipeline can
+be checked:
+
+    python benchmarks/load_test.py --concurrency 1 2 4 8 --requests 16
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+async def run_level(client: httpx.AsyncClient, url: str, message: str, concurrency: int, total: int) -> dict:
+    latencies = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        # クライアントごとに別セッションとして送信
+        session_id = f"load-{uuid.uuid4().hex[:8]}"
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json={"message": message, "session_id": session_id})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(statistics.median(latencies), 3) if latencies else None,
+        "latency_max_s": round(latencies[-1], 3) if latencies else None,
+    }
+
+
+async def main(args):
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        results = []
+        for concurrency in args.concurrency:
+            result = await run_level(client, args.url, args.message, concurrency, args.requests)
+            results.append(result)
+            print(
+                f"concurrency={result['concurrency']:>3}  "
+                f"throughput={result['throughput_rps']:.2f} req/s  "
+                f"p50={result['latency_p50_s']}s  errors={result['errors']}"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test for /api/chat")
+    parser.add_argument("--url", default="http://127.0.0.1:8501/api/chat")
+    parser.add_argument("--message", default="こんにちは。自己紹介をしてください。")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=16, help="requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    main_args = parser.parse_args()
+    asyncio.run(main(main_args))
@@ -0,0 +1,12 @@
+"""
+Offline benchmark suite for the chat pipeline.
+
+- fake_server: Ollama/OpenAI-compatible fake model server plus search and web stubs
+- corpus: synthetic Japanese corpora (1-500 pages) with checkable questions
+- scenarios: one scenario per task (chat, qa, summarize, web)
+- run: runs the FastAPI app in-process against the fake server and writes a JSON report
+- compare: compares two reports and flags regressions
+
+    python benchmarks/offline/run.py --output results.json
+    python benchmarks/offline/compare.py baseline.json results.json
+"""
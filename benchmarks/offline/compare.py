@@ -0,0 +1,75 @@
+"""
+Compares two reports written by benchmarks/offline/run.py, level by level (scenario, corpus
+pages, sessions). It prints the relative change of latency percentiles, time to first token,
+throughput and peak RSS. It exits with status 1 when any change is worse than --threshold
+percent, so it can gate CI.
+
+    python benchmarks/offline/compare.py baseline.json results.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# (表示名, 取り出し方, 大きいほど良いか)
+METRICS = [
+    ("p50_ms", lambda r: (r.get("latency_ms") or {}).get("p50"), False),
+    ("p95_ms", lambda r: (r.get("latency_ms") or {}).get("p95"), False),
+    ("p99_ms", lambda r: (r.get("latency_ms") or {}).get("p99"), False),
+    ("ttft_p50_ms", lambda r: (r.get("ttft_ms") or {}).get("p50"), False),
+    ("throughput_rps", lambda r: r.get("throughput_rps"), True),
+    ("peak_rss_mb", lambda r: r.get("peak_rss_mb"), False),
+]
+
+
+def level_key(result):
+    return result["scenario"], result.get("pages"), result["sessions"]
+
+
+def compare(baseline, current, threshold):
+    base = {level_key(r): r for r in baseline["results"]}
+    rows, regressions = [], []
+    for result in current["results"]:
+        key = level_key(result)
+        if key not in base:
+            continue
+        for name, get, higher_is_better in METRICS:
+            before, after = get(base[key]), get(result)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            row = {"level": "{}-{}p-{}s".format(key[0], key[1] or 0, key[2]), "metric": name,
+                   "baseline": before, "current": after, "change_pct": round(change, 1),
+                   "regression": worse > threshold}
+            rows.append(row)
+            if row["regression"]:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    rows, regressions = compare(baseline, current, args.threshold)
+
+    print(f"baseline {baseline.get('git_commit')} ({baseline.get('created_at')}) -> "
+          f"current {current.get('git_commit')} ({current.get('created_at')})")
+    for row in rows:
+        mark = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['level']:<24} {row['metric']:<15} {row['baseline']:>10} -> {row['current']:>10} "
+              f"({row['change_pct']:+.1f}%){mark}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows, "regressions": len(regressions)}, f, ensure_ascii=False, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two offline benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent")
+    parser.add_argument("--output", help="write the comparison as JSON to this path")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""
+Synthetic Japanese corpora for the offline benchmark suite.
+
+A corpus is a document of N pages. Each page has a heading and several paragraphs, and
+each paragraph holds one checkable fact ("第12工場の従業員数は340人です。") mixed into
+filler sentences. The same seed always produces the same text and questions, so results
+from different runs can be compared.
+"""
+import os
+import random
+import shutil
+from typing import Dict, List, Tuple
+
+SUBJECTS = ["第{}工場", "{}号館", "プロジェクト{}", "支店{}", "製品モデル{}", "研究グループ{}"]
+ATTRIBUTES = [("稼働開始年", "{}年"), ("従業員数", "{}人"), ("年間売上", "{}億円"), ("責任者", "担当者{}"),
+              ("所在地", "{}番地"), ("評価点", "{}点")]
+FILLER = [
+    "この取り組みは社内の複数部門と連携して進められている。",
+    "詳細については別紙の資料を参照してください。",
+    "なお、記載の数値は前年度末時点のものである。",
+    "関係者への聞き取り調査も並行して実施された。",
+    "今後の計画は次回の会議で改めて検討される予定だ。",
+    "品質管理の手順は従来の基準に沿って運用されている。",
+    "安全対策については定期的な点検で確認している。",
+    "外部の専門家による監査も年に一度行われている。",
+]
+TOPICS = ["生産体制", "人員配置", "売上推移", "設備投資", "品質管理", "研究開発", "地域連携", "環境対策"]
+
+
+def build_pages(pages: int, seed: int = 0, paragraphs_per_page: int = 4) -> Tuple[List[str], List[Dict[str, str]]]:
+    """
+    Returns the page texts and one question per fact ({"query", "answer", "page"}).
+    """
+    rng = random.Random(seed)
+    texts, questions = [], []
+    for page in range(pages):
+        topic = TOPICS[page % len(TOPICS)]
+        lines = [f"第{page + 1}章 {topic}について"]
+        for paragraph in range(paragraphs_per_page):
+            number = page * paragraphs_per_page + paragraph
+            subject = rng.choice(SUBJECTS).format(number)
+            attribute, value = rng.choice(ATTRIBUTES)
+            fact = f"{subject}の{attribute}は{value.format(rng.randint(10, 9999))}です。"
+            sentences = rng.sample(FILLER, 4)
+            sentences.insert(rng.randint(0, 4), fact)
+            lines.append("".join(sentences))
+            questions.append({"query": f"{subject}の{attribute}を教えてください", "answer": fact, "page": str(page)})
+        texts.append("\n".join(lines))
+    return texts, questions
+
+
+def write_corpus(directory: str, pages: int, seed: int = 0, filename: str = "corpus.txt") -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Writes a corpus of the given number of pages as one UTF-8 text file and returns its path
+    and questions. An existing file with the same size and seed is reused.
+    """
+    os.makedirs(directory, exist_ok=True)
+    texts, questions = build_pages(pages, seed)
+    path = os.path.join(directory, f"{pages}p-{seed}-{filename}")
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            # 改ページ相当の区切りとして空行を2つ入れる
+            f.write("\n\n\n".join(texts))
+    return path, questions
+
+
+def install(corpus_path: str, session_directory: str) -> None:
+    """
+    Places the corpus in a session's upload directory (hard link when possible, else a copy).
+    """
+    os.makedirs(session_directory, exist_ok=True)
+    target = os.path.join(session_directory, os.path.basename(corpus_path))
+    if os.path.exists(target):
+        return
+    try:
+        os.link(corpus_path, target)
+    except OSError:
+        shutil.copyfile(corpus_path, target)
+
+
+def page_html(page: int, seed: int = 0) -> Tuple[str, str]:
+    """
+    HTML for one page of the web stub: (title, html). Pages are drawn from an endless corpus.
+    """
+    texts, _ = build_pages(1, seed * 100003 + page)
+    lines = texts[0].split("\n")
+    title = f"{lines[0]}（ページ{page}）"
+    body = "".join(f"<p>{line}</p>" for line in lines[1:])
+    html = (f"<html><head><meta charset=\"utf-8\"><title>{title}</title></head>"
+            f"<body><nav>メニュー</nav><h1>{title}</h1>{body}<footer>Copyright</footer></body></html>")
+    return title, html
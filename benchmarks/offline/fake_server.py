@@ -0,0 +1,264 @@
+"""
+Local stand-in for Ollama and the web, for benchmarks that must not depend on a GPU or the
+internet. One FastAPI app serves:
+
+- Ollama API: /api/chat (streamed NDJSON), /api/generate, /api/embed, /api/embeddings, /api/tags
+- OpenAI-compatible API: /v1/chat/completions (the task router, via instructor JSON mode)
+  and /v1/embeddings
+- Search and web stub: /search?q= (DuckDuckGo-like results) and /web/pages/{n} (HTML pages
+  with ETag, answering conditional requests with 304)
+
+Generation is simulated with a prompt-processing delay proportional to the prompt length,
+a first-token delay and a per-token delay, with at most --parallel requests generating at
+once (like OLLAMA_NUM_PARALLEL). Embeddings are deterministic hashed character bigrams.
+
+    python benchmarks/offline/fake_server.py --port 11500 --token-latency 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import numpy as np
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+from benchmarks.offline.corpus import page_html
+
+SENTENCES = [
+    "ご質問ありがとうございます。",
+    "資料に記載されている内容をもとにお答えします。",
+    "該当する箇所によると、数値は前年度末時点のものです。",
+    "詳しくは関連する章もあわせてご確認ください。",
+    "要点を整理すると、主な取り組みは三つに分けられます。",
+    "まず、生産体制の見直しが進められています。",
+    "次に、品質管理の手順が改善されました。",
+    "最後に、今後の計画は次回の会議で検討される予定です。",
+]
+ROUTER_MARKER = "タスクは、4種類です"
+WEB_KEYWORDS = ("最新", "ニュース", "今日", "検索", "最近")
+
+
+@dataclass
+class FakeModelSettings:
+    token_latency: float = 0.02      # 1トークンの生成時間（秒）
+    first_token_latency: float = 0.05
+    prefill_per_1k: float = 0.01     # プロンプト1000文字あたりの処理時間
+    tokens: int = 48                 # 1回の応答のトークン数
+    embed_latency: float = 0.001     # 1テキストあたりの埋め込み時間
+    dim: int = 768
+    parallel: int = 4                # 同時に生成できるリクエスト数
+    page_latency: float = 0.05       # ウェブページ1件の応答時間
+    seed: int = 0
+
+
+def embed(text: str, dim: int) -> List[float]:
+    vector = np.zeros(dim, dtype=np.float32)
+    for i in range(len(text) - 1):
+        vector[zlib.crc32(text[i:i + 2].encode("utf-8")) % dim] += 1.0
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).tolist()
+
+
+def prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(str(content))
+    return "\n".join(parts)
+
+
+def route(prompt: str) -> str:
+    # タスク判定のプロンプトに対して、本物のモデルと同じ形式（{"Task": ...}）で答える
+    has_reference = "参照テキストあり" in prompt
+    query = prompt.split("ユーザーのクエリ:")[-1].split("回答:")[0]
+    if has_reference:
+        return "task3" if "要約" in query else "task2"
+    return "task4" if any(word in query for word in WEB_KEYWORDS) else "task1"
+
+
+def answer_tokens(prompt: str, count: int) -> List[str]:
+    # 同じプロンプトには常に同じ応答を返す（2文字を1トークンとみなす）
+    rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+    text = ""
+    while len(text) < count * 2:
+        text += rng.choice(SENTENCES)
+    return [text[i:i + 2] for i in range(0, count * 2, 2)]
+
+
+def prompt_tokens(prompt: str) -> int:
+    return max(1, len(prompt) // 2)
+
+
+def create_app(settings: FakeModelSettings) -> FastAPI:
+    app = FastAPI()
+    slots = asyncio.Semaphore(settings.parallel)
+    stats = {"chat": 0, "embed_texts": 0, "router": 0, "pages": 0, "not_modified": 0, "searches": 0}
+
+    async def generate(prompt: str, count: int):
+        # 同時実行数を超えた分は待たせ、プロンプト処理→トークン生成の順に時間をかける
+        async with slots:
+            await asyncio.sleep(settings.first_token_latency + settings.prefill_per_1k * len(prompt) / 1000)
+            for token in answer_tokens(prompt, count):
+                yield token
+                await asyncio.sleep(settings.token_latency)
+
+    def now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "elyza:jp8b", "model": "elyza:jp8b"},
+                           {"name": "nomic-embed-text", "model": "nomic-embed-text"}]}
+
+    @app.get("/stats")
+    async def server_stats():
+        return stats
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        prompt = prompt_text(body.get("messages", []))
+        model = body.get("model", "")
+        count = int(body.get("options", {}).get("num_predict") or settings.tokens)
+        stats["chat"] += 1
+
+        async def lines():
+            started = time.perf_counter_ns()
+            produced = 0
+            async for token in generate(prompt, count):
+                produced += 1
+                yield json.dumps({"model": model, "created_at": now(), "done": False,
+                                  "message": {"role": "assistant", "content": token}}, ensure_ascii=False) + "\n"
+            yield json.dumps({"model": model, "created_at": now(), "done": True, "done_reason": "stop",
+                              "message": {"role": "assistant", "content": ""},
+                              "total_duration": time.perf_counter_ns() - started,
+                              "prompt_eval_count": prompt_tokens(prompt), "eval_count": produced}) + "\n"
+
+        if body.get("stream", True):
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+        tokens = [token async for token in generate(prompt, count)]
+        return {"model": model, "created_at": now(), "done": True, "done_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "prompt_eval_count": prompt_tokens(prompt), "eval_count": len(tokens)}
+
+    @app.post("/api/generate")
+    async def ollama_generate(request: Request):
+        body = await request.json()
+        prompt = body.get("prompt", "")
+        tokens = [token async for token in generate(prompt, settings.tokens)]
+        return {"model": body.get("model", ""), "created_at": now(), "done": True, "response": "".join(tokens),
+                "prompt_eval_count": prompt_tokens(prompt), "eval_count": len(tokens)}
+
+    async def embed_many(texts: List[str]) -> List[List[float]]:
+        stats["embed_texts"] += len(texts)
+        await asyncio.sleep(settings.embed_latency * len(texts))
+        return [embed(text, settings.dim) for text in texts]
+
+    @app.post("/api/embed")
+    async def ollama_embed(request: Request):
+        body = await request.json()
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        return {"model": body.get("model", ""), "embeddings": await embed_many(texts)}
+
+    @app.post("/api/embeddings")
+    async def ollama_embeddings(request: Request):
+        body = await request.json()
+        return {"embedding": (await embed_many([body.get("prompt", "")]))[0]}
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        prompt = prompt_text(body.get("messages", []))
+        if ROUTER_MARKER in prompt:
+            stats["router"] += 1
+            async with slots:
+                await asyncio.sleep(settings.first_token_latency + settings.token_latency * 8)
+            content = json.dumps({"Task": route(prompt)})
+            completion_tokens = 8
+        else:
+            tokens = [token async for token in generate(prompt, settings.tokens)]
+            content = "".join(tokens)
+            completion_tokens = len(tokens)
+        return {
+            "id": f"chatcmpl-{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens(prompt), "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens(prompt) + completion_tokens},
+        }
+
+    @app.post("/v1/embeddings")
+    async def openai_embeddings(request: Request):
+        body = await request.json()
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        vectors = await embed_many(texts)
+        return {"object": "list", "model": body.get("model", ""),
+                "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.get("/search")
+    async def search(request: Request, q: str = "", max_results: int = 3):
+        # クエリから決まる3ページを返す（同じクエリには同じ結果）
+        stats["searches"] += 1
+        base = str(request.base_url).rstrip("/")
+        first = zlib.crc32(q.encode("utf-8")) % 1000
+        results = []
+        for page in range(first, first + max_results):
+            title, _ = page_html(page, settings.seed)
+            results.append({"title": title, "link": f"{base}/web/pages/{page}", "snippet": f"{title}に関する記事です。"})
+        return results
+
+    @app.get("/web/pages/{page}")
+    async def web_page(page: int, request: Request):
+        title, html = page_html(page, settings.seed)
+        etag = f'"{zlib.crc32(html.encode("utf-8")):08x}"'
+        if request.headers.get("if-none-match") == etag:
+            stats["not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        stats["pages"] += 1
+        await asyncio.sleep(settings.page_latency)
+        return Response(html, media_type="text/html; charset=utf-8", headers={"ETag": etag})
+
+    return app
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser) -> None:
+    # FakeModelSettingsの各項目を --token-latency のようなオプションにする
+    for name, value in vars(FakeModelSettings()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+
+def settings_from_args(args: argparse.Namespace) -> FakeModelSettings:
+    return FakeModelSettings(**{name: getattr(args, name) for name in vars(FakeModelSettings())})
+
+def settings_to_argv(settings: FakeModelSettings) -> List[str]:
+    argv = []
+    for name, value in vars(settings).items():
+        argv += [f"--{name.replace('_', '-')}", str(value)]
+    return argv
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Fake Ollama/OpenAI and web server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
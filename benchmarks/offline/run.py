@@ -0,0 +1,320 @@
+"""
+Runs the chat pipeline against the fake model server and reports, for each scenario, corpus
+size and number of concurrent sessions: latency p50/p95/p99, time to first token, latency of
+each session's first request, throughput, peak RSS and the mean time spent in each pipeline
+stage (from the timings of /api/chat/stream).
+
+The FastAPI app runs in this process under uvicorn, so the peak RSS is the app's. Document
+parsing runs in a process pool, and those workers are not counted. The working directory is a
+temporary folder, so uploads and caches start cold. The fake server runs in a subprocess unless
+--server-url points at a running one (or at a real Ollama, with the web scenario using its stubs).
+
+    python benchmarks/offline/run.py --output results.json
+    python benchmarks/offline/run.py --scenarios qa summarize --pages 1 100 500 --sessions 1 8
+    python benchmarks/offline/compare.py baseline.json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+import httpx
+import numpy as np
+
+from benchmarks.offline.corpus import install, write_corpus
+from benchmarks.offline.fake_server import add_settings_arguments, settings_from_args, settings_to_argv
+from benchmarks.offline.scenarios import SCENARIOS, Scenario, StubSearch
+
+
+class RSSSampler:
+    """
+    Samples this process's resident set size in a background thread and keeps the peak.
+    """
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # /procがない環境（macOSなど）ではプロセス全体の最大値で代用
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(args) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_server.py")
+    process = subprocess.Popen([sys.executable, script, "--port", str(port)] + settings_to_argv(settings_from_args(args)))
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/api/tags", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("fake server did not start")
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    array = np.array(values) * 1000
+    return {
+        "p50": round(float(np.percentile(array, 50)), 1),
+        "p95": round(float(np.percentile(array, 95)), 1),
+        "p99": round(float(np.percentile(array, 99)), 1),
+        "mean": round(float(array.mean()), 1),
+        "max": round(float(array.max()), 1),
+    }
+
+
+async def send(client: httpx.AsyncClient, url: str, session_id: str, message: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    first_token, timings, error, chars = None, None, None, 0
+    try:
+        async with client.stream("POST", url, json={"message": message, "session_id": session_id}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                error = f"HTTP {response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token":
+                        first_token = first_token or time.perf_counter()
+                        chars += len(event["content"])
+                    elif event["type"] == "done":
+                        timings = event.get("timings")
+                    elif event["type"] == "error":
+                        error = event.get("message", "error")
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "latency": time.perf_counter() - start,
+        "ttft": first_token - start if first_token else None,
+        "timings": timings,
+        "error": error,
+        "chars": chars,
+    }
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float, peak_rss: int) -> Dict[str, Any]:
+    ok = [r for r in results if r["error"] is None]
+    stages, tokens, caches = defaultdict(float), Counter(), Counter()
+    timed = [r["timings"] for r in ok if r["timings"]]
+    for timings in timed:
+        for stage, ms in timings.get("stages_ms", {}).items():
+            stages[stage] += ms
+        tokens.update(timings.get("tokens", {}))
+        caches.update(f"{cache}:{result}" for cache, result in timings.get("cache", {}).items())
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_samples": sorted({r["error"] for r in results if r["error"]})[:3],
+        "latency_ms": percentiles([r["latency"] for r in ok]),
+        "ttft_ms": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "first_request_ms": percentiles([r["latency"] for r in ok if r["first"]]),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "output_chars_per_s": round(sum(r["chars"] for r in ok) / elapsed, 1) if elapsed else 0.0,
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+        "tasks": dict(Counter(t.get("task") or "none" for t in timed)),
+        # 段階ごとの1リクエストあたり平均（段階は入れ子・並行になるため合計は応答時間と一致しない）
+        "stages_ms": {stage: round(total / len(timed), 1) for stage, total in sorted(stages.items())} if timed else {},
+        "tokens_per_request": {k: round(v / len(timed), 1) for k, v in tokens.items()} if timed else {},
+        # リクエストごとの各キャッシュの結果（answer:hitが多い場合、モデルを呼ばずに応答している）
+        "cache": dict(sorted(caches.items())),
+    }
+
+
+async def run_level(client: httpx.AsyncClient, url: str, scenario: Scenario, pages: Optional[int],
+                    sessions: int, args) -> Dict[str, Any]:
+    questions, corpus_path = [], None
+    if scenario.uses_corpus:
+        corpus_path, questions = write_corpus(os.path.join(os.getcwd(), "corpora"), pages, args.seed)
+    label = f"{scenario.name}-{pages or 0}p-{sessions}s"
+    session_ids = [f"bench-{label}-{i}" for i in range(sessions)]
+    if corpus_path:
+        for session_id in session_ids:
+            install(corpus_path, os.path.join("uploads", session_id))
+
+    results: List[Dict[str, Any]] = []
+
+    async def session(index: int):
+        for i, message in enumerate(scenario.messages(questions, index, args.requests_per_session, args.seed)):
+            result = await send(client, url, session_ids[index], message)
+            result["first"] = i == 0
+            results.append(result)
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+
+    summary = {"scenario": scenario.name, "expected_task": scenario.task, "pages": pages, "sessions": sessions}
+    summary.update(summarize(results, elapsed, rss.peak))
+    latency = summary["latency_ms"] or {}
+    print(f"{label:<24} p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms "
+          f"rps={summary['throughput_rps']} rss={summary['peak_rss_mb']}MB errors={summary['errors']}",
+          file=sys.stderr)
+    return summary
+
+
+async def benchmark(args, server_url: str) -> Dict[str, Any]:
+    import logging
+    import uvicorn
+    import app as chat_app
+    from modules.AnswerCache import get_answer_cache
+    from modules.Clients import close_clients, init_clients
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    search = StubSearch(server_url)
+    init_clients(base_url=server_url, search_backend=search)
+    if args.no_answer_cache:
+        # 同じ質問の繰り返しでもモデルまでの経路を計測する
+        get_answer_cache().task_ttls = {}
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(chat_app.app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    url = f"http://127.0.0.1:{port}/api/chat/stream"
+
+    report: Dict[str, Any] = {"results": []}
+    limits = httpx.Limits(max_connections=max(args.sessions) * 2)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # 起動直後だけの処理（ルーターの代表クエリの埋め込みなど）を計測から外す
+        warmup = [await send(client, url, "bench-warmup", "こんにちは") for _ in range(args.warmup)]
+        report["warmup_ms"] = [round(r["latency"] * 1000, 1) for r in warmup]
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            for pages in (args.pages if scenario.uses_corpus else [None]):
+                for sessions in args.sessions:
+                    report["results"].append(await run_level(client, url, scenario, pages, sessions, args))
+        report["server_stats"] = httpx.get(f"{server_url}/stats").json() if not args.server_url else None
+
+    server.should_exit = True
+    await serving
+    await chat_app.memories.close()
+    await close_clients()
+    search.close()
+    return report
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="elyza-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    process = None
+    server_url = args.server_url
+    if server_url is None:
+        process, server_url = start_fake_server(args)
+    # uploads/と.cache/を作業ディレクトリに作らせ、毎回キャッシュなしの状態から計測する
+    os.environ["OLLAMA_BASE_URL"] = server_url
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(benchmark(args, server_url))
+    finally:
+        os.chdir(cwd)
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "scenarios": args.scenarios,
+            "pages": args.pages,
+            "sessions": args.sessions,
+            "requests_per_session": args.requests_per_session,
+            "seed": args.seed,
+            "answer_cache": not args.no_answer_cache,
+            "server": args.server_url or "fake",
+            "fake_model": vars(settings_from_args(args)),
+        },
+        **report,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the chat pipeline")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=["chat", "qa", "summarize", "web"])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 50], help="corpus sizes for qa/summarize (1-500)")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4], help="concurrent sessions")
+    parser.add_argument("--requests-per-session", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed requests before the first scenario")
+    parser.add_argument("--no-answer-cache", action="store_true", help="disable the semantic answer cache")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--server-url", help="use a running fake server (or Ollama) instead of starting one")
+    parser.add_argument("--workdir", help="keep uploads and caches here (default: a temporary directory)")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logs")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    add_settings_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,89 @@
+"""
+Benchmark scenarios, one per task, and the search backend stub.
+
+Each scenario yields the messages a session sends. Scenarios with a corpus ("qa",
+"summarize") get the corpus placed in the session's upload directory first, the way
+server.js stores uploads.
+"""
+import random
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
+
+import httpx
+
+CHAT_MESSAGES = [
+    "こんにちは。自己紹介をしてください。",
+    "おすすめの休日の過ごし方を教えてください。",
+    "敬語の使い方のコツはありますか？",
+    "ありがとうございます。もう少し詳しく説明してください。",
+    "日本の四季について簡単に話してください。",
+]
+SUMMARY_MESSAGES = [
+    "この文書を要約してください",
+    "資料の要点を3行で要約してください",
+    "文書全体の内容を簡潔に要約してください",
+]
+WEB_MESSAGES = [
+    "最新の生成AIのニュースを教えてください",
+    "最近の半導体業界の動向を検索してください",
+    "今日の為替相場の最新情報を教えてください",
+    "最新の電気自動車の販売状況を調べてください",
+    "最近話題のプログラミング言語を検索してください",
+]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    task: str              # 期待するタスク（ルーティング結果と照合する）
+    uses_corpus: bool
+    description: str
+
+    def messages(self, questions: List[Dict[str, str]], session_index: int, count: int, seed: int) -> Iterator[str]:
+        rng = random.Random(seed * 7919 + session_index)
+        if self.name == "chat":
+            pool = CHAT_MESSAGES
+        elif self.name == "qa":
+            pool = [q["query"] for q in questions]
+        elif self.name == "summarize":
+            pool = SUMMARY_MESSAGES
+        else:
+            pool = WEB_MESSAGES
+        # セッションごとに開始位置をずらし、同じ質問の繰り返しは現実的な範囲に抑える
+        start = rng.randrange(len(pool))
+        for i in range(count):
+            yield pool[(start + i) % len(pool)]
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (
+        Scenario("chat", "task1", False, "通常会話（会話履歴つき）"),
+        Scenario("qa", "task2", True, "参照文書Q&A（初回は解析・埋め込み・インデックス構築を含む）"),
+        Scenario("summarize", "task3", True, "文書要約"),
+        Scenario("web", "task4", False, "ウェブ検索（スタブの検索・ウェブサーバー）"),
+    )
+}
+
+
+class StubSearch:
+    """
+    Search backend with the DuckDuckGoSearchAPIWrapper interface (results(query, max_results)),
+    answered by the fake server's /search endpoint.
+    """
+    region = "jp-jp"
+    time = "y"
+    safesearch = "moderate"
+    source = "text"
+    backend = "stub"
+
+    def __init__(self, base_url: str, timeout: float = 10.0):
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.Client(timeout=timeout)
+
+    def results(self, query: str, max_results: int = 3) -> List[Dict[str, str]]:
+        response = self.client.get(f"{self.base_url}/search", params={"q": query, "max_results": max_results})
+        response.raise_for_status()
+        return response.json()
+
+    def close(self) -> None:
+        self.client.close()
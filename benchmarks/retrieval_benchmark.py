@@ -0,0 +1,97 @@
+"""
+Recall@k and query latency of the dense (FAISS), lexical (BM25 over character n-grams)
+and hybrid (reciprocal rank fusion) retrieval paths used by ContextQA.
+
+The default run is offline: a synthetic Japanese corpus and a hashed n-gram embedding as a
+stand-in for the dense model. Pass --embeddings to use nomic-embed-text through Ollama,
+which is what shows where the lexical path recovers keyword and number queries.
+
+    python benchmarks/retrieval_benchmark.py
+    python benchmarks/retrieval_benchmark.py --facts 1000 --k 3 --embeddings
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from chunker_benchmark import NgramEmbeddings, build_corpus
+from modules.Chunker import get_chunker
+from modules.LexicalIndex import HybridRetriever, LexicalIndex
+from modules.VectorStore import build_faiss
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def measure(name, search, questions, k):
+    latencies, hits = [], 0
+    for question in questions:
+        start = time.perf_counter()
+        results = search(question["query"])
+        latencies.append(time.perf_counter() - start)
+        hits += any(question["answer"] in text for text in results[:k])
+    return {
+        "path": name,
+        f"recall@{k}": round(hits / len(questions), 3),
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p95_us": round(percentile(latencies, 95) * 1e6, 1),
+    }
+
+
+def main(args):
+    text, questions = build_corpus(args.facts, args.seed)
+    chunks = [Document(page_content=chunk) for chunk in get_chunker("qa").split_text(text)]
+    texts = [chunk.page_content for chunk in chunks]
+
+    if args.embeddings:
+        from modules.Clients import get_clients
+        embeddings = get_clients().embeddings("nomic-embed-text")
+    else:
+        embeddings = NgramEmbeddings()
+
+    start = time.perf_counter()
+    db = build_faiss(chunks, embeddings)
+    dense_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lexical = LexicalIndex.build(texts)
+    lexical_build = time.perf_counter() - start
+
+    hybrid = HybridRetriever(vectorstore=db, lexical=lexical, documents=chunks, k=args.k)
+    # クエリ埋め込みを含めた計測になるよう、事前に一度ずつ呼び出してウォームアップ
+    db.similarity_search(questions[0]["query"], k=args.k)
+    hybrid.invoke(questions[0]["query"])
+
+    results = [
+        measure("dense", lambda q: [d.page_content for d in db.similarity_search(q, k=args.k)], questions, args.k),
+        measure("lexical", lambda q: [texts[i] for i, _ in lexical.search(q, args.k)], questions, args.k),
+        measure("hybrid", lambda q: [d.page_content for d in hybrid.invoke(q)], questions, args.k),
+    ]
+    report = {
+        "chunks": len(chunks),
+        "questions": len(questions),
+        "build_ms": {"dense": round(dense_build * 1000, 1), "lexical": round(lexical_build * 1000, 1)},
+        "results": results,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dense / lexical / hybrid retrieval benchmark")
+    parser.add_argument("--facts", type=int, default=300, help="number of facts in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--embeddings", action="store_true", help="use nomic-embed-text via Ollama")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    main(parser.parse_args())
@@ -0,0 +1,134 @@
+"""
+Offline accuracy and latency benchmark for the task router.
+
+The rule tier runs fully offline. Samples marked "kind": "confusable" are negative and
+confusable queries (keywords used in another sense, document questions without an upload)
+and are also reported separately. Pass --embeddings to add the embedding tier
+(requires Ollama with nomic-embed-text) and --llm to send undecided queries to
+the LLM classifier for an end-to-end comparison:
+
+    python benchmarks/router_benchmark.py
+    python benchmarks/router_benchmark.py --embeddings --llm
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.TaskRouter import TaskRouter
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize_latencies(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 95) * 1000, 3) if values else None,
+    }
+
+
+def summarize_kinds(rows):
+    # 種類ごとのローカル判定の割合と正解率（ローカル判定のみ。LLMに回したものは含めない）
+    kinds = {}
+    for kind in sorted({row["kind"] for row in rows}):
+        subset = [row for row in rows if row["kind"] == kind]
+        local = [row for row in subset if row["tier"] in ("rule", "embedding")]
+        kinds[kind] = {
+            "samples": len(subset),
+            "local_coverage": round(len(local) / len(subset), 3),
+            "local_accuracy": round(sum(row["predicted"] == row["label"] for row in local) / len(local), 3) if local else None,
+        }
+    return kinds
+
+
+async def main(args):
+    with open(args.data, encoding="utf-8") as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    embeddings = None
+    handler = None
+    if args.embeddings or args.llm:
+        from modules.Clients import get_clients
+        clients = get_clients()
+        embeddings = clients.embeddings("nomic-embed-text") if args.embeddings else None
+        if args.llm:
+            from modules.TaskHandler import TaskHandler
+            handler = TaskHandler(clients=clients, use_router=False)
+
+    router = TaskRouter(embeddings=embeddings)
+    if embeddings is not None:
+        # 代表クエリの埋め込みは計測対象外
+        await router._prototypes()
+
+    latencies = {"rule": [], "embedding": [], "llm": []}
+    local_correct = 0
+    local_total = 0
+    overall_correct = 0
+    rows = []
+
+    for sample in samples:
+        query, has_reference, label = sample["query"], sample["has_reference"], sample["label"]
+
+        start = time.perf_counter()
+        decision = router.route_by_rules(query, has_reference)
+        latencies["rule"].append(time.perf_counter() - start)
+
+        if decision is None and embeddings is not None:
+            start = time.perf_counter()
+            decision = await router.aroute_by_embedding(query, has_reference)
+            latencies["embedding"].append(time.perf_counter() - start)
+
+        predicted = decision.Task if decision else None
+        tier = decision.tier if decision else None
+        if decision is not None:
+            local_total += 1
+            local_correct += predicted == label
+        elif handler is not None:
+            start = time.perf_counter()
+            predicted = await handler.aprocess_query(query, has_reference=has_reference)
+            latencies["llm"].append(time.perf_counter() - start)
+            tier = "llm"
+
+        overall_correct += predicted == label
+        rows.append({"query": query, "label": label, "predicted": predicted, "tier": tier,
+                     "kind": sample.get("kind", "standard")})
+
+    report = {
+        "samples": len(samples),
+        "local_coverage": round(local_total / len(samples), 3),
+        "local_accuracy": round(local_correct / local_total, 3) if local_total else None,
+        "overall_accuracy": round(overall_correct / len(samples), 3) if handler is not None else None,
+        "by_kind": summarize_kinds(rows),
+        "latency": {tier: summarize_latencies(values) for tier, values in latencies.items() if values},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.verbose:
+        for row in rows:
+            mark = "OK " if row["predicted"] == row["label"] else "NG "
+            print(f"{mark}{row['tier'] or '-':<9} {row['label']} -> {row['predicted']}  {row['query']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"report": report, "rows": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Task router accuracy/latency benchmark")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(__file__), "data", "router_queries.jsonl"))
+    parser.add_argument("--embeddings", action="store_true", help="enable the embedding tier (needs Ollama)")
+    parser.add_argument("--llm", action="store_true", help="send undecided queries to the LLM (needs Ollama)")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,108 @@
+"""
+Interactive latency while a large map-reduce summary floods the model, with a plain per-model
+semaphore (the previous ClientRegistry.limit) versus modules.Scheduler.LLMScheduler. The model
+is simulated by a fixed service time per call, so the run needs no Ollama server.
+
+    python benchmarks/scheduler_benchmark.py
+    python benchmarks/scheduler_benchmark.py --limit 4 --batch 200 --chats 40 --service 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from modules.Scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerBusy
+
+
+class SemaphoreLimit:
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self, model, priority=INTERACTIVE, session_id=None):
+        async with self.semaphore:
+            yield
+
+
+async def run(limiter, args):
+    rng = random.Random(args.seed)
+    latencies = {INTERACTIVE: [], BATCH: []}
+    rejected = 0
+
+    async def call(priority, session_id):
+        nonlocal rejected
+        start = time.perf_counter()
+        try:
+            async with limiter.slot("elyza:jp8b", priority, session_id):
+                await asyncio.sleep(args.service * rng.uniform(0.5, 1.5))
+        except SchedulerBusy:
+            rejected += 1
+            return
+        latencies[priority].append(time.perf_counter() - start)
+
+    async def summary(session_id):
+        # 部分要約をmax_concurrency件ずつ並行に投入する（Summarize_MapReduceと同じ形）
+        semaphore = asyncio.Semaphore(args.map_concurrency)
+
+        async def item():
+            async with semaphore:
+                await call(BATCH, session_id)
+        await asyncio.gather(*(item() for _ in range(args.batch)))
+
+    async def chats():
+        tasks = []
+        for i in range(args.chats):
+            await asyncio.sleep(rng.expovariate(1 / args.interval))
+            tasks.append(asyncio.create_task(call(INTERACTIVE, f"chat-{i % 8}")))
+        await asyncio.gather(*tasks)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(summary(f"summary-{i}") for i in range(args.summaries)), chats())
+    wall = time.perf_counter() - start
+
+    def pct(values, q):
+        return round(float(np.percentile(values, q)) * 1000, 1) if values else None
+
+    return {
+        "wall_s": round(wall, 2),
+        "interactive_p50_ms": pct(latencies[INTERACTIVE], 50),
+        "interactive_p95_ms": pct(latencies[INTERACTIVE], 95),
+        "batch_p50_ms": pct(latencies[BATCH], 50),
+        "batch_p95_ms": pct(latencies[BATCH], 95),
+        "rejected": rejected,
+    }
+
+
+async def main(args):
+    scheduler = LLMScheduler(default_limit=args.limit, queue_timeout=600)
+    report = {
+        "semaphore": await run(SemaphoreLimit(args.limit), args),
+        "scheduler": await run(scheduler, args),
+        "scheduler_stats": scheduler.stats(),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM scheduler vs semaphore benchmark")
+    parser.add_argument("--limit", type=int, default=4, help="max in-flight calls per model")
+    parser.add_argument("--summaries", type=int, default=2, help="concurrent map-reduce summaries")
+    parser.add_argument("--batch", type=int, default=100, help="map calls per summary")
+    parser.add_argument("--map-concurrency", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=30)
+    parser.add_argument("--interval", type=float, default=0.1, help="mean seconds between chats")
+    parser.add_argument("--service", type=float, default=0.05, help="mean seconds per model call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    asyncio.run(main(parser.parse_args()))
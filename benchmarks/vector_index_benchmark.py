@@ -0,0 +1,129 @@
+"""
+Build time, query latency (p50/p99), recall@k against exact search and memory for the
+index types selected by modules.VectorStore (Flat / HNSW / IVF-PQ) on synthetic clustered
+vectors.
+
+    python benchmarks/vector_index_benchmark.py
+    python benchmarks/vector_index_benchmark.py --sizes 10000 100000 1000000 --dim 768
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+import numpy as np
+
+from modules.VectorStore import IndexSettings, create_index, index_type
+
+
+def current_rss_mb():
+    # Linuxでは/procから現在のRSS、それ以外はピークRSSで代用
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_vectors(count, dim, seed, clusters=256):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    return centers[labels] + 0.3 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3)
+
+
+def run(kind, vectors, queries, truth, settings, k):
+    # 指定した種類のインデックスになるよう閾値を調整
+    thresholds = {
+        "flat": {"hnsw_threshold": len(vectors) + 1, "ivfpq_threshold": len(vectors) + 1},
+        "hnsw": {"hnsw_threshold": 0, "ivfpq_threshold": len(vectors) + 1},
+        "ivfpq": {"hnsw_threshold": 0, "ivfpq_threshold": 0},
+    }[kind]
+    settings = settings.model_copy(update=thresholds)
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    index = create_index(vectors, settings)
+    index.add(vectors)
+    build_seconds = time.perf_counter() - start
+    rss_delta = current_rss_mb() - rss_before
+
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+
+    result = {
+        "vectors": len(vectors),
+        "index": kind,
+        "selected_by_default": index_type(len(vectors)) == kind,
+        "build_s": round(build_seconds, 2),
+        "query_p50_ms": percentile_ms(latencies, 50),
+        "query_p99_ms": percentile_ms(latencies, 99),
+        f"recall@{k}": round(float(recall), 3),
+        "index_mb": round(faiss.serialize_index(index).nbytes / 1024 ** 2, 1),
+        "rss_delta_mb": round(rss_delta, 1),
+    }
+    del index
+    return result
+
+
+def main(args):
+    settings = IndexSettings(
+        hnsw_m=args.hnsw_m,
+        hnsw_ef_search=args.ef_search,
+        ivf_nprobe=args.nprobe,
+        pq_dims=args.pq_dims,
+    )
+    results = []
+    for size in args.sizes:
+        vectors = synthetic_vectors(size, args.dim, args.seed)
+        rng = np.random.default_rng(args.seed + 1)
+        queries = vectors[rng.choice(size, args.queries, replace=False)] + 0.05 * rng.standard_normal(
+            (args.queries, args.dim)).astype(np.float32)
+
+        # 正解は全件探索の結果
+        exact = faiss.IndexFlatL2(args.dim)
+        exact.add(vectors)
+        _, truth = exact.search(queries, args.k)
+        del exact
+
+        for kind in args.types:
+            result = run(kind, vectors, queries, truth, settings, args.k)
+            print(json.dumps(result), flush=True)
+            results.append(result)
+        del vectors
+
+    report = {"dim": args.dim, "settings": settings.model_dump(), "peak_rss_mb": round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FAISS index type benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=768, help="768 matches nomic-embed-text")
+    parser.add_argument("--types", nargs="+", default=["flat", "hnsw", "ivfpq"], choices=["flat", "hnsw", "ivfpq"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--pq-dims", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    main(parser.parse_args())
@@ -0,0 +1,139 @@
+"""
+Latency of WebSearchTool for a cold query, a repeated query served from modules.WebCache and a
+repeated query after the page TTL expired (revalidated with ETag / 304). Runs offline: a stub
+search backend returns pages of a local stub web server and hashed n-gram embeddings stand in
+for the embedding model. The stub counts search calls and page downloads so the report shows
+which runs touched the "network".
+
+    python benchmarks/web_cache_benchmark.py
+    python benchmarks/web_cache_benchmark.py --pages 5 --delay 0.5 --repeats 20
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunker_benchmark import NgramEmbeddings, build_corpus
+from modules.WebCache import WebCache
+from modules.WebSearch import WebSearchTool
+
+COUNTS = {"search": 0, "download": 0, "not_modified": 0}
+
+
+class StubSearch:
+    """
+    Stand-in for DuckDuckGoSearchAPIWrapper.results returning pages of the stub web server.
+    """
+    region, time, safesearch, source, backend = "jp-jp", "y", "moderate", "text", "stub"
+
+    def __init__(self, base, pages, delay):
+        self.base = base
+        self.pages = pages
+        self.delay = delay
+
+    def results(self, query, max_results):
+        COUNTS["search"] += 1
+        time.sleep(self.delay)
+        return [
+            {"title": f"ページ{i}", "link": f"{self.base}/page/{i}", "snippet": f"{query}に関するページ{i}"}
+            for i in range(min(max_results, self.pages))
+        ]
+
+
+def make_handler(bodies, delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies[int(self.path.rsplit("/", 1)[1]) % len(bodies)]
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                COUNTS["not_modified"] += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            COUNTS["download"] += 1
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return StubHandler
+
+
+async def timed(tool, query):
+    start = time.perf_counter()
+    result = await tool.arun(query)
+    return (time.perf_counter() - start) * 1000, result
+
+
+async def main(args):
+    text, questions = build_corpus(args.facts, args.seed)
+    paragraphs = text.split("\n")
+    size = max(1, len(paragraphs) // args.pages)
+    bodies = [
+        ("<html><head><title>stub</title></head><body>"
+         + "".join(f"<p>{p}</p>" for p in paragraphs[i * size:(i + 1) * size])
+         + "</body></html>").encode("utf-8")
+        for i in range(args.pages)
+    ]
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(bodies, args.delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = WebCache(db_path=os.path.join(tmp, "web.sqlite3"))
+        search = StubSearch(f"http://127.0.0.1:{server.server_port}", args.pages, args.delay)
+        tool = WebSearchTool(search_backend=search, cache=cache, embeddings=NgramEmbeddings())
+        query = questions[0]["query"]
+        report = {}
+
+        counts = dict(COUNTS)
+        cold_ms, result = await timed(tool, query)
+        report["cold"] = {"ms": round(cold_ms, 1), **{k: COUNTS[k] - counts[k] for k in COUNTS}}
+
+        counts = dict(COUNTS)
+        warm = [await timed(tool, query) for _ in range(args.repeats)]
+        warm_ms = sorted(ms for ms, _ in warm)
+        report["warm"] = {
+            "p50_ms": round(warm_ms[len(warm_ms) // 2], 2),
+            "max_ms": round(warm_ms[-1], 2),
+            "same_result": all(r == result for _, r in warm),
+            **{k: COUNTS[k] - counts[k] for k in COUNTS},
+        }
+
+        # ページの期限切れ後はETagで再検証し、未更新なら本文を再取得しない
+        cache.page_ttl = 0
+        counts = dict(COUNTS)
+        revalidate_ms, _ = await timed(tool, query)
+        report["revalidated"] = {"ms": round(revalidate_ms, 1), **{k: COUNTS[k] - counts[k] for k in COUNTS}}
+        report["cache"] = cache.stats()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Web search / page cache benchmark")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--facts", type=int, default=60, help="facts in the synthetic page corpus")
+    parser.add_argument("--delay", type=float, default=0.3, help="simulated search / download latency in seconds")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    asyncio.run(main(parser.parse_args()))
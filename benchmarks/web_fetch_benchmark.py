@@ -0,0 +1,132 @@
+"""
+Wall time of fetching search result pages one after another (the previous WebBaseLoader
+behaviour) versus concurrently with modules.WebFetcher, against a local stub web server with
+fast, slow, stalled, Shift_JIS and oversized pages.
+
+    python benchmarks/web_fetch_benchmark.py
+    python benchmarks/web_fetch_benchmark.py --slow 3 --stall 30 --deadline 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from modules.WebFetcher import WebFetcher
+
+PARAGRAPH = "<p>東京都の人口は約1400万人で、日本の総人口の約11%を占めています。</p>\n"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # /page?delay=秒&stall=秒&size=段落数&charset=shift_jis
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        charset = params.get("charset", "utf-8")
+        body = (f"<html><head><meta charset=\"{charset}\"><title>stub {self.path}</title>"
+                f"<script>var x = 1;</script></head><body>"
+                + PARAGRAPH * int(params.get("size", "50")) + "</body></html>").encode(charset)
+        time.sleep(float(params.get("delay", "0")))
+        self.send_response(200)
+        # charsetはmetaタグのみで指定し、先頭部分からの判定を確認する
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        half = len(body) // 2
+        try:
+            self.wfile.write(body[:half])
+            self.wfile.flush()
+            # 途中で止まるページ（読み込みタイムアウトや締め切りの確認用）
+            time.sleep(float(params.get("stall", "0")))
+            self.wfile.write(body[half:])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def sequential(urls, read_timeout):
+    # 従来の動作：1件ずつ取得し、本文サイズにも合計時間にも上限がない
+    pages = 0
+    async with httpx.AsyncClient(timeout=httpx.Timeout(read_timeout)) as client:
+        for url in urls:
+            try:
+                response = await client.get(url)
+                pages += bool(response.text)
+            except httpx.HTTPError:
+                pass
+    return pages
+
+
+async def concurrent(urls, args):
+    async with httpx.AsyncClient() as client:
+        fetcher = WebFetcher(client, per_host_limit=args.per_host, read_timeout=args.read_timeout,
+                             max_bytes=args.max_bytes, deadline=args.deadline)
+        documents = await fetcher.fetch_all(urls)
+    return documents
+
+
+async def main(args):
+    server = start_server()
+    base = f"http://127.0.0.1:{server.server_port}/page"
+    urls = [
+        f"{base}?id=fast",
+        f"{base}?id=slow1&delay={args.slow}",
+        f"{base}?id=slow2&delay={args.slow}",
+        f"{base}?id=sjis&charset=shift_jis&delay={args.slow / 2}",
+        f"{base}?id=large&size=20000",
+        f"{base}?id=stalled&stall={args.stall}",
+    ]
+
+    start = time.perf_counter()
+    pages = await sequential(urls, args.stall + 5)
+    sequential_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    documents = await concurrent(urls, args)
+    concurrent_s = time.perf_counter() - start
+
+    report = {
+        "urls": len(urls),
+        "sequential": {"wall_s": round(sequential_s, 2), "pages": pages},
+        "concurrent": {
+            "wall_s": round(concurrent_s, 2),
+            "pages": len(documents),
+            "chars": {doc.metadata["source"].split("id=")[1].split("&")[0]: len(doc.page_content) for doc in documents},
+        },
+        "settings": {"deadline_s": args.deadline, "read_timeout_s": args.read_timeout,
+                     "max_bytes": args.max_bytes, "per_host": args.per_host},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequential vs concurrent web page fetching")
+    parser.add_argument("--slow", type=float, default=2.0, help="delay of the slow pages in seconds")
+    parser.add_argument("--stall", type=float, default=10.0, help="mid-body stall of one page in seconds")
+    parser.add_argument("--deadline", type=float, default=3.0)
+    parser.add_argument("--read-timeout", type=float, default=5.0)
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024)
+    # スタブサーバーは全ページが同一ホストのため、既定では上限を緩める
+    parser.add_argument("--per-host", type=int, default=8)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    asyncio.run(main(parser.parse_args()))
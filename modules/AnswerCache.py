@@ -0,0 +1,182 @@
+from langchain_core.embeddings import Embeddings
+from modules.TaskRouter import normalize_query
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import hashlib
+import logging
+import os
+import threading
+import time
+
+# 類似度の閾値・保持期間・件数上限（環境変数で調整）
+# 閾値が未設定の場合は完全一致（正規化後）のみ。番号や固有名詞だけが異なる質問（第3条と第4条など）を
+# 埋め込みが区別できることをbenchmarks/answer_cache_benchmark.pyで確認してから設定する
+ANSWER_CACHE_THRESHOLD: Optional[float] = float(os.environ["ANSWER_CACHE_THRESHOLD"]) if os.environ.get("ANSWER_CACHE_THRESHOLD") else None
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_WEB_TTL = float(os.environ.get("ANSWER_CACHE_WEB_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "2000"))
+
+NO_DOCUMENT = "no-doc"
+
+# 回答をキャッシュするタスク（通常会話は会話履歴に依存するため対象外）とその保持期間
+CACHED_TASKS: Dict[str, float] = {
+    "task2": ANSWER_CACHE_TTL,
+    "task3": ANSWER_CACHE_TTL,
+    "task4": ANSWER_CACHE_WEB_TTL,
+}
+
+# 各モジュールがエラー時に返す定型文（キャッシュしない）
+ERROR_MARKERS = ("エラーが発生しました", "見つかりませんでした", "失敗しました")
+
+class AnswerCache:
+    """
+    Semantic cache of final answers keyed by (task, document-set key, query embedding).
+    All cached query embeddings live in one preallocated float32 matrix, so a lookup is a
+    single matrix-vector product masked to the partition; an answer is served when the cosine
+    similarity reaches threshold. Identical (normalized) queries are answered without
+    embedding; with threshold None only those are served and nothing is embedded. Entries
+    expire after their task's TTL; when full, expired or least recently used slots are reused.
+    """
+    def __init__(self, embeddings: Optional[Embeddings] = None, threshold: Optional[float] = ANSWER_CACHE_THRESHOLD,
+                 max_entries: int = ANSWER_CACHE_SIZE, task_ttls: Optional[Dict[str, float]] = None):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.task_ttls = task_ttls or dict(CACHED_TASKS)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self.matrix: Optional[np.ndarray] = None
+        self.partitions = np.full(max_entries, -1, dtype=np.int64)
+        self.expires_at = np.zeros(max_entries, dtype=np.float64)
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+        self.answers: list = [None] * max_entries
+        self.queries: list = [None] * max_entries
+        self._exact: Dict[Tuple[int, str], int] = {}
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def enabled(self, task: str) -> bool:
+        return task in self.task_ttls
+
+    def _embeddings(self) -> Embeddings:
+        if self.embeddings is None:
+            from modules.Clients import get_clients
+            self.embeddings = get_clients().embeddings("nomic-embed-text")
+        return self.embeddings
+
+    async def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(await self._embeddings().aembed_query(query), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    @staticmethod
+    def _partition(task: str, documents_key: Optional[str]) -> int:
+        # タスクと文書集合のハッシュ（非負の63ビット）。対応表を持たないため、セッションや文書が増えてもメモリは増えない
+        digest = hashlib.blake2b(f"{task}\n{documents_key or NO_DOCUMENT}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") >> 1
+
+    def _exact_hit(self, partition: int, normalized: str, now: float) -> Optional[str]:
+        slot = self._exact.get((partition, normalized))
+        if slot is None or self.expires_at[slot] <= now:
+            return None
+        self.last_used[slot] = now
+        self.hits["exact"] += 1
+        return self.answers[slot]
+
+    async def lookup(self, task: str, documents_key: Optional[str], query: str) -> Optional[str]:
+        """
+        Returns a cached answer for a query equal or similar enough to a cached one, or None.
+        """
+        if not self.enabled(task):
+            return None
+        normalized = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            partition = self._partition(task, documents_key)
+            answer = self._exact_hit(partition, normalized, now)
+            if answer is not None or self.matrix is None or self.threshold is None:
+                if answer is None:
+                    self.misses += 1
+                return answer
+
+        try:
+            vector = await self._embed(query)
+        except Exception as e:
+            # 埋め込みに失敗してもキャッシュなしで回答できるようにする
+            self.logger.warning(f"Answer cache lookup failed: {str(e)}")
+            return None
+        with self._lock:
+            # 全エントリとの類似度を一括で計算し、同じタスク・文書集合の有効なエントリ以外を除外
+            # （行を抜き出すと行列のコピーが発生するため、マスクで除外する）
+            scores = self.matrix @ vector
+            scores[(self.partitions != partition) | (self.expires_at <= now)] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] >= self.threshold:
+                self.last_used[slot] = now
+                self.hits["semantic"] += 1
+                self.logger.info(f"Answer cache hit ({scores[slot]:.3f}) for {task}")
+                return self.answers[slot]
+            self.misses += 1
+        return None
+
+    def _free_slot(self, now: float) -> int:
+        # 空き・期限切れのスロットを優先し、なければ最後に使われたのが最も古いスロットを再利用
+        expired = np.flatnonzero(self.expires_at <= now)
+        slot = int(expired[0]) if expired.size else int(np.argmin(self.last_used))
+        if self.queries[slot] is not None:
+            self._exact.pop((int(self.partitions[slot]), self.queries[slot]), None)
+        return slot
+
+    async def store(self, task: str, documents_key: Optional[str], query: str, answer: str) -> None:
+        if not self.enabled(task) or not answer or any(marker in answer for marker in ERROR_MARKERS):
+            return
+        vector = None
+        if self.threshold is not None:
+            try:
+                vector = await self._embed(query)
+            except Exception as e:
+                self.logger.warning(f"Answer cache store failed: {str(e)}")
+                return
+        now = time.time()
+        with self._lock:
+            if self.matrix is None and vector is not None:
+                self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            partition = self._partition(task, documents_key)
+            normalized = normalize_query(query)
+            slot = self._exact.get((partition, normalized))
+            if slot is None:
+                slot = self._free_slot(now)
+            if self.matrix is not None:
+                # 埋め込みなしで保存する場合は、再利用したスロットの古いベクトルを消す
+                self.matrix[slot] = vector if vector is not None else 0.0
+            self.partitions[slot] = partition
+            self.expires_at[slot] = now + self.task_ttls[task]
+            self.last_used[slot] = now
+            self.answers[slot] = answer
+            self.queries[slot] = normalized
+            self._exact[(partition, normalized)] = slot
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            entries = int(np.count_nonzero(self.expires_at > now))
+        lookups = self.hits["exact"] + self.hits["semantic"] + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+        }
+
+
+_shared_cache: Optional[AnswerCache] = None
+_shared_lock = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = AnswerCache()
+        return _shared_cache
@@ -0,0 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+import asyncio
+import contextvars
+import os
+
+# 同期APIの呼び出しを逃がすための上限付きスレッドプール
+BLOCKING_POOL_SIZE = int(os.environ.get("BLOCKING_POOL_SIZE", "16"))
+_blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs a synchronous callable on the shared bounded thread pool without blocking the event loop.
+    Context variables (session, request trace) are visible to the callable.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_blocking_pool, partial(context.run, func, *args, **kwargs))
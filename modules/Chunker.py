@@ -0,0 +1,170 @@
+from langchain_core.documents import Document
+from modules.Cache import LRUCache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import hashlib
+import json
+import re
+import threading
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count: one token per non-ASCII character, four ASCII characters per token.
+    """
+    ascii_chars = len(re.findall(r"[\x00-\x7f]", text))
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+def truncate_tokens(text: str, max_tokens: int, length_function: Callable[[str], int] = estimate_tokens) -> str:
+    if length_function(text) <= max_tokens:
+        return text
+    # トークン数が上限に収まる位置まで切り詰める
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if length_function(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+# 文末（句点・感嘆符・疑問符と、直後の閉じ括弧）と改行で区切る
+# 英文のピリオドは小数点や略語と区別するため、直後に空白がある場合のみ区切る
+SENTENCE_BOUNDARY = re.compile(
+    r"(?<=[。！？!?．])(?![」』）)\]】])|(?<=[。！？!?．][」』）)\]】])"
+    r"|(?<=\.)(?=\s)|(?<=\.[\"')\]])(?=\s)|(\n+)"
+)
+# 長すぎる文は読点で区切る
+CLAUSE_BOUNDARY = re.compile(r"(?<=[、，,])")
+
+# タスクごとのチャンクサイズ（推定トークン数）
+TASK_CHUNK_SETTINGS: Dict[str, Dict[str, int]] = {
+    "qa": {"chunk_tokens": 400, "overlap_tokens": 50},
+    "contextual": {"chunk_tokens": 400, "overlap_tokens": 50},
+    "summarize": {"chunk_tokens": 1000, "overlap_tokens": 0},
+    "web": {"chunk_tokens": 400, "overlap_tokens": 50},
+}
+
+
+class JapaneseChunker:
+    """
+    Splits text on sentence boundaries (。！？, or ". " in English) and packs whole sentences into
+    chunks of at most chunk_tokens, carrying trailing sentences up to overlap_tokens into the next
+    chunk.
+    Pass a tokenizer's counting function as length_function to size chunks by model tokens.
+    """
+    def __init__(self, chunk_tokens: int = 400, overlap_tokens: int = 50,
+                 length_function: Callable[[str], int] = estimate_tokens,
+                 cache: Optional[LRUCache] = None):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.length_function = length_function
+        self.cache = cache if cache is not None else LRUCache(max_size=256)
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "splitter": "JapaneseChunker",
+            "chunk_tokens": self.chunk_tokens,
+            "overlap_tokens": self.overlap_tokens,
+            "length_function": getattr(self.length_function, "__name__", "custom"),
+        }
+
+    def _pieces(self, text: str) -> List[Tuple[str, str]]:
+        """
+        Returns (separator, piece) pairs; separator is the space to put before the piece when it
+        follows the previous one in a chunk.
+        """
+        pieces: List[Tuple[str, str]] = []
+
+        def add(piece: str, spaced: bool) -> None:
+            # 元の文章で空白・改行を挟み、前後がともにASCII文字の場合のみ空白で区切る（英単語の連結を防ぐ）
+            previous = pieces[-1][1] if pieces else ""
+            separator = " " if spaced and previous[-1:].isascii() and piece[:1].isascii() else ""
+            pieces.append((separator, piece))
+
+        spaced = False
+        for sentence in SENTENCE_BOUNDARY.split(text):
+            if not sentence:
+                continue
+            if sentence.startswith("\n"):
+                spaced = True
+                continue
+            stripped = sentence.strip()
+            if not stripped:
+                spaced = True
+                continue
+            spaced = spaced or stripped[0] != sentence[0]
+            if self.length_function(stripped) <= self.chunk_tokens:
+                add(stripped, spaced)
+                spaced = False
+                continue
+            # 一文がチャンクに収まらない場合は読点、それでも長ければトークン数で切る
+            for clause in CLAUSE_BOUNDARY.split(stripped):
+                spaced = spaced or clause[:1].isspace()
+                clause = clause.lstrip()
+                while clause:
+                    head = truncate_tokens(clause, self.chunk_tokens, self.length_function)
+                    if not head:
+                        head = clause[:1]
+                    add(head, spaced)
+                    spaced = False
+                    clause = clause[len(head):]
+        return pieces
+
+    def split_text(self, text: str) -> List[str]:
+        chunks: List[str] = []
+        current: List[Tuple[str, str]] = []
+        lengths: List[int] = []
+
+        def join(pieces: List[Tuple[str, str]]) -> str:
+            # チャンク先頭の区切りは付けない
+            return "".join(separator + piece if i else piece for i, (separator, piece) in enumerate(pieces))
+
+        for separator, piece in self._pieces(text):
+            length = self.length_function(separator + piece)
+            if current and sum(lengths) + length > self.chunk_tokens:
+                chunks.append(join(current))
+                # 末尾の文をオーバーラップとして次のチャンクに引き継ぐ
+                carried, carried_lengths = [], []
+                for sentence, sentence_length in zip(reversed(current), reversed(lengths)):
+                    if sum(carried_lengths) + sentence_length > self.overlap_tokens:
+                        break
+                    carried.insert(0, sentence)
+                    carried_lengths.insert(0, sentence_length)
+                while carried and sum(carried_lengths) + length > self.chunk_tokens:
+                    carried.pop(0)
+                    carried_lengths.pop(0)
+                current, lengths = carried, carried_lengths
+            current.append((separator, piece))
+            lengths.append(length)
+
+        if current:
+            chunks.append(join(current))
+        return chunks
+
+    def split_cached(self, text: str) -> List[str]:
+        """
+        split_text with results cached per document hash and chunker settings.
+        """
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest() + json.dumps(self.settings(), sort_keys=True)
+        chunks = self.cache.get(key)
+        if chunks is None:
+            chunks = self.split_text(text)
+            self.cache.put(key, chunks)
+        return chunks
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        return [
+            Document(page_content=chunk, metadata=dict(document.metadata))
+            for document in documents
+            for chunk in self.split_cached(document.page_content)
+        ]
+
+
+# タスクごとに共有するチャンカー（分割結果のキャッシュも共有される）
+_chunkers: Dict[str, JapaneseChunker] = {}
+_chunkers_lock = threading.Lock()
+
+def get_chunker(task: str = "qa") -> JapaneseChunker:
+    with _chunkers_lock:
+        if task not in _chunkers:
+            _chunkers[task] = JapaneseChunker(**TASK_CHUNK_SETTINGS[task])
+        return _chunkers[task]
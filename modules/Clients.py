@@ -0,0 +1,201 @@
+from langchain_ollama import ChatOllama
+from langchain_community.utilities.duckduckgo_search import DuckDuckGoSearchAPIWrapper
+from openai import OpenAI, AsyncOpenAI
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from modules.EmbeddingCache import CachedEmbeddings, get_embeddings
+from modules.WebFetcher import WebFetcher
+from modules.Scheduler import INTERACTIVE, LLMScheduler
+from modules.Metrics import LLM_CALL_SECONDS, LLM_QUEUE_SECONDS, TokenUsageHandler, observe_stage
+from fake_useragent import UserAgent
+import instructor
+import httpx
+import logging
+import os
+import threading
+import time
+
+# Ollama（またはOpenAI互換の代替サーバー）の接続先
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+# モデルのコンテキスト長。同じモデルでnum_ctxが変わるとOllamaはモデルを読み込み直すため、全呼び出しで共通にする
+# （OpenAI互換APIの呼び出しはModelfileの値で動くため、ModelfileのPARAMETER num_ctxと同じ値にする）
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+
+class ClientRegistry:
+    """
+    Application-scoped registry of long-lived model and search clients.
+    Clients share keep-alive HTTP connection pools and are reused across requests.
+    """
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, api_key: str = "ollama",
+                 max_connections: int = 32, max_keepalive_connections: int = 16,
+                 timeout: float = 300.0, model_limits: Optional[Dict[str, int]] = None,
+                 default_model_limit: int = 4, search_backend: Any = None, num_ctx: int = OLLAMA_NUM_CTX):
+        self.base_url = base_url
+        self.num_ctx = num_ctx
+        self.api_key = api_key
+        self.timeout = timeout
+        self.model_limits = model_limits or {}
+        self.default_model_limit = default_model_limit
+        self.logger = logging.getLogger(__name__)
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.http_client = httpx.Client(limits=self.limits, timeout=timeout)
+        self.async_http_client = httpx.AsyncClient(limits=self.limits, timeout=timeout)
+
+        self._lock = threading.Lock()
+        self._chat_models: Dict[Any, ChatOllama] = {}
+        # モデルへの呼び出しはすべてスケジューラーを通して同時実行数と順番を制御する
+        self.scheduler = LLMScheduler(self.model_limits, default_model_limit)
+        self._openai: Optional[OpenAI] = None
+        self._async_openai: Optional[AsyncOpenAI] = None
+        self._instructor = None
+        self._async_instructor = None
+        # search_backendを渡すとDuckDuckGoの代わりに使う（results(query, max_results)を持つオブジェクト）
+        self._search_wrapper = search_backend
+        self._web_client: Optional[httpx.AsyncClient] = None
+        self._web_fetcher: Optional[WebFetcher] = None
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        return {"limits": self.limits, "timeout": self.timeout}
+
+    def chat(self, model: str = "elyza:jp8b", **kwargs) -> ChatOllama:
+        if kwargs.setdefault("num_ctx", self.num_ctx) != self.num_ctx:
+            raise ValueError(f"num_ctx must be {self.num_ctx} for every caller (set OLLAMA_NUM_CTX)")
+        key = (model, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self._chat_models:
+                self._chat_models[key] = ChatOllama(
+                    model=model,
+                    base_url=self.base_url,
+                    client_kwargs=self._client_kwargs(),
+                    # 呼び出しごとの入出力トークン数を/metricsに記録
+                    callbacks=[TokenUsageHandler(model)],
+                    **kwargs
+                )
+            return self._chat_models[key]
+
+    def embeddings(self, model: str = "nomic-embed-text") -> CachedEmbeddings:
+        return get_embeddings(model, base_url=self.base_url, client_kwargs=self._client_kwargs())
+
+    def openai_client(self) -> OpenAI:
+        with self._lock:
+            if self._openai is None:
+                self._openai = OpenAI(
+                    base_url=f"{self.base_url}/v1",
+                    api_key=self.api_key,
+                    http_client=self.http_client,
+                )
+            return self._openai
+
+    def async_openai_client(self) -> AsyncOpenAI:
+        with self._lock:
+            if self._async_openai is None:
+                self._async_openai = AsyncOpenAI(
+                    base_url=f"{self.base_url}/v1",
+                    api_key=self.api_key,
+                    http_client=self.async_http_client,
+                )
+            return self._async_openai
+
+    def instructor_client(self):
+        if self._instructor is None:
+            self._instructor = instructor.from_openai(self.openai_client(), mode=instructor.Mode.JSON)
+        return self._instructor
+
+    def async_instructor_client(self):
+        if self._async_instructor is None:
+            self._async_instructor = instructor.from_openai(self.async_openai_client(), mode=instructor.Mode.JSON)
+        return self._async_instructor
+
+    def search_wrapper(self) -> DuckDuckGoSearchAPIWrapper:
+        with self._lock:
+            if self._search_wrapper is None:
+                self._search_wrapper = DuckDuckGoSearchAPIWrapper(
+                    backend='api',
+                    max_results=5,
+                    region='jp-jp',
+                    safesearch='moderate',
+                    source='text',
+                    time='y'
+                )
+            return self._search_wrapper
+
+    def web_fetcher(self) -> WebFetcher:
+        # 外部サイト用のプールはOllama用とは分け、タイムアウトもページ取得向けに短くする
+        with self._lock:
+            if self._web_fetcher is None:
+                self._web_client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+                    headers={"User-Agent": UserAgent().chrome},
+                )
+                self._web_fetcher = WebFetcher(self._web_client)
+            return self._web_fetcher
+
+    @asynccontextmanager
+    async def limit(self, model: str, priority: str = INTERACTIVE, session_id: Optional[str] = None):
+        """
+        Holds one of the model's concurrency slots for the duration of the block, scheduled by
+        priority class and session (see LLMScheduler). Raises SchedulerBusy when not admitted.
+        """
+        start = time.perf_counter()
+        async with self.scheduler.slot(model, priority, session_id):
+            acquired = time.perf_counter()
+            LLM_QUEUE_SECONDS.observe(acquired - start, model=model, priority=priority)
+            observe_stage("llm_wait", acquired - start)
+            try:
+                yield
+            finally:
+                LLM_CALL_SECONDS.observe(time.perf_counter() - acquired, model=model, priority=priority)
+                observe_stage("llm", time.perf_counter() - acquired)
+
+    async def health_check(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            response = await self.async_http_client.get(f"{self.base_url}/api/tags", timeout=5.0)
+            response.raise_for_status()
+            models = [m.get("name") for m in response.json().get("models", [])]
+            status = "ok"
+        except Exception as e:
+            self.logger.error(f"Ollama health check failed: {str(e)}")
+            models = []
+            status = "unavailable"
+        return {
+            "status": status,
+            "ollama": self.base_url,
+            "models": models,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    async def aclose(self) -> None:
+        await self.async_http_client.aclose()
+        if self._web_client is not None:
+            await self._web_client.aclose()
+        self.http_client.close()
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+def init_clients(**kwargs) -> ClientRegistry:
+    global _registry
+    with _registry_lock:
+        _registry = ClientRegistry(**kwargs)
+        return _registry
+
+def get_clients() -> ClientRegistry:
+    # 起動処理を経ずに使われた場合（スクリプトなど）は既定設定で作成
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
+
+async def close_clients() -> None:
+    global _registry
+    with _registry_lock:
+        registry, _registry = _registry, None
+    if registry is not None:
+        await registry.aclose()
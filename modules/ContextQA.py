@@ -1,19 +1,39 @@
-from langchain_ollama import ChatOllama
 from langchain.schema.output_parser import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough
-from langchain_ollama import OllamaEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
+from modules.IndexStore import IndexStore
+from modules.Clients import ClientRegistry, get_clients
+from modules.VectorStore import DEFAULT_INDEX_SETTINGS, IndexSettings, apply_search_settings, build_faiss, abuild_faiss
+from modules.AsyncUtils import run_blocking
+from modules.Chunker import get_chunker
+from modules.LexicalIndex import HybridRetriever, LexicalIndex
+from modules.Metrics import stage, timed_runnable
+from typing import Callable, Optional
+
+# プロセス内で共有するインデックスキャッシュ
+index_store = IndexStore()
 
 class ContextQA:
-    def __init__(self, temp_file_path):
+    def __init__(self, temp_file_path, index_store: IndexStore = index_store, doc_loader=None,
+                 clients: ClientRegistry = None, index_settings: IndexSettings = DEFAULT_INDEX_SETTINGS):
         self.temp_file_path = temp_file_path
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=20)
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        self.llm = ChatOllama(model="elyza:jp8b", temperature=0)
+        self.doc_loader = doc_loader
+        self.clients = clients or get_clients()
+        self.embedding_model = "nomic-embed-text"
+        self.text_splitter = get_chunker("qa")
+        self.embeddings = self.clients.embeddings(self.embedding_model)
+        self.index_store = index_store
+        # 件数に応じてFlat/HNSW/IVF-PQを切り替える設定
+        self.index_settings = index_settings
+        self.model_name = "elyza:jp8b"
+        self.llm = self.clients.chat(self.model_name, temperature=0)
+        # ベクトル検索と文字n-gramのBM25検索を順位融合する
+        self.hybrid = True
         self.chain = None
+        # セッションの作業領域でメモリ使用量を見積もるために保持
+        self.db = None
+        self.chunks = None
 
     def load_context(self):
         with open(self.temp_file_path, 'r', encoding='utf-8') as f:
@@ -21,23 +41,102 @@ class ContextQA:
         documents = [Document(page_content=document_content)]
         return documents
 
-    def setup_qa_chain(self):
-        if self.chain is None:
-            documents = self.load_context()
-            texts = self.text_splitter.split_documents(documents)
-            db = FAISS.from_documents(texts, self.embeddings)
+    def splitter_settings(self):
+        return self.text_splitter.settings()
+
+    def load_chunks(self):
+        # ファイル単位のチャンクキャッシュがあれば再分割しない
+        if self.doc_loader is not None:
+            settings_key = IndexStore.make_key("", self.splitter_settings())
+            chunks = self.doc_loader.get_chunks(self.text_splitter, settings_key)
+            if chunks:
+                return chunks
+        return self.text_splitter.split_documents(self.load_context())
+
+    def index_key(self, chunks):
+        settings = dict(
+            self.splitter_settings(),
+            embedding_model=self.embedding_model,
+            # 検索時のパラメータは読み込み後に適用するためキーに含めない
+            index=self.index_settings.model_dump(exclude={"hnsw_ef_search", "ivf_nprobe"}),
+        )
+        return IndexStore.make_key("\n".join(chunk.page_content for chunk in chunks), settings)
+
+    def build_vector_store(self, chunks, key=None):
+        # 同じ文書・設定のインデックスがあれば埋め込みを省略
+        key = key or self.index_key(chunks)
+        db = self.index_store.load(key, self.embeddings)
+        if db is None:
+            db = build_faiss(chunks, self.embeddings, self.index_settings)
+            self.index_store.save(key, db)
+        apply_search_settings(db.index, self.index_settings)
+        return db
+
+    async def abuild_vector_store(self, chunks, key=None):
+        key = key or await run_blocking(self.index_key, chunks)
+        db = await run_blocking(self.index_store.load, key, self.embeddings)
+        if db is None:
+            db = await abuild_faiss(chunks, self.embeddings, self.index_settings)
+            await run_blocking(self.index_store.save, key, db)
+        apply_search_settings(db.index, self.index_settings)
+        return db
+
+    def build_lexical_index(self, chunks, key=None):
+        # 語彙索引は埋め込み不要で軽量なため、キャッシュになければその場で作成して保存
+        key = key or self.index_key(chunks)
+        lexical = self.index_store.load_lexical(key)
+        if lexical is None:
+            lexical = LexicalIndex.build([chunk.page_content for chunk in chunks])
+            self.index_store.save_lexical(key, lexical)
+        return lexical
+
+    def _make_chain(self, db, chunks=None, lexical=None):
+        if lexical is not None:
+            retriever = HybridRetriever(vectorstore=db, lexical=lexical, documents=chunks, k=3)
+        else:
             retriever = db.as_retriever(search_kwargs={"k": 3})
+        # 検索（クエリの埋め込みとベクトル・BM25検索）の時間を生成とは分けて計測する
+        retriever = timed_runnable("retrieve", retriever)
+
+        prompt = PromptTemplate.from_template(
+            "質問: {user_query}\n\n背景情報:\n{context}\n\n回答:"
+        )
 
-            prompt = PromptTemplate.from_template(
-                "質問: {user_query}\n\n背景情報:\n{context}\n\n回答:"
-            )
+        return (
+            {"context": retriever, "user_query": RunnablePassthrough()}
+            | prompt
+            | self.llm
+            | StrOutputParser()
+        )
+
+    def setup_qa_chain(self):
+        if self.chain is None:
+            with stage("index"):
+                chunks = self.load_chunks()
+                key = self.index_key(chunks)
+                db = self.build_vector_store(chunks, key)
+                lexical = self.build_lexical_index(chunks, key) if self.hybrid else None
+            self.db, self.chunks = db, chunks
+            self.chain = self._make_chain(db, chunks, lexical)
+        return self.chain
 
-            self.chain = (
-                {"context": retriever, "user_query": RunnablePassthrough()}
-                | prompt
-                | self.llm
-                | StrOutputParser()
-            )
+    async def asetup_qa_chain(self, progress: Optional[Callable[[str], None]] = None):
+        # ファイルI/Oとインデックス読み込みはスレッドプールへ、埋め込みは非同期で実行
+        # progressには段階名（chunking/embedding/indexing）が渡される（アップロード時の事前構築用）
+        if self.chain is None:
+            with stage("index"):
+                if progress:
+                    progress("chunking")
+                chunks = await run_blocking(self.load_chunks)
+                key = await run_blocking(self.index_key, chunks)
+                if progress:
+                    progress("embedding")
+                db = await self.abuild_vector_store(chunks, key)
+                if progress:
+                    progress("indexing")
+                lexical = await run_blocking(self.build_lexical_index, chunks, key) if self.hybrid else None
+            self.db, self.chunks = db, chunks
+            self.chain = self._make_chain(db, chunks, lexical)
         return self.chain
 
     def get_answer(self, user_query):
@@ -45,3 +144,13 @@ class ContextQA:
         answer = chain.invoke(input=user_query)
         return answer
 
+    async def aget_answer(self, user_query):
+        chain = await self.asetup_qa_chain()
+        async with self.clients.limit(self.model_name):
+            return await chain.ainvoke(user_query)
+
+    async def astream_answer(self, user_query):
+        chain = await self.asetup_qa_chain()
+        async with self.clients.limit(self.model_name):
+            async for chunk in chain.astream(user_query):
+                yield chunk
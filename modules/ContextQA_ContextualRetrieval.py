@@ -1,19 +1,47 @@
-from langchain_ollama import ChatOllama
 from langchain.schema.output_parser import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough
-from langchain_ollama import OllamaEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
+from typing import Callable, Dict, List, Optional, Tuple
+from modules.Clients import ClientRegistry, get_clients
+from modules.Scheduler import BATCH
+from modules.VectorStore import build_faiss, abuild_faiss
+from modules.AsyncUtils import run_blocking
+from modules.Chunker import JapaneseChunker, get_chunker
+from modules.ContextStore import ContextStore, get_context_store
+from modules.Metrics import stage, timed_runnable
+import asyncio
+import hashlib
+import logging
 
 class ContextQA:
-    def __init__(self, temp_file_path):
+    def __init__(self, temp_file_path, doc_loader=None, clients: ClientRegistry = None,
+                 context_store: ContextStore = None, max_concurrency: int = 4, context_tokens: Optional[int] = None):
+        # doc_loaderはContextQA.pyとの差し替え互換のために受け付ける
         self.temp_file_path = temp_file_path
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=20)
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        self.llm = ChatOllama(model="elyza:jp8b", temperature=0)
+        self.doc_loader = doc_loader
+        self.clients = clients or get_clients()
+        self.text_splitter = get_chunker("contextual")
+        self.embeddings = self.clients.embeddings("nomic-embed-text")
+        self.model_name = "elyza:jp8b"
+        self.llm = self.clients.chat(self.model_name, temperature=0)
         self.chain = None
+        self.logger = logging.getLogger(__name__)
+
+        # 文脈生成は文書のセクションをプロンプトに含めるため、モデル共通のコンテキスト長（OLLAMA_NUM_CTX）に合わせて分割する
+        # （num_ctxを変えた専用のモデルを使うと、通常の呼び出しと交互になるたびにOllamaがモデルを読み込み直す）
+        self.context_tokens = min(context_tokens or self.clients.num_ctx, self.clients.num_ctx)
+        self.context_chain = self.llm | StrOutputParser()
+        self.max_concurrency = max_concurrency
+        self.context_store = context_store or get_context_store()
+        # 長い文書はコンテキスト長に収まるセクションに分け、セクション内のチャンクで同じ接頭辞を共有する
+        self.section_splitter = JapaneseChunker(
+            chunk_tokens=self.context_tokens - self.text_splitter.chunk_tokens - 512,
+            overlap_tokens=0,
+        )
+        self.context_version = hashlib.sha256(
+            f"{self.model_name}\n{self.context_tokens}\n{self._contextualize_prompt('', '')}".encode("utf-8")
+        ).hexdigest()[:16]
 
     def load_context(self):
         with open(self.temp_file_path, 'r', encoding='utf-8') as f:
@@ -21,41 +49,132 @@ class ContextQA:
         documents = [Document(page_content=document_content)]
         return documents
 
+    def _contextualize_prompt(self, document, chunk):
+        # 文書部分をプロンプトの先頭に置き、同じ文書のチャンク間でOllamaのプロンプトキャッシュを効かせる
+        return f"""
+        <document>
+        {document}
+        </document>
+        ドキュメント全体の中に配置したいチャンクは次のとおりです。
+        <chunk>
+        {chunk}
+        </chunk>
+        このチャンクを文書全体の中に位置づけるための簡潔なコンテキストを記述してください。
+        """
+
+    def _make_chain(self, db):
+        retriever = timed_runnable("retrieve", db.as_retriever(search_kwargs={"k": 3}))
+
+        prompt = PromptTemplate.from_template(
+            "質問: {user_query}\n\n背景情報:\n{context}\n\n回答:"
+        )
+
+        return (
+            {"context": retriever, "user_query": RunnablePassthrough()}
+            | prompt
+            | self.llm
+            | StrOutputParser()
+        )
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _plan(self, text: str) -> Tuple[List[Tuple[str, str, str, str]], Dict[str, Dict[str, str]]]:
+        """
+        Splits the document into (doc_hash, chunk_hash, section, chunk) items and loads stored contexts.
+        """
+        plan = []
+        contexts = {}
+        for section in self.section_splitter.split_cached(text):
+            doc_hash = self._hash(section)
+            contexts[doc_hash] = self.context_store.get_document(self.context_version, doc_hash)
+            for chunk in self.text_splitter.split_cached(section):
+                plan.append((doc_hash, self._hash(chunk), section, chunk))
+        return plan, contexts
+
+    @staticmethod
+    def _missing(plan, contexts):
+        missing, seen = [], set()
+        for doc_hash, chunk_hash, section, chunk in plan:
+            if chunk_hash not in contexts[doc_hash] and (doc_hash, chunk_hash) not in seen:
+                seen.add((doc_hash, chunk_hash))
+                missing.append((doc_hash, chunk_hash, section, chunk))
+        return missing
+
+    def _store(self, generated: Dict[Tuple[str, str], str], contexts) -> None:
+        by_document: Dict[str, Dict[str, str]] = {}
+        for (doc_hash, chunk_hash), context in generated.items():
+            by_document.setdefault(doc_hash, {})[chunk_hash] = context
+            contexts[doc_hash][chunk_hash] = context
+        for doc_hash, items in by_document.items():
+            self.context_store.put_many(self.context_version, doc_hash, items)
+
+    @staticmethod
+    def _documents(plan, contexts) -> List[Document]:
+        return [
+            Document(page_content=f"{contexts[doc_hash][chunk_hash]}\n{chunk}")
+            for doc_hash, chunk_hash, _, chunk in plan
+        ]
+
+    def contextualize(self, text: str) -> List[Document]:
+        plan, contexts = self._plan(text)
+        missing = self._missing(plan, contexts)
+        if missing:
+            self.logger.info(f"Generating contexts for {len(missing)} of {len(plan)} chunks")
+            # セクション順に並べたまま並列に生成し、接頭辞が共通のリクエストを続けて送る
+            results = self.context_chain.batch(
+                [self._contextualize_prompt(section, chunk) for _, _, section, chunk in missing],
+                config={"max_concurrency": self.max_concurrency},
+            )
+            self._store({(d, c): result for (d, c, _, _), result in zip(missing, results)}, contexts)
+        return self._documents(plan, contexts)
+
+    async def acontextualize(self, text: str) -> List[Document]:
+        plan, contexts = await run_blocking(self._plan, text)
+        missing = self._missing(plan, contexts)
+        if missing:
+            self.logger.info(f"Generating contexts for {len(missing)} of {len(plan)} chunks")
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            generated: Dict[Tuple[str, str], str] = {}
+
+            async def worker(doc_hash, chunk_hash, section, chunk):
+                async with semaphore, self.clients.limit(self.model_name, priority=BATCH):
+                    generated[(doc_hash, chunk_hash)] = await self.context_chain.ainvoke(
+                        self._contextualize_prompt(section, chunk)
+                    )
+
+            try:
+                await asyncio.gather(*(worker(*item) for item in missing))
+            finally:
+                # 途中で失敗しても生成済みの文脈は保存して次回に使う
+                await run_blocking(self._store, generated, contexts)
+        return self._documents(plan, contexts)
+
     def setup_qa_chain(self):
         if self.chain is None:
-            documents = self.load_context()
-            
-            # チャンクに分割
-            chunks = self.text_splitter.split_text(documents[0].page_content)
-            
-            # 各チャンクに対して文脈情報を生成
-            contextualized_chunks = []
-            for chunk in chunks:
-                context = self.llm.invoke(f"""
-                <document>
-                ドキュメント全体の内容
-                </document>
-                ドキュメント全体の中に配置したいチャンクは次のとおりです。
-                <chunk>
-                {chunk}
-                </chunk>
-                このチャンクを文書全体の中に位置づけるための簡潔なコンテキストを記述してください。
-                """)
-                contextualized_chunks.append(Document(page_content=f"{context} {chunk}"))
-
-            db = FAISS.from_documents(contextualized_chunks, self.embeddings)
-            retriever = db.as_retriever(search_kwargs={"k": 3})
-
-            prompt = PromptTemplate.from_template(
-                "質問: {user_query}\n\n背景情報:\n{context}\n\n回答:"
-            )
+            with stage("index"):
+                documents = self.load_context()
 
-            self.chain = (
-                {"context": retriever, "user_query": RunnablePassthrough()}
-                | prompt
-                | self.llm
-                | StrOutputParser()
-            )
+                # チャンクに分割し、各チャンクに文書内での位置づけを付与（保存済みの文脈は再利用）
+                contextualized_chunks = self.contextualize(documents[0].page_content)
+
+                db = build_faiss(contextualized_chunks, self.embeddings)
+            self.chain = self._make_chain(db)
+        return self.chain
+
+    async def asetup_qa_chain(self, progress: Optional[Callable[[str], None]] = None):
+        if self.chain is None:
+            with stage("index"):
+                if progress:
+                    progress("chunking")
+                documents = await run_blocking(self.load_context)
+                contextualized_chunks = await self.acontextualize(documents[0].page_content)
+
+                if progress:
+                    progress("embedding")
+                db = await abuild_faiss(contextualized_chunks, self.embeddings)
+            self.chain = self._make_chain(db)
         return self.chain
 
     def get_answer(self, user_query):
@@ -63,3 +182,13 @@ class ContextQA:
         answer = chain.invoke(input=user_query)  
         return answer
 
+    async def aget_answer(self, user_query):
+        chain = await self.asetup_qa_chain()
+        async with self.clients.limit(self.model_name):
+            return await chain.ainvoke(user_query)
+
+    async def astream_answer(self, user_query):
+        chain = await self.asetup_qa_chain()
+        async with self.clients.limit(self.model_name):
+            async for chunk in chain.astream(user_query):
+                yield chunk
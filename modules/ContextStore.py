@@ -0,0 +1,63 @@
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+import sqlite3
+import threading
+
+class ContextStore:
+    """
+    SQLite-backed store of generated chunk contexts keyed by (version, doc hash, chunk hash).
+    version identifies the model and prompt that produced the context.
+    """
+    def __init__(self, db_path: str = ".cache/contexts.sqlite3"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS contexts (
+                version TEXT NOT NULL,
+                doc_hash TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                context TEXT NOT NULL,
+                PRIMARY KEY (version, doc_hash, chunk_hash)
+            )
+        """)
+        self._conn.commit()
+
+    def get_document(self, version: str, doc_hash: str) -> Dict[str, str]:
+        """
+        Returns {chunk_hash: context} for every stored chunk of the document.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_hash, context FROM contexts WHERE version = ? AND doc_hash = ?",
+                (version, doc_hash),
+            ).fetchall()
+        return dict(rows)
+
+    def put_many(self, version: str, doc_hash: str, contexts: Dict[str, str]) -> None:
+        if not contexts:
+            return
+        rows = [(version, doc_hash, chunk_hash, context) for chunk_hash, context in contexts.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO contexts (version, doc_hash, chunk_hash, context) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+
+_shared_store: Optional[ContextStore] = None
+_shared_lock = threading.Lock()
+
+def get_context_store() -> ContextStore:
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = ContextStore()
+        return _shared_store
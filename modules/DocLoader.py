@@ -3,25 +3,95 @@ from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.document_loaders import CSVLoader
 from langchain_community.document_loaders import TextLoader
 from langchain_community.document_loaders import Docx2txtLoader
+from langchain.schema import Document
+from modules.IngestManifest import IngestManifest, get_manifest
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
 import os
+import time
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import threading
+from typing import List, Dict, Optional, Tuple
+
+# ProcessPoolExecutorのワーカーから参照するため、ローダーと解析関数はモジュールレベルに定義
+LOADERS = {
+    '.pdf': PyPDFLoader,
+    '.csv': CSVLoader,
+    '.txt': TextLoader,
+    '.docx': Docx2txtLoader,
+}
+
+def normalize_documents(documents: List) -> str:
+    # 各ドキュメントのテキストを処理して余計な改行を削除
+    return ' '.join(' '.join(doc.page_content.split()) for doc in documents)
+
+def parse_file(file_path: str) -> Tuple[str, float]:
+    start = time.perf_counter()
+    _, ext = os.path.splitext(file_path)
+    documents = LOADERS[ext.lower()](file_path).load()
+    return normalize_documents(documents), time.perf_counter() - start
+
+def parse_pdf_pages(file_path: str, first_page: int, last_page: int) -> Tuple[str, float]:
+    from pypdf import PdfReader
+
+    start = time.perf_counter()
+    reader = PdfReader(file_path)
+    texts = [' '.join((reader.pages[i].extract_text() or '').split()) for i in range(first_page, last_page)]
+    return ' '.join(texts), time.perf_counter() - start
+
+def count_pdf_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_workers: Optional[int] = None
+_process_pool_lock = threading.Lock()
+
+def _process_context():
+    # スレッドやSQLiteの接続を持つサーバープロセスからforkすると子プロセスがデッドロックし得るため、
+    # forkserver（使えない環境ではspawn）で起動する
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+def _get_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    # プロセスの起動コストを避けるため、プールはプロセス内で使い回す
+    # 呼び出し側は_process_pool_lockを保持すること（作り直しと投入が競合しないように）
+    global _process_pool, _process_pool_workers
+    if _process_pool is None or _process_pool_workers != max_workers:
+        if _process_pool is not None:
+            # 投入済みのタスクは古いプールで最後まで実行される
+            _process_pool.shutdown(wait=False)
+        _process_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=_process_context())
+        _process_pool_workers = max_workers
+    return _process_pool
+
+def submit_tasks(tasks: List[Tuple], max_workers: Optional[int] = None) -> List[Future]:
+    """
+    Submits (function, *args) tasks to the shared process pool.
+    """
+    with _process_pool_lock:
+        pool = _get_process_pool(max_workers)
+        return [pool.submit(*task) for task in tasks]
 
 class DocumentLoader:
-    def __init__(self, directory_path: str = "uploads", debug: bool = False):
+    def __init__(self, directory_path: str = "uploads", debug: bool = False,
+                 manifest: Optional[IngestManifest] = None, parallel: bool = True,
+                 max_workers: Optional[int] = None, pdf_pages_per_task: int = 20):
         self.directory_path = directory_path
         self.temp_file_path = os.path.join(directory_path, "temp_combined.txt")
         self.debug = debug
+        self.manifest = manifest or get_manifest()
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.pdf_pages_per_task = pdf_pages_per_task
+        self.timings: Dict[str, float] = {}
         
         logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
         self.logger = logging.getLogger(__name__)
         
-        self.loaders = {
-            '.pdf': PyPDFLoader,
-            '.csv': CSVLoader,
-            '.txt': TextLoader,
-            '.docx': Docx2txtLoader,
-        }
+        self.loaders = LOADERS
 
     def get_files_by_type(self) -> Dict[str, List[str]]:
         files_by_type = {ext: [] for ext in self.loaders.keys()}
@@ -29,8 +99,11 @@ class DocumentLoader:
         for root, _, files in os.walk(self.directory_path):
             for file in files:
                 _, ext = os.path.splitext(file)
+                full_path = os.path.join(root, file)
+                # 自身が出力する結合ファイルは読み込み対象外
+                if os.path.abspath(full_path) == os.path.abspath(self.temp_file_path):
+                    continue
                 if ext.lower() in self.loaders:
-                    full_path = os.path.join(root, file)
                     files_by_type[ext.lower()].append(full_path)
                     self.logger.debug(f"Found {ext} file: {full_path}")
         
@@ -64,25 +137,126 @@ class DocumentLoader:
         
         return all_documents
 
+    def get_ordered_files(self) -> List[str]:
+        # アップロード順（更新時刻順）に並べる
+        files_by_type = self.get_files_by_type()
+        paths = [path for files in files_by_type.values() for path in files]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    def _split_tasks(self, path: str) -> List[Tuple]:
+        # ページ数の多いPDFはページ範囲ごとに分割して並列に解析
+        if path.lower().endswith('.pdf'):
+            try:
+                pages = count_pdf_pages(path)
+            except Exception as e:
+                self.logger.debug(f"Could not count pages of {path}: {str(e)}")
+                pages = 0
+            if pages > self.pdf_pages_per_task:
+                return [
+                    (parse_pdf_pages, path, first, min(first + self.pdf_pages_per_task, pages))
+                    for first in range(0, pages, self.pdf_pages_per_task)
+                ]
+        return [(parse_file, path)]
+
+    def parse_files(self, paths: List[str]) -> Dict[str, str]:
+        """
+        Parses files into normalized text, in a process pool when parallel mode is enabled.
+        """
+        if not self.parallel or not paths:
+            results = {}
+            for path in paths:
+                try:
+                    results[path], self.timings[path] = parse_file(path)
+                    self.logger.info(f"Parsed {path} in {self.timings[path]:.2f}s")
+                except Exception as e:
+                    self.logger.error(f"Error loading {path}: {str(e)}")
+            return results
+
+        futures = {path: submit_tasks(self._split_tasks(path), self.max_workers) for path in paths}
+
+        results = {}
+        for path in paths:
+            try:
+                parts = [future.result() for future in futures[path]]
+                results[path] = ' '.join(text for text, _ in parts)
+                self.timings[path] = sum(elapsed for _, elapsed in parts)
+                self.logger.info(f"Parsed {path} in {self.timings[path]:.2f}s ({len(parts)} tasks)")
+            except Exception as e:
+                self.logger.error(f"Error loading {path}: {str(e)}")
+        return results
+
+    def load_texts(self) -> List[Tuple[str, str]]:
+        """
+        Returns (path, content hash) for every supported file, parsing only new or changed files.
+        """
+        paths = self.get_ordered_files()
+
+        hashes = {}
+        to_parse = []
+        for path in paths:
+            try:
+                content_hash, cached = self.manifest.lookup(path)
+                hashes[path] = content_hash
+                if not cached:
+                    to_parse.append(path)
+            except Exception as e:
+                self.logger.error(f"Error loading {path}: {str(e)}")
+
+        changed = False
+        if to_parse:
+            self.logger.info(f"Parsing {len(to_parse)} new or changed files...")
+            for path, text in self.parse_files(to_parse).items():
+                self.manifest.record(path, hashes[path], text)
+                changed = True
+
+        entries = [
+            (path, hashes[path]) for path in paths
+            if path in hashes and (path not in to_parse or self.manifest.has_text(hashes[path]))
+        ]
+
+        if self.manifest.stale_paths(paths, self.directory_path):
+            self.manifest.prune(paths, self.directory_path)
+            changed = True
+        if changed:
+            self.manifest.save()
+        return entries
+
+    def get_chunks(self, text_splitter, settings_key: str) -> List[Document]:
+        """
+        Returns chunks of every loaded file, reusing per-file chunk caches for the given splitter settings.
+        """
+        chunks = []
+        for path, content_hash in self.load_texts():
+            texts = self.manifest.get_chunks(content_hash, settings_key)
+            if texts is None:
+                texts = text_splitter.split_text(self.manifest.get_text(content_hash))
+                self.manifest.put_chunks(content_hash, settings_key, texts)
+            chunks.extend(Document(page_content=t, metadata={"source": path}) for t in texts)
+        return chunks
+
     def create_temp_file(self) -> Optional[str]:
         try:
-            documents = self.load_documents()
-            if not documents:
+            entries = self.load_texts()
+            if not entries:
                 self.logger.warning("No documents were loaded")
                 return None
-            
-            # 各ドキュメントのテキストを処理して余計な改行を削除
-            processed_texts = []
-            for doc in documents:
-                # 複数の改行を単一の改行に置換
-                text = ' '.join(doc.page_content.split())
-                processed_texts.append(text)
-            
+
+            # ファイル構成が前回と同じで結合ファイルも残っていれば書き直さない
+            combined_key = hashlib.sha256(
+                "\n".join(content_hash for _, content_hash in entries).encode("utf-8")
+            ).hexdigest()
+            if self.manifest.combined.get(self.temp_file_path) == combined_key and os.path.exists(self.temp_file_path):
+                self.logger.info(f"Documents unchanged, reusing: {self.temp_file_path}")
+                return self.temp_file_path
+
             # 処理したテキストを単一の文字列に結合
-            combined_text = ' '.join(processed_texts)
+            combined_text = ' '.join(self.manifest.get_text(content_hash) for _, content_hash in entries)
             
             with open(self.temp_file_path, 'w', encoding='utf-8') as f:
                 f.write(combined_text)
+
+            self.manifest.combined[self.temp_file_path] = combined_key
+            self.manifest.save()
             
             self.logger.info(f"Combined text saved to: {self.temp_file_path}")
             return self.temp_file_path
@@ -92,4 +266,4 @@ class DocumentLoader:
             return None
 
     def __str__(self) -> str:
-        return f"DocumentLoader(directory_path='{self.directory_path}', supported_formats={list(self.loaders.keys())})"
\ No newline at end of file
+        return f"DocumentLoader(directory_path='{self.directory_path}', supported_formats={list(self.loaders.keys())})"
\ No newline at end of file
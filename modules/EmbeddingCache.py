@@ -0,0 +1,201 @@
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from modules.Cache import LRUCache
+from modules.EmbeddingExecutor import EmbeddingExecutor
+from modules.AsyncUtils import run_blocking
+from modules.Metrics import record_cache, stage
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+import hashlib
+import logging
+import sqlite3
+import threading
+
+class EmbeddingStore:
+    """
+    SQLite-backed store of float32 embedding vectors keyed by (model, sha256(text)).
+    """
+    def __init__(self, db_path: str = ".cache/embeddings.sqlite3"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # SQLiteのプレースホルダ上限を超えないよう分割して問い合わせ
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]) -> None:
+        rows = [
+            (model, key, int(vec.shape[0]), np.asarray(vec, dtype=np.float32).tobytes())
+            for key, vec in vectors.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, dim, vector) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends cache misses to the underlying model.
+    Lookups go through an in-process LRU first, then the on-disk store.
+    """
+    def __init__(self, underlying: Embeddings, model: str,
+                 store: Optional[EmbeddingStore] = None, lru_size: int = 20000,
+                 executor: Optional[EmbeddingExecutor] = None):
+        self.underlying = underlying
+        self.model = model
+        self.store = store or EmbeddingStore()
+        self.executor = executor or EmbeddingExecutor(underlying)
+        self.lru = LRUCache(max_size=lru_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        remaining = []
+        for key in dict.fromkeys(hashes):
+            vec = self.lru.get((self.model, key))
+            if vec is not None:
+                found[key] = vec
+            else:
+                remaining.append(key)
+
+        if remaining:
+            stored = self.store.get_many(self.model, remaining)
+            for key, vec in stored.items():
+                self.lru.put((self.model, key), vec)
+            found.update(stored)
+        return found
+
+    def _remember(self, vectors: Dict[str, np.ndarray]) -> None:
+        for key, vec in vectors.items():
+            self.lru.put((self.model, key), vec)
+        self.store.put_many(self.model, vectors)
+
+    def _count(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        record_cache("embedding", True, hits)
+        record_cache("embedding", False, misses)
+
+    def _split(self, texts: List[str]):
+        hashes = [self.text_hash(t) for t in texts]
+        found = self._lookup(hashes)
+        # 同じテキストが複数回現れても埋め込みは一度だけ行う
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in found and key not in missing:
+                missing[key] = text
+        hits = sum(1 for k in hashes if k in found)
+        self._count(hits, len(texts) - hits)
+        return hashes, found, missing
+
+    def _assemble(self, hashes: List[str], found: Dict[str, np.ndarray]) -> np.ndarray:
+        dim = len(next(iter(found.values())))
+        matrix = np.empty((len(hashes), dim), dtype=np.float32)
+        for row, key in enumerate(hashes):
+            matrix[row] = found[key]
+        return matrix
+
+    def _store_missing(self, keys: List[str], vectors: np.ndarray, found: Dict[str, np.ndarray]) -> None:
+        new = {key: vectors[row].copy() for row, key in enumerate(keys)}
+        self._remember(new)
+        found.update(new)
+
+    async def aembed_matrix(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # ハッシュ計算とSQLiteの読み書きはイベントループを止めないようスレッドプールで行う
+        hashes, found, missing = await run_blocking(self._split, texts)
+        if missing:
+            keys = list(missing.keys())
+            with stage("embed"):
+                vectors = await self.executor.aembed([missing[k] for k in keys])
+            await run_blocking(self._store_missing, keys, vectors, found)
+        return self._assemble(hashes, found)
+
+    def embed_matrix(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        hashes, found, missing = self._split(texts)
+        if missing:
+            keys = list(missing.keys())
+            with stage("embed"):
+                vectors = self.executor.embed([missing[k] for k in keys])
+            self._store_missing(keys, vectors, found)
+        return self._assemble(hashes, found)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return (await self.aembed_matrix(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # クエリは使い回されにくいためキャッシュせずに委譲
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.underlying.aembed_query(text)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "lru": self.lru.stats(),
+        }
+
+
+# モデルごとに共有するキャッシュ付き埋め込み
+_shared_embeddings: Dict[str, CachedEmbeddings] = {}
+_shared_lock = threading.Lock()
+
+def get_embeddings(model: str = "nomic-embed-text", batch_size: int = 32,
+                   max_concurrency: int = 4, base_url: Optional[str] = None,
+                   client_kwargs: Optional[Dict[str, Any]] = None) -> CachedEmbeddings:
+    with _shared_lock:
+        if model not in _shared_embeddings:
+            options = {"base_url": base_url} if base_url else {}
+            underlying = OllamaEmbeddings(model=model, client_kwargs=client_kwargs or {}, **options)
+            executor = EmbeddingExecutor(underlying, batch_size=batch_size, max_concurrency=max_concurrency)
+            _shared_embeddings[model] = CachedEmbeddings(underlying, model=model, executor=executor)
+        return _shared_embeddings[model]
@@ -0,0 +1,69 @@
+from langchain_core.embeddings import Embeddings
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import numpy as np
+import asyncio
+import logging
+
+def run_sync(coro):
+    """
+    Runs a coroutine to completion from synchronous code, even when called inside a running event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # 既にイベントループ内にいる場合は別スレッドで実行
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+class EmbeddingExecutor:
+    """
+    Packs texts into fixed-size batches and keeps a bounded number of batches in flight.
+    Results are written directly into a preallocated float32 matrix in input order.
+    """
+    def __init__(self, embeddings: Embeddings, batch_size: int = 32, max_concurrency: int = 4,
+                 max_retries: int = 3, retry_delay: float = 0.5):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.logger = logging.getLogger(__name__)
+
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                # 同期クライアントをスレッドで呼ぶことで、どのイベントループからでも安全に使える
+                return await asyncio.to_thread(self.embeddings.embed_documents, batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_delay * (2 ** attempt)
+                self.logger.warning(f"Embedding batch failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        matrix: Optional[np.ndarray] = None
+
+        async def worker(start: int):
+            nonlocal matrix
+            batch = texts[start:start + self.batch_size]
+            async with semaphore:
+                vectors = await self._embed_batch(batch)
+            # 最初に返ってきたバッチで次元数を確定して行列を確保
+            if matrix is None:
+                matrix = np.empty((len(texts), len(vectors[0])), dtype=np.float32)
+            matrix[start:start + len(batch)] = vectors
+
+        await asyncio.gather(*(worker(start) for start in range(0, len(texts), self.batch_size)))
+        self.logger.info(f"Embedded {len(texts)} texts in batches of {self.batch_size}")
+        return matrix
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return run_sync(self.aembed(texts))
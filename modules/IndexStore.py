@@ -0,0 +1,155 @@
+from langchain_community.vectorstores import FAISS
+from modules.LexicalIndex import LexicalIndex
+from pathlib import Path
+from typing import Any, Dict, Optional
+import faiss
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+
+class IndexStore:
+    """
+    Content-addressed on-disk store for FAISS vector stores.
+    Entries are keyed by a hash of the source text and the settings used to build them.
+    """
+    INDEX_FILE = "index.faiss"
+    DOCSTORE_FILE = "index.pkl"
+    LEXICAL_FILE = "lexical.npz"
+
+    def __init__(self, cache_dir: str = ".cache/faiss_index", max_entries: int = 32,
+                 max_bytes: int = 2 * 1024 ** 3, use_mmap: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.use_mmap = use_mmap
+        self.logger = logging.getLogger(__name__)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(text: str, settings: Dict[str, Any]) -> str:
+        # テキスト本体と分割・埋め込みの設定をまとめてハッシュ化
+        digest = hashlib.sha256()
+        digest.update(text.encode("utf-8"))
+        digest.update(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def _read_index(self, path: Path):
+        if self.use_mmap:
+            # フラットインデックスはIO_FLAG_MMAP_IFC、それ以外はIO_FLAG_MMAPでメモリマップ読み込み
+            flags = [getattr(faiss, "IO_FLAG_MMAP_IFC", None), faiss.IO_FLAG_MMAP]
+            for flag in flags:
+                if flag is None:
+                    continue
+                try:
+                    return faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    continue
+        return faiss.read_index(str(path))
+
+    def load(self, key: str, embeddings) -> Optional[FAISS]:
+        entry = self._entry_path(key)
+        index_path = entry / self.INDEX_FILE
+        docstore_path = entry / self.DOCSTORE_FILE
+        if not index_path.exists() or not docstore_path.exists():
+            return None
+
+        try:
+            index = self._read_index(index_path)
+            # 自身で保存したファイルのみを読み込む
+            with docstore_path.open("rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+        except Exception as e:
+            self.logger.error(f"Failed to load cached index {key}: {str(e)}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        # LRU判定用にアクセス時刻を更新
+        now = time.time()
+        os.utime(entry, (now, now))
+        self.logger.info(f"Loaded cached index: {key}")
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        )
+
+    def save(self, key: str, db: FAISS, lexical: Optional[LexicalIndex] = None) -> None:
+        entry = self._entry_path(key)
+        if entry.exists():
+            return
+
+        tmp_entry = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        try:
+            db.save_local(str(tmp_entry))
+            if lexical is not None:
+                lexical.save(str(tmp_entry / self.LEXICAL_FILE))
+            # 書き込み途中のエントリを読ませないようにリネームで公開
+            os.replace(tmp_entry, entry)
+            self.logger.info(f"Saved index to cache: {key}")
+        except OSError as e:
+            if entry.exists():
+                # 他のプロセスが同じキーを先に保存した場合（リネーム先が空でないディレクトリ）
+                self.logger.debug(f"Index cache entry already exists: {key} ({str(e)})")
+            else:
+                # 容量不足・権限などの書き込みの失敗
+                self.logger.warning(f"Failed to save index {key}: {str(e)}")
+        except Exception as e:
+            self.logger.error(f"Failed to save index {key}: {str(e)}")
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.evict()
+
+    def load_lexical(self, key: str) -> Optional[LexicalIndex]:
+        path = self._entry_path(key) / self.LEXICAL_FILE
+        if not path.exists():
+            return None
+        try:
+            return LexicalIndex.load(str(path))
+        except Exception as e:
+            self.logger.error(f"Failed to load cached lexical index {key}: {str(e)}")
+            return None
+
+    def save_lexical(self, key: str, lexical: LexicalIndex) -> None:
+        # ベクトルインデックスが保存済みのエントリにのみ追加する
+        entry = self._entry_path(key)
+        if not entry.exists():
+            return
+        tmp_path = entry / f".{self.LEXICAL_FILE}.{os.getpid()}.tmp"
+        try:
+            lexical.save(str(tmp_path))
+            os.replace(tmp_path, entry / self.LEXICAL_FILE)
+        except Exception as e:
+            self.logger.error(f"Failed to save lexical index {key}: {str(e)}")
+            tmp_path.unlink(missing_ok=True)
+
+    def _entry_size(self, entry: Path) -> int:
+        return sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+
+    def evict(self) -> None:
+        entries = [p for p in self.cache_dir.iterdir() if p.is_dir() and not p.name.startswith(".")]
+        # 最近使われたものから順に並べる
+        entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+
+        total_bytes = 0
+        for i, entry in enumerate(entries):
+            try:
+                total_bytes += self._entry_size(entry)
+            except OSError:
+                continue
+            # 直近のエントリは容量超過でも残す
+            if i >= self.max_entries or (i > 0 and total_bytes > self.max_bytes):
+                shutil.rmtree(entry, ignore_errors=True)
+                self.logger.info(f"Evicted cached index: {entry.name}")
+
+    def __str__(self) -> str:
+        return f"IndexStore(cache_dir='{self.cache_dir}', max_entries={self.max_entries}, max_bytes={self.max_bytes})"
@@ -0,0 +1,202 @@
+from modules.Cache import LRUCache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+class IngestManifest:
+    """
+    Tracks (path, size, mtime, hash) for ingested files and caches their normalized text and chunks.
+    Text and chunk caches are keyed by content hash, so re-uploading an identical file skips parsing.
+    Cached texts of files that are no longer uploaded are evicted least recently used first once
+    the cache holds more than max_entries texts or max_bytes on disk.
+    """
+    def __init__(self, cache_dir: str = ".cache/ingest", memory_entries: int = 256,
+                 max_entries: int = 512, max_bytes: int = 512 * 1024 ** 2):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.manifest_path = self.cache_dir / "manifest.json"
+        self.text_dir = self.cache_dir / "text"
+        self.chunk_dir = self.cache_dir / "chunks"
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+
+        self.text_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.combined: Dict[str, str] = {}
+        # 直近に使ったテキストとチャンクはメモリ上にも保持
+        self._texts = LRUCache(max_size=memory_entries)
+        self._chunks = LRUCache(max_size=memory_entries)
+        self._load()
+
+    def _load(self) -> None:
+        if not self.manifest_path.exists():
+            return
+        try:
+            with self.manifest_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data.get("files", {})
+            self.combined = data.get("combined", {})
+        except Exception as e:
+            self.logger.error(f"Failed to read ingest manifest: {str(e)}")
+
+    def save(self) -> None:
+        with self._lock:
+            tmp_path = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump({"files": self.entries, "combined": self.combined}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+            self.evict()
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def lookup(self, path: str) -> Tuple[str, bool]:
+        """
+        Returns the content hash of a file and whether its normalized text is already cached.
+        """
+        with self._lock:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            # サイズと更新時刻が一致すればハッシュ計算も省略
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                if self.has_text(entry["hash"]):
+                    self._touch(self.text_dir / f"{entry['hash']}.txt")
+                    return entry["hash"], True
+
+            content_hash = self.file_hash(path)
+            cached = self.has_text(content_hash)
+            if cached:
+                self.entries[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": content_hash}
+            return content_hash, cached
+
+    def record(self, path: str, content_hash: str, text: str) -> None:
+        with self._lock:
+            stat = os.stat(path)
+            self.entries[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": content_hash}
+            self._texts.put(content_hash, text)
+            (self.text_dir / f"{content_hash}.txt").write_text(text, encoding="utf-8")
+
+    @staticmethod
+    def _within(path: str, directory: Optional[str]) -> bool:
+        if directory is None:
+            return True
+        directory = os.path.abspath(directory)
+        return os.path.abspath(path).startswith(directory + os.sep)
+
+    def stale_paths(self, paths: List[str], directory: Optional[str] = None) -> List[str]:
+        return [path for path in set(self.entries) - set(paths) if self._within(path, directory)]
+
+    def prune(self, paths: List[str], directory: Optional[str] = None) -> None:
+        # 削除されたファイルのエントリを取り除く（テキストキャッシュは再アップロードに備えて残し、evictで上限内に収める）
+        # directoryを指定した場合は、その配下のエントリのみを対象にする（他セッションの作業領域には触れない）
+        with self._lock:
+            for path in self.stale_paths(paths, directory):
+                del self.entries[path]
+            for temp_path in [p for p in self.combined if self._within(p, directory) and not os.path.exists(p)]:
+                del self.combined[temp_path]
+
+    def has_text(self, content_hash: str) -> bool:
+        return self._texts.get(content_hash) is not None or (self.text_dir / f"{content_hash}.txt").exists()
+
+    def get_text(self, content_hash: str) -> str:
+        with self._lock:
+            text = self._texts.get(content_hash)
+            if text is None:
+                text_path = self.text_dir / f"{content_hash}.txt"
+                text = text_path.read_text(encoding="utf-8")
+                self._touch(text_path)
+                self._texts.put(content_hash, text)
+            return text
+
+    def get_chunks(self, content_hash: str, settings_key: str) -> Optional[List[str]]:
+        key = f"{content_hash}-{settings_key}"
+        with self._lock:
+            chunks = self._chunks.get(key)
+            if chunks is not None:
+                return chunks
+            chunk_path = self.chunk_dir / f"{key}.json"
+            if not chunk_path.exists():
+                return None
+            with chunk_path.open("r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            self._touch(chunk_path)
+            self._chunks.put(key, chunks)
+            return chunks
+
+    def put_chunks(self, content_hash: str, settings_key: str, chunks: List[str]) -> None:
+        key = f"{content_hash}-{settings_key}"
+        with self._lock:
+            self._chunks.put(key, chunks)
+            with (self.chunk_dir / f"{key}.json").open("w", encoding="utf-8") as f:
+                json.dump(chunks, f, ensure_ascii=False)
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        # LRU判定用にアクセス時刻を更新
+        try:
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """
+        Removes cached texts, together with their chunks, least recently used first until the cache
+        is within max_entries and max_bytes. Texts of files still listed in the manifest are kept.
+        """
+        with self._lock:
+            live = {entry["hash"] for entry in self.entries.values()}
+            # ファイル名の先頭はコンテンツハッシュ（テキスト: {hash}.txt、チャンク: {hash}-{設定}.json）
+            groups: Dict[str, List[Path]] = {}
+            for path in list(self.text_dir.iterdir()) + list(self.chunk_dir.iterdir()):
+                groups.setdefault(path.name[:64], []).append(path)
+
+            sizes: Dict[str, int] = {}
+            used: Dict[str, float] = {}
+            for content_hash, paths in groups.items():
+                try:
+                    stats = [path.stat() for path in paths]
+                except OSError:
+                    continue
+                sizes[content_hash] = sum(stat.st_size for stat in stats)
+                used[content_hash] = max(stat.st_mtime for stat in stats)
+
+            count, total = len(sizes), sum(sizes.values())
+            evicted = 0
+            # 古いものから削除する
+            for content_hash in sorted(sizes, key=used.get):
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                if content_hash in live:
+                    continue
+                for path in groups[content_hash]:
+                    path.unlink(missing_ok=True)
+                count -= 1
+                total -= sizes[content_hash]
+                evicted += 1
+            if evicted:
+                self.logger.info(f"Evicted {evicted} cached texts from the ingest cache")
+
+
+# プロセス内で共有するマニフェスト
+_shared_manifests: Dict[str, IngestManifest] = {}
+_shared_lock = threading.Lock()
+
+def get_manifest(cache_dir: str = ".cache/ingest") -> IngestManifest:
+    with _shared_lock:
+        if cache_dir not in _shared_manifests:
+            _shared_manifests[cache_dir] = IngestManifest(cache_dir)
+        return _shared_manifests[cache_dir]
@@ -0,0 +1,225 @@
+from collections import Counter
+from modules.Workspace import WorkspaceManager, safe_session_id
+from modules.Scheduler import current_session
+from modules.Metrics import observe_stage
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+# ワーカー数・待ち行列の上限・終了したジョブの保持期間（環境変数で調整）
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+INGEST_MAX_QUEUE = int(os.environ.get("INGEST_MAX_QUEUE", "100"))
+INGEST_JOB_TTL = float(os.environ.get("INGEST_JOB_TTL", "3600"))
+
+# 処理段階とおおよその進捗（埋め込みが大半を占める）
+PHASES = {
+    "queued": 0.0,
+    "parsing": 0.1,
+    "chunking": 0.3,
+    "embedding": 0.4,
+    "indexing": 0.9,
+    "done": 1.0,
+}
+FINISHED = ("done", "failed", "cancelled")
+
+
+class IngestQueueFull(Exception):
+    """
+    Raised when the ingestion queue already holds max_queue jobs.
+    """
+
+
+class IngestCancelled(Exception):
+    """
+    Raised inside a job at the next phase boundary after it was cancelled.
+    """
+
+
+class IngestJob:
+    """
+    Pre-indexing job of one session: parse → chunk → embed → index of its upload directory.
+    """
+    def __init__(self, session_id: str, filenames: List[str]):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.filenames = list(filenames)
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def advance(self, phase: str) -> None:
+        # 取り消しは段階の切れ目で反映する（解析・保存のスレッドを途中で放置しないため）
+        if self.cancel_requested:
+            raise IngestCancelled(self.id)
+        self.status = phase
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = PHASES.get(self.status)
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "filenames": self.filenames,
+            "status": "cancelling" if self.cancel_requested and not self.finished else self.status,
+            "progress": progress if progress is not None else 1.0,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestQueue:
+    """
+    Background pre-indexing of uploads, so a session's retrieval index is built before its
+    first question instead of inside it. Jobs are per session: files uploaded while a job is
+    still queued join that job, and uploads during a running job queue a follow-up job. A job
+    holds the workspace lock, so a question asked meanwhile waits for the index rather than
+    building it a second time. Job state and the built indexes live in this process only, so
+    with several server processes the queue is created disabled and indexes are built at the
+    first question as before.
+    """
+    def __init__(self, workspaces: WorkspaceManager, workers: int = INGEST_WORKERS,
+                 max_queue: int = INGEST_MAX_QUEUE, job_ttl: float = INGEST_JOB_TTL, enabled: bool = True):
+        self.workspaces = workspaces
+        self.enabled = enabled
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.job_ttl = job_ttl
+        self.jobs: Dict[str, IngestJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[str, IngestJob] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.completed = Counter()
+        self.logger = logging.getLogger(__name__)
+
+    def start(self) -> None:
+        # イベントループ上で呼ぶ（アプリのlifespanから）
+        if self._tasks or not self.enabled:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for task in list(self._running.values()) + self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, session_id: str, filenames: List[str]) -> IngestJob:
+        """
+        Queues indexing of the session's uploads and returns the job (a queued job of the same
+        session is reused).
+        """
+        if self._queue is None:
+            raise RuntimeError("IngestQueue is not started")
+        session_id = safe_session_id(session_id)
+        self.prune()
+        job = self._pending.get(session_id)
+        if job is not None:
+            job.filenames.extend(name for name in filenames if name not in job.filenames)
+            return job
+        if self._queue.qsize() >= self.max_queue:
+            raise IngestQueueFull(f"ingestion queue is full ({self.max_queue})")
+        job = IngestJob(session_id, filenames)
+        self.jobs[job.id] = job
+        self._pending[session_id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, session_id: str) -> List[IngestJob]:
+        """
+        Cancels the session's queued and running jobs. A queued job ends immediately, a running
+        one at its next phase boundary.
+        """
+        session_id = safe_session_id(session_id)
+        cancelled = []
+        for job in self.jobs.values():
+            if job.session_id != session_id or job.finished or job.cancel_requested:
+                continue
+            job.cancel_requested = True
+            if self._pending.get(session_id) is job:
+                del self._pending[session_id]
+                job.finish("cancelled")
+                self.completed["cancelled"] += 1
+            cancelled.append(job)
+        return cancelled
+
+    def prune(self) -> None:
+        # 終了後、保持期間を過ぎたジョブの状態を破棄する
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished_at > self.job_ttl:
+                del self.jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.finished:
+                    continue
+                if self._pending.get(job.session_id) is job:
+                    del self._pending[job.session_id]
+                task = asyncio.create_task(self._run(job))
+                self._running[job.id] = task
+                try:
+                    # ワーカー自身の停止（close）でのみCancelledErrorが伝わる
+                    await asyncio.wait({task})
+                finally:
+                    self._running.pop(job.id, None)
+                if task.cancelled():
+                    job.finish("cancelled")
+                elif isinstance(task.exception(), IngestCancelled):
+                    job.finish("cancelled")
+                elif task.exception() is not None:
+                    error = task.exception()
+                    self.logger.error(f"Ingestion failed for session {job.session_id}: {str(error)}")
+                    job.finish("failed", str(error))
+                else:
+                    job.finish("done")
+                self.completed[job.status] += 1
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: IngestJob) -> None:
+        current_session.set(job.session_id)
+        job.started_at = time.time()
+        start = time.perf_counter()
+        workspace = self.workspaces.get(job.session_id)
+        async with workspace.lock:
+            job.advance("parsing")
+            temp_file_path = await workspace.prepare()
+            if temp_file_path is not None:
+                context_qa = workspace.context_qa()
+                await context_qa.asetup_qa_chain(progress=job.advance)
+            job.advance("indexing")
+        observe_stage("ingest", time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        statuses = Counter(job.status for job in self.jobs.values() if not job.finished)
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "queued": statuses["queued"],
+            "running": len(self._running),
+            "max_queue": self.max_queue,
+            "completed": dict(self.completed),
+        }
@@ -0,0 +1,177 @@
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import re
+import unicodedata
+
+# 英数字は語単位、それ以外は文字bigramで索引化
+WORD_PATTERN = re.compile(r"[0-9a-z]+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Character bigrams of the normalized text plus whole ASCII words and numbers.
+    """
+    text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", text).lower())
+    tokens = [text[i:i + 2] for i in range(len(text) - 1)]
+    tokens.extend(WORD_PATTERN.findall(text))
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over character n-grams, stored as CSR-style numpy arrays.
+    """
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {term: i for i, term in enumerate(terms.tolist())}
+
+        doc_count = len(doc_lengths)
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        average = float(doc_lengths.mean()) if doc_count else 1.0
+        # 文書長による正規化項は検索のたびに計算しないよう前計算
+        self.length_norm = (k1 * (1.0 - b + b * doc_lengths / max(average, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: Sequence[str], **kwargs) -> "LexicalIndex":
+        vocabulary: Dict[str, int] = {}
+        term_ids, doc_ids, freqs = [], [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            doc_lengths[doc_id] = len(tokens)
+            term_ids.extend(counts.keys())
+            doc_ids.extend([doc_id] * len(counts))
+            freqs.extend(counts.values())
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+        terms = np.empty(len(vocabulary), dtype=object)
+        for term, term_id in vocabulary.items():
+            terms[term_id] = term
+        return cls(
+            terms=terms.astype(str),
+            offsets=offsets,
+            doc_ids=np.asarray(doc_ids, dtype=np.int32)[order],
+            term_freqs=np.asarray(freqs, dtype=np.float32)[order],
+            doc_lengths=doc_lengths,
+            **kwargs,
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1.0) / (tf + self.length_norm[docs])
+        return scores
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """
+        Returns up to k (doc_id, score) pairs with a positive score, best first.
+        """
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=self.terms,
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                term_freqs=self.term_freqs,
+                doc_lengths=self.doc_lengths,
+                params=np.asarray([self.k1, self.b], dtype=np.float32),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"].tolist()
+            return cls(
+                terms=data["terms"],
+                offsets=data["offsets"],
+                doc_ids=data["doc_ids"],
+                term_freqs=data["term_freqs"],
+                doc_lengths=data["doc_lengths"],
+                k1=k1,
+                b=b,
+            )
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[int]:
+    """
+    Fuses ranked id lists by summing 1 / (k + rank).
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves from a vector store and a LexicalIndex over the same documents and fuses the
+    two rankings with reciprocal rank fusion.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: Any
+    lexical: LexicalIndex
+    documents: List[Document]
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    _positions: Optional[Dict[str, int]] = None
+
+    def _position(self, document: Document) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {}
+            for i, doc in enumerate(self.documents):
+                self._positions.setdefault(doc.page_content, i)
+        return self._positions.get(document.page_content)
+
+    def _fuse(self, dense: List[Document], query: str) -> List[Document]:
+        dense_ids = [i for i in (self._position(doc) for doc in dense) if i is not None]
+        lexical_ids = [doc_id for doc_id, _ in self.lexical.search(query, self.fetch_k)]
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], k=self.rrf_k)
+        return [self.documents[i] for i in fused[:self.k]]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        return self._fuse(dense, query)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        dense = await self.vectorstore.asimilarity_search(query, k=self.fetch_k)
+        return self._fuse(dense, query)
@@ -0,0 +1,320 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableLambda
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+# 応答ヘッダー（Server-Timing）とストリームの完了イベントに処理時間の内訳を含めるか
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "1") == "1"
+
+# 処理時間のヒストグラムの区切り（秒）。キャッシュヒットの数ミリ秒から長い要約の数分までを想定
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _escape_help(text: str) -> str:
+    # HELPの説明文では引用符はエスケープしない
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    """
+    One metric family; subclasses render their series as exposition-format sample lines.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        pass
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {_escape_help(self.help)}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [各区切りの件数（累積前）, 合計, 件数]
+        self._series: Dict[Tuple[Any, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process Prometheus registry (counters, gauges and histograms) rendered in the
+    text exposition format. Metrics are per process: with several uvicorn workers each worker
+    exposes its own values.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            # 同じ名前で二度登録された場合（モジュールの再読み込みなど）は既存のものを返す
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
+
+REQUEST_SECONDS = _registry.histogram(
+    "elyza_request_duration_seconds", "End-to-end chat request latency.", ("endpoint", "task", "status"))
+STAGE_SECONDS = _registry.histogram(
+    "elyza_stage_duration_seconds", "Latency of each pipeline stage (stages may nest).", ("stage",))
+LLM_QUEUE_SECONDS = _registry.histogram(
+    "elyza_llm_queue_wait_seconds", "Time spent waiting for a model slot.", ("model", "priority"))
+LLM_CALL_SECONDS = _registry.histogram(
+    "elyza_llm_call_duration_seconds", "Time a model slot was held.", ("model", "priority"))
+LLM_TOKENS = _registry.counter(
+    "elyza_llm_tokens_total", "Tokens sent to (input) and generated by (output) the models.", ("model", "direction"))
+CACHE_REQUESTS = _registry.counter(
+    "elyza_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+
+
+class RequestTrace:
+    """
+    Per-request accumulation of stage timings and token counts. Stages that run several times
+    (e.g. map-reduce calls) are summed; concurrent stages may add up to more than the wall time.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.task: Optional[str] = None
+        self.stages: Dict[str, List[float]] = {}
+        self.tokens = {"input": 0, "output": 0}
+        self.cache: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_tokens(self, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            self.tokens["input"] += input_tokens
+            self.tokens["output"] += output_tokens
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def timings(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: round(total * 1000, 1) for name, (total, _) in self.stages.items()}
+        return {
+            "task": self.task,
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "stages_ms": stages,
+            "tokens": dict(self.tokens),
+            "cache": dict(self.cache),
+        }
+
+    def server_timing(self) -> str:
+        # Server-Timing: stage;dur=ミリ秒（ブラウザの開発者ツールでそのまま表示される）
+        with self._lock:
+            parts = [f"{name};dur={total * 1000:.1f}" for name, (total, _) in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+def start_trace() -> RequestTrace:
+    trace = RequestTrace()
+    current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: RequestTrace, endpoint: str, status: str = "ok") -> None:
+    REQUEST_SECONDS.observe(trace.elapsed(), endpoint=endpoint, task=trace.task or "none", status=status)
+    logging.getLogger(__name__).info(f"Request timings ({endpoint}, {trace.task}): {trace.timings()}")
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the enclosed block as a pipeline stage (histogram and, inside a request, its trace).
+    Usable around awaits in async code as well as in threads started with a copied context.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+def timed_runnable(name: str, runnable: Runnable) -> Runnable:
+    """
+    Wraps a runnable (e.g. a retriever inside a chain) so that each invocation is timed as a stage.
+    """
+    def invoke(value):
+        with stage(name):
+            return runnable.invoke(value)
+
+    async def ainvoke(value):
+        with stage(name):
+            return await runnable.ainvoke(value)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+def record_tokens(model: str, input_tokens: int = 0, output_tokens: int = 0) -> None:
+    LLM_TOKENS.inc(input_tokens, model=model, direction="input")
+    LLM_TOKENS.inc(output_tokens, model=model, direction="output")
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_tokens(input_tokens, output_tokens)
+
+def record_cache(cache: str, hit: bool, count: int = 1) -> None:
+    if count <= 0:
+        return
+    CACHE_REQUESTS.inc(count, cache=cache, result="hit" if hit else "miss")
+    trace = current_trace.get()
+    if trace is not None:
+        # 同じリクエストで複数回参照した場合は最後の結果を記録
+        trace.cache[cache] = "hit" if hit else "miss"
+
+
+def _usage(generation: Any) -> Tuple[int, int]:
+    # ChatOllamaはusage_metadata、古い形式はgeneration_infoのprompt_eval_count/eval_countに入る
+    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+    if usage:
+        return int(usage.get("input_tokens", 0) or 0), int(usage.get("output_tokens", 0) or 0)
+    info = getattr(generation, "generation_info", None) or {}
+    return int(info.get("prompt_eval_count", 0) or 0), int(info.get("eval_count", 0) or 0)
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    LangChain callback that records the token usage reported by the model for every call,
+    streaming or not.
+    """
+    def __init__(self, model: str):
+        self.model = model
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        input_tokens = output_tokens = 0
+        for generations in getattr(response, "generations", []):
+            for generation in generations:
+                i, o = _usage(generation)
+                input_tokens += i
+                output_tokens += o
+        if input_tokens or output_tokens:
+            record_tokens(self.model, input_tokens, output_tokens)
+
+def record_completion_usage(model: str, response: Any) -> None:
+    # OpenAI互換API（instructor経由）の応答に含まれるusageを記録
+    raw = getattr(response, "_raw_response", response)
+    usage = getattr(raw, "usage", None)
+    if usage is not None:
+        record_tokens(model, int(getattr(usage, "prompt_tokens", 0) or 0), int(getattr(usage, "completion_tokens", 0) or 0))
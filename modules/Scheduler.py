@@ -0,0 +1,219 @@
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional
+import numpy as np
+import asyncio
+import logging
+import math
+import os
+import time
+
+# 優先度クラス（上ほど優先）
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)
+
+# 待ち行列の上限・待ち時間の上限・対話用に確保する枠（環境変数で調整）
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "64"))
+LLM_MAX_QUEUE_PER_SESSION = int(os.environ.get("LLM_MAX_QUEUE_PER_SESSION", "8"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "60"))
+LLM_RESERVED_INTERACTIVE = int(os.environ.get("LLM_RESERVED_INTERACTIVE", "1"))
+
+# リクエストを処理中のセッション（公平性のため、各モジュールから引数なしで参照できるようにする）
+current_session: ContextVar[Optional[str]] = ContextVar("current_session", default=None)
+
+
+class SchedulerBusy(Exception):
+    """
+    Raised when a request is not admitted: 429 when the session already has too many queued
+    calls, 503 when the model's queue is full or the queue wait timed out.
+    """
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _ModelQueue:
+    """
+    Scheduling state of one model: in-flight count and, per priority class, the waiting calls
+    grouped by session (served round-robin).
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self.depth = Counter()
+        self.per_session = Counter()
+        self.service_time = 1.0
+        self.waits: Deque[float] = deque(maxlen=1000)
+        self.admitted = Counter()
+        self.rejected = Counter()
+        self.timeouts = 0
+
+    def queued(self) -> int:
+        return sum(self.depth.values())
+
+    def dequeued(self, priority: str, session_id: str) -> None:
+        self.depth[priority] -= 1
+        self.per_session[session_id] -= 1
+        # 待ちのなくなったセッションは残さない
+        if self.per_session[session_id] <= 0:
+            del self.per_session[session_id]
+
+
+class LLMScheduler:
+    """
+    Admission control and scheduling in front of the model backend. At most limit calls per
+    model run at once; waiting calls are served by priority class (interactive > batch >
+    background) and round-robin across sessions within a class. reserved_interactive slots
+    are never given to batch/background work, so a long summary cannot occupy every slot.
+    Queues are bounded: over-limit calls fail fast with SchedulerBusy instead of piling up.
+    """
+    def __init__(self, model_limits: Optional[Dict[str, int]] = None, default_limit: int = 4,
+                 max_queue: int = LLM_MAX_QUEUE, max_queue_per_session: int = LLM_MAX_QUEUE_PER_SESSION,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, reserved_interactive: int = LLM_RESERVED_INTERACTIVE):
+        self.model_limits = model_limits or {}
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.max_queue_per_session = max_queue_per_session
+        self.queue_timeout = queue_timeout
+        self.reserved_interactive = reserved_interactive
+        self.logger = logging.getLogger(__name__)
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+        if model not in self._queues:
+            self._queues[model] = _ModelQueue(self.model_limits.get(model, self.default_limit))
+        return self._queues[model]
+
+    def _can_run(self, queue: _ModelQueue, priority: str) -> bool:
+        if priority == INTERACTIVE:
+            return queue.in_flight < queue.limit
+        # 1枠しかない場合でもバッチ処理が止まらないよう、最低1枠は使えるようにする
+        reserved = min(self.reserved_interactive, queue.limit - 1)
+        return queue.in_flight < queue.limit - reserved
+
+    def retry_after(self, model: str) -> int:
+        # 待ち行列が捌けるまでの見込み時間（秒）
+        queue = self._queue(model)
+        return max(1, math.ceil(queue.service_time * (queue.queued() + 1) / queue.limit))
+
+    def check_admission(self, model: str, session_id: Optional[str] = None, priority: str = INTERACTIVE) -> None:
+        """
+        Raises SchedulerBusy if a new call would be rejected right now; used before a streaming
+        response starts, while an HTTP error status can still be returned.
+        """
+        queue = self._queue(model)
+        session_id = session_id or current_session.get() or "default"
+        if queue.per_session[session_id] >= self.max_queue_per_session:
+            queue.rejected[429] += 1
+            raise SchedulerBusy("Too many queued requests for this session", 429, self.retry_after(model))
+        if queue.queued() >= self.max_queue:
+            queue.rejected[503] += 1
+            raise SchedulerBusy(f"Queue for {model} is full", 503, self.retry_after(model))
+
+    def _next(self, queue: _ModelQueue) -> Optional[asyncio.Future]:
+        for priority in PRIORITIES:
+            sessions = queue.waiting[priority]
+            if not sessions or not self._can_run(queue, priority):
+                continue
+            session_id, waiters = next(iter(sessions.items()))
+            future = waiters.popleft()
+            queue.dequeued(priority, session_id)
+            # 同じセッションの残りは後ろに回し、他のセッションを先に処理する
+            if waiters:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            return future
+        return None
+
+    def _dispatch(self, queue: _ModelQueue) -> None:
+        while queue.in_flight < queue.limit:
+            future = self._next(queue)
+            if future is None:
+                return
+            # 切断やタイムアウトで取り消されたばかりの待ち（後始末がまだ実行されていない）は飛ばす
+            if future.done():
+                continue
+            future.set_result(None)
+            queue.in_flight += 1
+
+    def _remove(self, queue: _ModelQueue, priority: str, session_id: str, future: asyncio.Future) -> None:
+        waiters = queue.waiting[priority].get(session_id)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        queue.dequeued(priority, session_id)
+        if not waiters:
+            del queue.waiting[priority][session_id]
+
+    def _release(self, queue: _ModelQueue, elapsed: Optional[float] = None) -> None:
+        queue.in_flight -= 1
+        if elapsed is not None:
+            # 処理時間の指数移動平均（Retry-Afterの見積もりに使う）
+            queue.service_time = 0.9 * queue.service_time + 0.1 * elapsed
+        self._dispatch(queue)
+
+    async def _acquire(self, queue: _ModelQueue, model: str, priority: str, session_id: str) -> None:
+        # 同じかより高い優先度の待ちがなければ待たずに実行
+        ahead = any(queue.waiting[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if not ahead and self._can_run(queue, priority):
+            queue.in_flight += 1
+            return
+
+        self.check_admission(model, session_id, priority)
+        future = asyncio.get_running_loop().create_future()
+        queue.waiting[priority].setdefault(session_id, deque()).append(future)
+        queue.depth[priority] += 1
+        queue.per_session[session_id] += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 枠が割り当てられた直後に中断された場合は枠を返す
+                self._release(queue)
+            else:
+                self._remove(queue, priority, session_id, future)
+            if isinstance(e, asyncio.TimeoutError):
+                queue.timeouts += 1
+                queue.rejected[503] += 1
+                raise SchedulerBusy(f"Timed out waiting for {model}", 503, self.retry_after(model)) from None
+            raise
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str = INTERACTIVE, session_id: Optional[str] = None):
+        """
+        Holds one of the model's in-flight slots for the duration of the block.
+        """
+        queue = self._queue(model)
+        session_id = session_id or current_session.get() or "default"
+        start = time.monotonic()
+        await self._acquire(queue, model, priority, session_id)
+        queue.waits.append(time.monotonic() - start)
+        queue.admitted[priority] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(queue, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for model, queue in self._queues.items():
+            waits = np.array(queue.waits) if queue.waits else np.zeros(1)
+            stats[model] = {
+                "limit": queue.limit,
+                "in_flight": queue.in_flight,
+                "queued": {p: queue.depth[p] for p in PRIORITIES},
+                "admitted": {p: queue.admitted[p] for p in PRIORITIES},
+                "rejected": {str(code): count for code, count in queue.rejected.items()},
+                "timeouts": queue.timeouts,
+                "wait_ms_p50": round(float(np.percentile(waits, 50)) * 1000, 1),
+                "wait_ms_p95": round(float(np.percentile(waits, 95)) * 1000, 1),
+                "service_s": round(queue.service_time, 2),
+            }
+        return stats
@@ -0,0 +1,226 @@
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from modules.Chunker import estimate_tokens, truncate_tokens
+from modules.Scheduler import BACKGROUND
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import random
+import sys
+
+# セッション数・保持期間・履歴のトークン上限（環境変数で調整）
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "1000"))
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "3600"))
+SESSION_TOKEN_BUDGET = int(os.environ.get("SESSION_TOKEN_BUDGET", "1500"))
+
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+class ChatMessage:
+    """
+    Compact chat message record; the token estimate is computed once on creation.
+    """
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: Optional[int] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = estimate_tokens(content) if tokens is None else tokens
+
+    def to_langchain(self) -> BaseMessage:
+        return HumanMessage(content=self.content) if self.role == USER else AIMessage(content=self.content)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content, "tokens": self.tokens}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatMessage":
+        return cls(data["role"], data["content"], data.get("tokens"))
+
+
+class SessionMemory:
+    """
+    Conversation of one session: a rolling summary of older turns plus the recent messages.
+    """
+    __slots__ = ("summary", "summary_tokens", "messages")
+
+    def __init__(self, summary: str = "", summary_tokens: int = 0, messages: Optional[List[ChatMessage]] = None):
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+        self.messages: List[ChatMessage] = messages or []
+
+    def total_tokens(self) -> int:
+        return self.summary_tokens + sum(message.tokens for message in self.messages)
+
+    def copy(self) -> "SessionMemory":
+        # ChatMessageは変更しないため、リストのみ複製すれば十分
+        return SessionMemory(self.summary, self.summary_tokens, list(self.messages))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "summary": self.summary,
+            "summary_tokens": self.summary_tokens,
+            "messages": [message.to_dict() for message in self.messages],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SessionMemory":
+        return cls(data.get("summary", ""), data.get("summary_tokens", 0),
+                   [ChatMessage.from_dict(message) for message in data.get("messages", [])])
+
+
+class SessionMemoryStore:
+    """
+    Token-bounded conversation memory on top of a SessionStore backend (in-memory, SQLite or
+    Redis; see modules.SessionStore). Once a session exceeds token_budget, the older messages
+    are folded into a rolling summary in the background, and history() never returns more
+    than token_budget tokens. Writes use the backend's per-session version, so several worker
+    processes can share one backend.
+    """
+    def __init__(self, max_sessions: int = SESSION_MAX, idle_ttl: float = SESSION_IDLE_TTL,
+                 token_budget: int = SESSION_TOKEN_BUDGET, keep_recent_messages: int = 4,
+                 clients=None, model_name: str = "elyza:jp8b", backend=None, max_retries: int = 8):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.keep_recent_messages = keep_recent_messages
+        self.clients = clients
+        self.model_name = model_name
+        self.max_retries = max_retries
+        if backend is None:
+            from modules.SessionStore import create_session_store
+            backend = create_session_store(max_sessions=max_sessions, idle_ttl=idle_ttl)
+        self.backend = backend
+        self.conflicts = 0
+        self.summaries = 0
+        self._compacting: Set[str] = set()
+        self._tasks = set()
+        self.logger = logging.getLogger(__name__)
+
+        self.summary_prompt = ChatPromptTemplate.from_messages([
+            ("system", """以下はこれまでの会話の要約と、その後の会話です。
+            後続の会話で参照できるよう、重要な事実・ユーザーの要望・決定事項を保持して簡潔な要約にまとめてください。
+
+            これまでの要約:
+            {summary}
+
+            会話:
+            {conversation}""")
+        ])
+
+    async def evict(self) -> None:
+        await self.backend.evict()
+
+    async def history(self, session_id: str) -> List[BaseMessage]:
+        """
+        Returns the summary and the newest messages that fit into the token budget.
+        """
+        memory, _ = await self.backend.load(session_id)
+        if memory is None:
+            return []
+        budget = self.token_budget - memory.summary_tokens
+        recent: List[ChatMessage] = []
+        for message in reversed(memory.messages):
+            if message.tokens > budget:
+                break
+            recent.append(message)
+            budget -= message.tokens
+
+        history: List[BaseMessage] = []
+        if memory.summary:
+            history.append(SystemMessage(content=f"これまでの会話の要約:\n{memory.summary}"))
+        history.extend(message.to_langchain() for message in reversed(recent))
+        return history
+
+    async def add_turn(self, session_id: str, query: str, response: str) -> None:
+        turn = [ChatMessage(USER, query), ChatMessage(ASSISTANT, response)]
+        # 他のワーカーと同時に書き込んだ場合は読み直して追加し直す
+        for attempt in range(self.max_retries):
+            memory, version = await self.backend.load(session_id)
+            memory = memory or SessionMemory()
+            memory.messages.extend(turn)
+            if await self.backend.save(session_id, memory, version):
+                break
+            self.conflicts += 1
+            await self._backoff(attempt)
+        else:
+            self.logger.warning(f"Failed to save conversation of session {session_id} after {self.max_retries} attempts")
+            return
+
+        if memory.total_tokens() > self.token_budget and session_id not in self._compacting:
+            self._compacting.add(session_id)
+            # 要約は応答の返却を待たせないようバックグラウンドで行う
+            task = asyncio.get_running_loop().create_task(self._compact(session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _backoff(self, attempt: int) -> None:
+        # 競合したワーカー同士が同時に再試行しないよう、ゆらぎを加えて待つ
+        await asyncio.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+
+    async def _summarize(self, summary: str, messages: List[ChatMessage]) -> str:
+        if self.clients is None:
+            from modules.Clients import get_clients
+            self.clients = get_clients()
+        chain = self.summary_prompt | self.clients.chat(self.model_name, temperature=0) | StrOutputParser()
+        conversation = "\n".join(
+            f"{'ユーザー' if message.role == USER else 'アシスタント'}: {message.content}" for message in messages
+        )
+        async with self.clients.limit(self.model_name, priority=BACKGROUND):
+            return await chain.ainvoke({"summary": summary or "なし", "conversation": conversation})
+
+    async def _apply_summary(self, session_id: str, base: SessionMemory, count: int, summary: str) -> bool:
+        """
+        Replaces the first count messages of base with summary. Returns False when another
+        writer already changed that part of the conversation, in which case the summary is dropped.
+        """
+        summary = truncate_tokens(summary, self.token_budget // 3)
+        for attempt in range(self.max_retries):
+            memory, version = await self.backend.load(session_id)
+            if (memory is None or memory.summary != base.summary or len(memory.messages) < count
+                    or memory.messages[count - 1].content != base.messages[count - 1].content):
+                return False
+            memory.summary = summary
+            memory.summary_tokens = estimate_tokens(summary)
+            # 要約中に追加された発言は残す
+            memory.messages = memory.messages[count:]
+            if await self.backend.save(session_id, memory, version):
+                return True
+            self.conflicts += 1
+            await self._backoff(attempt)
+        return False
+
+    async def _compact(self, session_id: str) -> None:
+        try:
+            # 要約中に発言が追加されて再び上限を超えた場合も続けて要約する
+            for _ in range(self.max_retries):
+                memory, _ = await self.backend.load(session_id)
+                if memory is None or memory.total_tokens() <= self.token_budget:
+                    return
+                old = memory.messages[:-self.keep_recent_messages] if self.keep_recent_messages else list(memory.messages)
+                if not old:
+                    return
+                try:
+                    summary = await self._summarize(memory.summary, old)
+                    self.summaries += 1
+                except Exception as e:
+                    # 要約に失敗した場合は古い発言を切り捨てて上限を守る
+                    self.logger.warning(f"Failed to summarize conversation: {str(e)}")
+                    summary = memory.summary
+                await self._apply_summary(session_id, memory, len(old), summary)
+        finally:
+            self._compacting.discard(session_id)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.backend.stats()
+        stats.update({
+            "token_budget": self.token_budget,
+            "summaries": self.summaries,
+            "conflicts": self.conflicts,
+        })
+        return stats
@@ -0,0 +1,259 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from modules.AsyncUtils import run_blocking
+from modules.SessionMemory import SessionMemory, SESSION_IDLE_TTL, SESSION_MAX
+from typing import Any, Dict, Optional, Tuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# 会話履歴の保存先（memory / sqlite / redis）と接続先（環境変数で調整）
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_STORE_URL = os.environ.get("SESSION_STORE_URL", "")
+
+def serialize(memory: SessionMemory) -> str:
+    return json.dumps(memory.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+def deserialize(data) -> SessionMemory:
+    return SessionMemory.from_dict(json.loads(data))
+
+
+class SessionStore(ABC):
+    """
+    Persistence backend of SessionMemoryStore. Every session carries a version that is
+    incremented on each save; save() only succeeds when the caller's version is still current
+    (optimistic concurrency), so concurrent writers reload and retry instead of overwriting.
+    """
+    @abstractmethod
+    async def load(self, session_id: str) -> Tuple[Optional[SessionMemory], int]:
+        """
+        Returns (memory, version); memory is None for unknown or expired sessions.
+        """
+
+    @abstractmethod
+    async def save(self, session_id: str, memory: SessionMemory, version: int) -> bool:
+        """
+        Stores memory if the stored version still equals version and refreshes the session TTL.
+        """
+
+    async def evict(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local store with LRU (max_sessions) and idle TTL eviction. Only suitable for a
+    single worker process.
+    """
+    def __init__(self, max_sessions: int = SESSION_MAX, idle_ttl: float = SESSION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # session_id -> (memory, version, last_used)
+        self.sessions: "OrderedDict[str, Tuple[SessionMemory, int, float]]" = OrderedDict()
+        self.evicted = 0
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        # 古い順に並んでいるので、期限内のセッションが現れた時点で打ち切る
+        while self.sessions:
+            session_id, (_, _, last_used) = next(iter(self.sessions.items()))
+            if now - last_used <= self.idle_ttl and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[session_id]
+            self.evicted += 1
+
+    async def load(self, session_id: str) -> Tuple[Optional[SessionMemory], int]:
+        self._evict()
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None, 0
+        memory, version, _ = entry
+        self.sessions[session_id] = (memory, version, time.monotonic())
+        self.sessions.move_to_end(session_id)
+        # 呼び出し側の変更が保存前に反映されないよう複製を返す
+        return memory.copy(), version
+
+    async def save(self, session_id: str, memory: SessionMemory, version: int) -> bool:
+        entry = self.sessions.get(session_id)
+        if (entry[1] if entry else 0) != version:
+            return False
+        self.sessions[session_id] = (memory, version + 1, time.monotonic())
+        self.sessions.move_to_end(session_id)
+        self._evict()
+        return True
+
+    async def evict(self) -> None:
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "evicted": self.evicted,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite (WAL) store shared by all worker processes on one host. Sessions expire idle_ttl
+    seconds after their last save; expired rows are deleted by evict().
+    """
+    def __init__(self, db_path: str = ".cache/sessions.sqlite3", idle_ttl: float = SESSION_IDLE_TTL):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.idle_ttl = idle_ttl
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+        self._conn.commit()
+
+    def _load(self, session_id: str) -> Tuple[Optional[SessionMemory], int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, data, expires_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None, 0
+        version, data, expires_at = row
+        # 期限切れの行も版数は引き継ぎ、削除前の古い版での上書きを防ぐ
+        if expires_at <= time.time():
+            return None, version
+        return deserialize(data), version
+
+    def _save(self, session_id: str, memory: SessionMemory, version: int) -> bool:
+        data = serialize(memory)
+        expires_at = time.time() + self.idle_ttl
+        with self._lock:
+            if version == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, version, data, expires_at) VALUES (?, 1, ?, ?)",
+                    (session_id, data, expires_at),
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET version = version + 1, data = ?, expires_at = ? WHERE session_id = ? AND version = ?",
+                    (data, expires_at, session_id, version),
+                )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def _evict(self) -> None:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+        self.evicted += cursor.rowcount
+
+    async def load(self, session_id: str) -> Tuple[Optional[SessionMemory], int]:
+        return await run_blocking(self._load, session_id)
+
+    async def save(self, session_id: str, memory: SessionMemory, version: int) -> bool:
+        return await run_blocking(self._save, session_id, memory, version)
+
+    async def evict(self) -> None:
+        await run_blocking(self._evict)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "idle_ttl": self.idle_ttl,
+            "evicted": self.evicted,
+        }
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Store on any server speaking the Redis protocol (Redis, Valkey, KeyDB, ...), shared across
+    hosts. Each session is a hash {version, data} with a server-side TTL; saves run in a
+    WATCH/MULTI/EXEC transaction. client can be any redis.asyncio compatible client, e.g. a
+    fakeredis instance for local testing.
+    """
+    def __init__(self, url: str = "redis://localhost:6379/0", idle_ttl: float = SESSION_IDLE_TTL,
+                 prefix: str = "elyza:session:", client=None):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.client = client
+        self.idle_ttl = idle_ttl
+        self.prefix = prefix
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    async def load(self, session_id: str) -> Tuple[Optional[SessionMemory], int]:
+        version, data = await self.client.hmget(self._key(session_id), "version", "data")
+        if data is None:
+            return None, 0
+        return deserialize(data), int(version)
+
+    async def save(self, session_id: str, memory: SessionMemory, version: int) -> bool:
+        from redis.exceptions import WatchError
+        key = self._key(session_id)
+        data = serialize(memory)
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                # WATCH後に他の書き込みがあればEXECが失敗する
+                await pipe.watch(key)
+                current = await pipe.hget(key, "version")
+                if int(current or 0) != version:
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={"version": version + 1, "data": data})
+                pipe.pexpire(key, int(self.idle_ttl * 1000))
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "idle_ttl": self.idle_ttl}
+
+
+def create_session_store(kind: str = SESSION_STORE, url: str = SESSION_STORE_URL,
+                         max_sessions: int = SESSION_MAX, idle_ttl: float = SESSION_IDLE_TTL) -> SessionStore:
+    """
+    Creates the backend selected by SESSION_STORE; SESSION_STORE_URL is the SQLite path or Redis URL.
+    """
+    if kind == "sqlite":
+        return SQLiteSessionStore(url or ".cache/sessions.sqlite3", idle_ttl=idle_ttl)
+    if kind == "redis":
+        return RedisSessionStore(url or "redis://localhost:6379/0", idle_ttl=idle_ttl)
+    if kind != "memory":
+        logging.getLogger(__name__).warning(f"Unknown session store {kind}, using in-memory store")
+    return InMemorySessionStore(max_sessions=max_sessions, idle_ttl=idle_ttl)
@@ -1,19 +1,23 @@
 from langchain.prompts import PromptTemplate
-from langchain_ollama import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from typing import Optional
 from pathlib import Path
 import logging
+from modules.AsyncUtils import run_blocking
+from modules.Clients import ClientRegistry, get_clients
+from modules.Scheduler import SchedulerBusy
 
 class DocumentSummarizer:   
-    def __init__(self, temp_file_path: Optional[str] = None):
+    def __init__(self, temp_file_path: Optional[str] = None, clients: Optional[ClientRegistry] = None):
         self.temp_file_path = temp_file_path
+        self.clients = clients or get_clients()
+        self.model_name = "elyza:jp8b"
         # loggingの設定
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         
         try:
-            self.llm = ChatOllama(model="elyza:jp8b", temperature=0)
+            self.llm = self.clients.chat(self.model_name, temperature=0)
         except Exception as e:
             self.logger.error(f"言語モデルの初期化に失敗しました: {e}")
             raise
@@ -35,51 +39,93 @@ class DocumentSummarizer:
             self.logger.error(f"ファイルの読み込みに失敗しました: {e}")
             return None
 
-    def summarize(self, query: str) -> str:
-        if not query.strip():
-            return "入力が提供されていません。"
-
-        try:
+    def _build_chain(self, query: str, document: Optional[str] = None):
+        if document is None:
             document = self._load_document() if self.temp_file_path else \
                 "要約対象となる文書を検出できませんでした。文書を添付し、メッセージでご指示ください。"
 
-            template = """あなたはプロの編集者です。以下の文書をユーザーの意図を反映させて要約してください。
+        template = """あなたはプロの編集者です。以下の文書をユーザーの意図を反映させて要約してください。
+
+        以下の点に注意してください:
+        - 重要なキーワードを漏らさない
+        - 文書の本質的な意味を保持する
+        - 架空の表現を使用しない
+        - 数値は変更しない
 
-            以下の点に注意してください:
-            - 重要なキーワードを漏らさない
-            - 文書の本質的な意味を保持する
-            - 架空の表現を使用しない
-            - 数値は変更しない
+        ユーザーのメッセージ: 
+        {user_query}
 
-            ユーザーのメッセージ: 
-            {user_query}
+        要約する文書:
+        {document}
 
-            要約する文書:
-            {document}
+        要約結果は以下の形式で出力してください：
 
-            要約結果は以下の形式で出力してください：
+        【要約】
+        （ここに要約を記載）
 
-            【要約】
-            （ここに要約を記載）
+        【要約の観点】
+        - 重視した点
+        - 抽出したキーワード
+        - 要約方針の説明
+        """
 
-            【要約の観点】
-            - 重視した点
-            - 抽出したキーワード
-            - 要約方針の説明
-            """
+        prompt = PromptTemplate(
+            input_variables=["user_query", "document"],
+            template=template
+        )
 
-            prompt = PromptTemplate(
-                input_variables=["user_query", "document"],
-                template=template
-            )
+        chain = prompt | self.llm | StrOutputParser()
 
-            chain = prompt | self.llm | StrOutputParser()
+        return chain, {
+            "user_query": query,
+            "document": document
+        }
 
-            return chain.invoke({
-                "user_query": query,
-                "document": document
-            })
+    def summarize(self, query: str) -> str:
+        if not query.strip():
+            return "入力が提供されていません。"
+
+        try:
+            chain, inputs = self._build_chain(query)
+            return chain.invoke(inputs)
             
         except Exception as e:
             self.logger.error(f"要約処理中にエラーが発生しました: {e}")
-            return f"要約処理中にエラーが発生しました: {e}"
\ No newline at end of file
+            return f"要約処理中にエラーが発生しました: {e}"
+
+    async def _abuild_chain(self, query: str):
+        # ファイル読み込みはスレッドプールで行う
+        document = await run_blocking(self._load_document) if self.temp_file_path else None
+        return self._build_chain(query, document)
+
+    async def asummarize(self, query: str) -> str:
+        if not query.strip():
+            return "入力が提供されていません。"
+
+        try:
+            chain, inputs = await self._abuild_chain(query)
+            async with self.clients.limit(self.model_name):
+                return await chain.ainvoke(inputs)
+
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            self.logger.error(f"要約処理中にエラーが発生しました: {e}")
+            return f"要約処理中にエラーが発生しました: {e}"
+
+    async def astream_summary(self, query: str):
+        if not query.strip():
+            yield "入力が提供されていません。"
+            return
+
+        try:
+            chain, inputs = await self._abuild_chain(query)
+            async with self.clients.limit(self.model_name):
+                async for chunk in chain.astream(inputs):
+                    yield chunk
+
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            self.logger.error(f"要約処理中にエラーが発生しました: {e}")
+            yield f"要約処理中にエラーが発生しました: {e}"
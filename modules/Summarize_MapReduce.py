@@ -1,28 +1,42 @@
 from langchain.prompts import ChatPromptTemplate
-from langchain_ollama import ChatOllama
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.output_parsers import StrOutputParser
 from langchain.docstore.document import Document
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pathlib import Path
+import asyncio
 import logging
+from modules.AsyncUtils import run_blocking
+from modules.Clients import ClientRegistry, get_clients
+from modules.Scheduler import BATCH, SchedulerBusy
+from modules.Metrics import stage
+from modules.Chunker import estimate_tokens, get_chunker, truncate_tokens
 
 class DocumentSummarizer:
-    def __init__(self, temp_file_path: Optional[str] = None):
+    def __init__(self, temp_file_path: Optional[str] = None, clients: Optional[ClientRegistry] = None,
+                 max_concurrency: int = 4, context_tokens: Optional[int] = None, output_tokens: int = 512,
+                 max_collapse_levels: int = 5):
         # loggingの設定
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         
         self.temp_file_path = temp_file_path
-        self.llm = ChatOllama(model="elyza:jp8b", temperature=0)
+        self.clients = clients or get_clients()
+        self.model_name = "elyza:jp8b"
+        self.llm = self.clients.chat(self.model_name, temperature=0)
+        # 部分要約（map・collapse）は出力トークン数をモデル側で制限し、統合時の入力量を抑える
+        self.partial_llm = self.clients.chat(self.model_name, temperature=0, num_predict=output_tokens)
+        # 同時に要約するチャンク数（モデルごとの同時実行数の上限も適用される）
+        self.max_concurrency = max_concurrency
+        # 統合プロンプトがモデル共通のコンテキスト長（OLLAMA_NUM_CTX）に収まるよう入力量を制限
+        self.context_tokens = min(context_tokens or self.clients.num_ctx, self.clients.num_ctx)
+        self.output_tokens = output_tokens
+        # 段階的な統合の最大回数（超えた場合は残りを切り詰めて一度に統合する）
+        self.max_collapse_levels = max_collapse_levels
 
         self.output_parser = StrOutputParser()
         
-        # テキスト分割の設定
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=200,
-            chunk_overlap=20,
-        )
+        # テキスト分割の設定（文単位で、要約用の大きめのチャンクに分割）
+        self.text_splitter = get_chunker("summarize")
         
         # プロンプトテンプレートの設定
         self.summary_prompt = ChatPromptTemplate.from_messages([
@@ -63,6 +77,18 @@ class DocumentSummarizer:
             - 要約方針の説明""")
         ])
 
+        # 部分要約が多い場合に段階的にまとめるためのプロンプト
+        self.collapse_prompt = ChatPromptTemplate.from_messages([
+            ("system", """以下は部分的な要約です。
+            ユーザーの意図を反映させながら、重要なキーワードと数値を保持して一つの要約に統合してください。
+
+            ユーザーのメッセージ:
+            {query}
+
+            部分要約:
+            {text}""")
+        ])
+
     def _load_document(self) -> Optional[str]:
         if not self.temp_file_path:
             return None
@@ -82,18 +108,103 @@ class DocumentSummarizer:
 
     def prepare_documents(self, text: str) -> list:
         try:
-            texts = self.text_splitter.split_text(text)
+            texts = self.text_splitter.split_cached(text)
             return [Document(page_content=t) for t in texts]
         except Exception as e:
             self.logger.error(f"テキスト分割中にエラーが発生しました: {e}")
             raise
 
     def map_step(self):
-        return self.summary_prompt | self.llm | self.output_parser
+        return self.summary_prompt | self.partial_llm | self.output_parser
 
     def reduce_step(self):
         return self.reduce_prompt | self.llm | self.output_parser
 
+    def collapse_step(self):
+        return self.collapse_prompt | self.partial_llm | self.output_parser
+
+    def _reduce_budget(self, query: str) -> int:
+        # 統合プロンプト自体と出力分を除いた、部分要約に使えるトークン数
+        overhead = estimate_tokens(self.reduce_prompt.format(text="", query=query))
+        return max(self.context_tokens - self.output_tokens - overhead, 256)
+
+    def group_summaries(self, summaries: List[str], query: str) -> List[List[str]]:
+        """
+        Packs summaries in order into groups whose combined size fits the reduce budget.
+        """
+        budget = self._reduce_budget(query)
+        # 区切り分（1件あたり1トークン）を含めても最大サイズの2件が予算に収まるように切り詰め、
+        # 最後のグループ以外には必ず2件以上入るようにする（統合のたびに件数がおよそ半分以下になる）
+        summaries = [truncate_tokens(summary, (budget - 2) // 2) for summary in summaries]
+
+        groups: List[List[str]] = []
+        current: List[str] = []
+        size = 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary) + 1
+            if current and size + tokens > budget:
+                groups.append(current)
+                current, size = [], 0
+            current.append(summary)
+            size += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    def fit_single_group(self, summaries: List[str], query: str) -> List[str]:
+        """
+        Truncates every summary evenly so that all of them fit into one reduce call.
+        """
+        per_summary = max(self._reduce_budget(query) // len(summaries) - 1, 1)
+        return [truncate_tokens(summary, per_summary) for summary in summaries]
+
+    def _batch(self, chain, inputs: List[Dict[str, Any]]) -> List[str]:
+        return chain.batch(inputs, config={"max_concurrency": self.max_concurrency})
+
+    async def _abatch(self, chain, inputs: List[Dict[str, Any]]) -> List[str]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(item):
+            # 部分要約はバッチ扱いとし、対話的な呼び出しを先に処理させる
+            async with semaphore, self.clients.limit(self.model_name, priority=BATCH):
+                return await chain.ainvoke(item)
+
+        return list(await asyncio.gather(*(run(item) for item in inputs)))
+
+    def map_summaries(self, docs: list, query: str) -> list:
+        # Mapステップ: 各チャンクを並列に要約
+        with stage("summarize_map"):
+            return self._batch(self.map_step(), [{"text": doc.page_content, "query": query} for doc in docs])
+
+    async def amap_summaries(self, docs: list, query: str) -> list:
+        with stage("summarize_map"):
+            return await self._abatch(self.map_step(), [{"text": doc.page_content, "query": query} for doc in docs])
+
+    def collapse_summaries(self, summaries: List[str], query: str) -> List[str]:
+        """
+        Merges groups of summaries level by level until the rest fit into a single reduce call.
+        """
+        groups = self.group_summaries(summaries, query)
+        for _ in range(self.max_collapse_levels):
+            if len(groups) <= 1:
+                return groups[0]
+            self.logger.info(f"部分要約を統合しています: {len(summaries)}件 -> {len(groups)}件")
+            with stage("summarize_collapse"):
+                summaries = self._batch(self.collapse_step(), [{"text": "\n\n".join(group), "query": query} for group in groups])
+            groups = self.group_summaries(summaries, query)
+        return groups[0] if len(groups) == 1 else self.fit_single_group(summaries, query)
+
+    async def acollapse_summaries(self, summaries: List[str], query: str) -> List[str]:
+        groups = self.group_summaries(summaries, query)
+        for _ in range(self.max_collapse_levels):
+            if len(groups) <= 1:
+                return groups[0]
+            self.logger.info(f"部分要約を統合しています: {len(summaries)}件 -> {len(groups)}件")
+            with stage("summarize_collapse"):
+                summaries = await self._abatch(self.collapse_step(), [{"text": "\n\n".join(group), "query": query} for group in groups])
+            groups = self.group_summaries(summaries, query)
+        return groups[0] if len(groups) == 1 else self.fit_single_group(summaries, query)
+
     def summarize(self, query: str = "この文書を要約してください") -> str:
         try:
             # ファイルから文書を読み込む
@@ -106,22 +217,13 @@ class DocumentSummarizer:
                 
             # ドキュメントの準備
             docs = self.prepare_documents(content)
-            
-            # Mapステップ: 各チャンクを要約
-            map_chain = self.map_step()
-            individual_summaries = []
-            
-            for doc in docs:
-                summary = map_chain.invoke({
-                    "text": doc.page_content,
-                    "query": query
-                })
-                individual_summaries.append(summary)
+            individual_summaries = self.map_summaries(docs, query)
             
             # Reduceステップ: 要約を統合
             if len(individual_summaries) == 1:
                 return individual_summaries[0]
-                
+
+            individual_summaries = self.collapse_summaries(individual_summaries, query)
             reduce_chain = self.reduce_step()
             final_summary = reduce_chain.invoke({
                 "text": "\n\n".join(individual_summaries),
@@ -133,3 +235,67 @@ class DocumentSummarizer:
         except Exception as e:
             self.logger.error(f"要約処理中にエラーが発生しました: {e}")
             return f"要約処理中にエラーが発生しました: {e}"
+
+    async def asummarize(self, query: str = "この文書を要約してください") -> str:
+        try:
+            content = await run_blocking(self._load_document)
+            if content is None:
+                return "文書の読み込みに失敗しました。"
+
+            if not content.strip():
+                return "文書が空です。"
+
+            docs = self.prepare_documents(content)
+            individual_summaries = await self.amap_summaries(docs, query)
+
+            if len(individual_summaries) == 1:
+                return individual_summaries[0]
+
+            individual_summaries = await self.acollapse_summaries(individual_summaries, query)
+            reduce_chain = self.reduce_step()
+            async with self.clients.limit(self.model_name):
+                return await reduce_chain.ainvoke({
+                    "text": "\n\n".join(individual_summaries),
+                    "query": query
+                })
+
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            self.logger.error(f"要約処理中にエラーが発生しました: {e}")
+            return f"要約処理中にエラーが発生しました: {e}"
+
+    async def astream_summary(self, query: str = "この文書を要約してください"):
+        try:
+            content = await run_blocking(self._load_document)
+            if content is None:
+                yield "文書の読み込みに失敗しました。"
+                return
+
+            if not content.strip():
+                yield "文書が空です。"
+                return
+
+            docs = self.prepare_documents(content)
+            individual_summaries = await self.amap_summaries(docs, query)
+
+            if len(individual_summaries) == 1:
+                yield individual_summaries[0]
+                return
+
+            individual_summaries = await self.acollapse_summaries(individual_summaries, query)
+
+            # 統合結果のみをトークン単位で返す
+            reduce_chain = self.reduce_step()
+            async with self.clients.limit(self.model_name):
+                async for chunk in reduce_chain.astream({
+                    "text": "\n\n".join(individual_summaries),
+                    "query": query
+                }):
+                    yield chunk
+
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            self.logger.error(f"要約処理中にエラーが発生しました: {e}")
+            yield f"要約処理中にエラーが発生しました: {e}"
@@ -1,16 +1,32 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from modules.Clients import ClientRegistry, get_clients
+from modules.TaskRouter import TaskRouter, get_router, normalize_query
+from modules.Cache import LRUCache
 from pydantic import BaseModel
 from langchain_core.prompts import ChatPromptTemplate
 import instructor
 from typing import Literal
 import os
+import hashlib
+import logging
+from modules.AsyncUtils import run_blocking
+from modules.Metrics import record_cache, record_completion_usage
 
 class TaskDetail(BaseModel):
     Task: Literal["task1", "task2", "task3", "task4"]
 
+# ルーティング結果のキャッシュ（件数と有効期間は環境変数で調整）
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "1024"))
+ROUTE_CACHE_TTL = float(os.environ.get("ROUTE_CACHE_TTL", "3600"))
+_route_cache = LRUCache(max_size=ROUTE_CACHE_SIZE, ttl=ROUTE_CACHE_TTL)
+
+def get_route_cache() -> LRUCache:
+    return _route_cache
+
 class TaskHandler:
-    def __init__(self, base_url="http://localhost:11434/v1", api_key="ollama", directory="uploads"):
-        self.prompt_template = ChatPromptTemplate.from_template("""
+    def __init__(self, base_url=None, api_key="ollama", directory="uploads", clients: ClientRegistry = None,
+                 router: TaskRouter = None, use_router: bool = True, route_cache: LRUCache = None):
+        self.template = """
             あなたは高性能な言語モデルです。タスクは、4種類です:
             1. 通常の会話（参照テキストはありません）
             2. 参照テキストに基づくQ&A (参照テキストがあります)
@@ -29,33 +45,74 @@ class TaskHandler:
             {input}
 
             回答:
-        """)
-        
-        self.client = instructor.from_openai(
-            OpenAI(
-                base_url=base_url,
-                api_key=api_key,
-            ),
-            mode=instructor.Mode.JSON,
-        )
+        """
+        self.prompt_template = ChatPromptTemplate.from_template(self.template)
+
+        self.clients = clients or get_clients()
+        if base_url is None:
+            # アプリ共通のクライアントを使い回す
+            self.client = self.clients.instructor_client()
+            self.async_client = self.clients.async_instructor_client()
+        else:
+            self.client = instructor.from_openai(
+                OpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                ),
+                mode=instructor.Mode.JSON,
+            )
+            # イベントループをブロックしないための非同期クライアント
+            self.async_client = instructor.from_openai(
+                AsyncOpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                ),
+                mode=instructor.Mode.JSON,
+            )
+        self.model_name = "elyza:jp8b"
         self.directory = directory
-
-    def search_file(self, filename):
+        # プロンプトやモデルを変更した場合は以前のキャッシュを使わない
+        self.template_version = hashlib.sha256(f"{self.model_name}\n{self.template}".encode("utf-8")).hexdigest()[:16]
+        self.route_cache = route_cache if route_cache is not None else get_route_cache()
+        # 確信度の高いクエリはLLMを呼ばずにローカルで判定
+        self.router = (router or get_router(self.clients.embeddings("nomic-embed-text"))) if use_router else None
+        self.logger = logging.getLogger(__name__)
+
+    def has_reference(self, filename):
         """
-        Searches for a specified file in the directory and its subdirectories.
+        Checks whether a non-empty reference file exists without reading its contents.
         """
         for root, dirs, files in os.walk(self.directory):
             if filename in files:
-                with open(os.path.join(root, filename), 'r', encoding='utf-8') as f:
-                    return f.read()
-        return None
+                return os.path.getsize(os.path.join(root, filename)) > 0
+        return False
+
+    def _cache_key(self, query, has_reference):
+        return (self.template_version, normalize_query(query), has_reference)
 
     def process_query(self, query, filename="temp_combined.txt"):
         """
         Processes the user's query and determines the task based on the presence of a specified file.
         """
-        reference_text = self.search_file(filename)
-        reference_status = "参照テキストあり" if reference_text else "参照テキストなし"
+        has_reference = self.has_reference(filename)
+        if self.router is not None:
+            decision = self.router.route_by_rules(query, has_reference)
+            if decision is not None:
+                self.logger.info(f"Routed locally ({decision.tier}, confidence={decision.confidence:.2f})")
+                return decision.Task
+        cache_key = self._cache_key(query, has_reference)
+        cached = self.route_cache.get(cache_key)
+        record_cache("route", cached is not None)
+        if cached is not None:
+            return cached
+        # 非同期版と同じ順（ルール → キャッシュ → 埋め込み → LLM）で判定する
+        if self.router is not None:
+            decision = self.router.route_by_embedding(query, has_reference)
+            if decision is not None:
+                self.logger.info(f"Routed locally ({decision.tier}, confidence={decision.confidence:.2f})")
+                self.route_cache.put(cache_key, decision.Task)
+                return decision.Task
+        reference_status = "参照テキストあり" if has_reference else "参照テキストなし"
 
         # Prepare the input for the prompt
         prompt_content = self.prompt_template.format(reference=reference_status, input=query)
@@ -66,9 +123,50 @@ class TaskHandler:
             messages=[{"role": "user", "content": prompt_content}],
             response_model=TaskDetail,
         )
+        record_completion_usage("elyza:jp8b", response)
 
         # Validate and return the task, with a default in case of unexpected output
         task = response.Task if response.Task in ["task1", "task2", "task3", "task4"] else "task1"  # デフォルト: task1
+        self.route_cache.put(cache_key, task)
+        return task
+
+    async def aprocess_query(self, query, filename="temp_combined.txt", has_reference=None):
+        """
+        Async version of process_query. has_reference overrides the file check when given.
+        """
+        if has_reference is None:
+            has_reference = await run_blocking(self.has_reference, filename)
+        # ルール判定はキャッシュより安価なので先に行う
+        if self.router is not None:
+            decision = self.router.route_by_rules(query, has_reference)
+            if decision is not None:
+                self.logger.info(f"Routed locally ({decision.tier}, confidence={decision.confidence:.2f})")
+                return decision.Task
+        cache_key = self._cache_key(query, has_reference)
+        cached = self.route_cache.get(cache_key)
+        record_cache("route", cached is not None)
+        if cached is not None:
+            return cached
+        if self.router is not None:
+            decision = await self.router.aroute_by_embedding(query, has_reference)
+            if decision is not None:
+                self.logger.info(f"Routed locally ({decision.tier}, confidence={decision.confidence:.2f})")
+                self.route_cache.put(cache_key, decision.Task)
+                return decision.Task
+        reference_status = "参照テキストあり" if has_reference else "参照テキストなし"
+
+        prompt_content = self.prompt_template.format(reference=reference_status, input=query)
+
+        async with self.clients.limit(self.model_name):
+            response = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt_content}],
+                response_model=TaskDetail,
+            )
+        record_completion_usage(self.model_name, response)
+
+        task = response.Task if response.Task in ["task1", "task2", "task3", "task4"] else "task1"  # デフォルト: task1
+        self.route_cache.put(cache_key, task)
         return task
     
 
@@ -0,0 +1,173 @@
+from pydantic import BaseModel
+from typing import Dict, List, Literal, Optional
+import numpy as np
+import asyncio
+import logging
+import re
+import unicodedata
+
+class RouteDecision(BaseModel):
+    Task: Literal["task1", "task2", "task3", "task4"]
+    tier: Literal["rule", "embedding"]
+    confidence: float
+
+# キーワードによる判定ルール（正規化後の小文字表記で照合）
+# 「今日は」（挨拶）や「web」（ウェブサイトの作り方など）のように他の意味にも取れる語は含めない
+TASK_KEYWORDS: Dict[str, List[str]] = {
+    "task1": ["こんにちは", "こんばんは", "おはよう", "ありがとう", "よろしく", "元気", "あなたは誰", "自己紹介", "雑談", "はじめまして"],
+    "task2": ["この文書", "この資料", "このファイル", "このpdf", "添付", "ドキュメント", "文書では", "文書によると", "資料では",
+              "資料によると", "記載", "書かれて", "本文", "アップロード", "アップロードした", "添付した", "文中"],
+    "task3": ["要約", "まとめ", "要点", "概要", "サマリ", "かいつまんで", "3行で", "三行で", "手短に", "箇条書き", "整理して"],
+    "task4": ["最新", "今日の", "ニュース", "天気", "株価", "為替", "現在の", "速報", "検索して", "調べて", "今年", "昨日", "今週",
+              "ネットで"],
+}
+
+# それだけで意図が明確な語（2語分として数える）
+STRONG_KEYWORDS = {
+    "こんにちは", "こんばんは", "おはよう", "はじめまして", "自己紹介", "あなたは誰",
+    "この文書", "この資料", "このファイル", "このpdf", "文書によると", "資料によると", "アップロードした", "添付した",
+    "要約", "サマリ", "かいつまんで", "3行で", "三行で",
+    "検索して", "速報",
+}
+
+# 一致が2語分未満、または次点との差が1語分未満の場合は確定せず、埋め込み・LLMに任せる
+MIN_RULE_HITS = 2
+MIN_RULE_MARGIN = 1.0
+
+# 「この文書を要約して」のように文書への言及と要約指示が重なる場合は要約を優先
+TASK_WEIGHTS: Dict[str, float] = {"task1": 1.0, "task2": 1.0, "task3": 2.0, "task4": 1.0}
+
+# 埋め込み類似度による判定に使う代表クエリ
+TASK_PROTOTYPES: Dict[str, List[str]] = {
+    "task1": ["こんにちは、調子はどうですか", "おすすめの本を教えて", "敬語の使い方を教えてください", "短い詩を書いて",
+              "プログラミングの勉強方法についてアドバイスをください", "ありがとう、助かりました"],
+    "task2": ["この文書に書かれている条件は何ですか", "資料の中で説明されている手順を教えて", "契約書の解約条項について教えてください",
+              "マニュアルに記載の設定方法は", "文書の第3章では何が述べられていますか", "添付ファイルの売上の数値はいくつですか"],
+    "task3": ["この文書を要約してください", "資料の要点を3つにまとめて", "内容を簡潔にまとめてください",
+              "全体の概要を教えて", "重要なポイントを短く整理して"],
+    "task4": ["今日の東京の天気は", "最新のAI関連ニュースを教えて", "現在のドル円の為替レートは",
+              "今年のノーベル賞受賞者は誰", "最近発表された新製品について調べて"],
+}
+
+# 参照テキストが必要なタスク
+REFERENCE_TASKS = {"task2", "task3"}
+
+def normalize_query(query: str) -> str:
+    # 全角・半角の揺れと空白を吸収
+    text = unicodedata.normalize("NFKC", query).lower()
+    return re.sub(r"\s+", "", text)
+
+
+class TaskRouter:
+    """
+    Routes queries locally with keyword rules, then embedding similarity to prototype queries.
+    Returns None when neither tier is confident, so the caller can fall back to the LLM.
+    """
+    def __init__(self, embeddings=None, min_similarity: float = 0.75, min_margin: float = 0.05):
+        self.embeddings = embeddings
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.logger = logging.getLogger(__name__)
+
+        self._prototype_matrix: Optional[np.ndarray] = None
+        self._prototype_labels: List[str] = [task for task, texts in TASK_PROTOTYPES.items() for _ in texts]
+        self._prototype_lock = asyncio.Lock()
+
+    def _allowed(self, has_reference: bool) -> List[str]:
+        return [task for task in TASK_KEYWORDS if has_reference or task not in REFERENCE_TASKS]
+
+    def route_by_rules(self, query: str, has_reference: bool) -> Optional[RouteDecision]:
+        text = normalize_query(query)
+        counts = {
+            task: sum(2 if keyword in STRONG_KEYWORDS else 1 for keyword in keywords if keyword in text)
+            for task, keywords in TASK_KEYWORDS.items()
+        }
+        allowed = self._allowed(has_reference)
+        # 文書がないのに文書への言及がある場合（「この文書の最新版は」など）は判定しない
+        if any(counts[task] for task in TASK_KEYWORDS if task not in allowed):
+            return None
+        hits = {task: TASK_WEIGHTS[task] * counts[task] for task in allowed}
+        ranked = sorted(hits.items(), key=lambda item: item[1], reverse=True)
+        (best, best_hits), (_, second_hits) = ranked[0], ranked[1]
+        # 一つのタスクだけが明確に優勢な場合のみ確定
+        if counts[best] < MIN_RULE_HITS or best_hits - second_hits < MIN_RULE_MARGIN:
+            return None
+        confidence = best_hits / (best_hits + second_hits)
+        return RouteDecision(Task=best, tier="rule", confidence=confidence)
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def _prototype_texts() -> List[str]:
+        return [text for texts in TASK_PROTOTYPES.values() for text in texts]
+
+    async def _prototypes(self) -> np.ndarray:
+        async with self._prototype_lock:
+            if self._prototype_matrix is None:
+                vectors = await self.embeddings.aembed_documents(self._prototype_texts())
+                self._prototype_matrix = self._normalize_rows(np.asarray(vectors, dtype=np.float32))
+            return self._prototype_matrix
+
+    def classify_vector(self, query_vector: np.ndarray, prototypes: np.ndarray,
+                        has_reference: bool) -> Optional[RouteDecision]:
+        query_vector = query_vector / max(np.linalg.norm(query_vector), 1e-12)
+        similarities = prototypes @ query_vector
+        allowed = set(self._allowed(has_reference))
+
+        # タスクごとに最も近い代表クエリの類似度を採用
+        scores: Dict[str, float] = {}
+        for label, similarity in zip(self._prototype_labels, similarities):
+            if label in allowed:
+                scores[label] = max(scores.get(label, -1.0), float(similarity))
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (best, best_score), (_, second_score) = ranked[0], ranked[1]
+        if best_score < self.min_similarity or best_score - second_score < self.min_margin:
+            return None
+        return RouteDecision(Task=best, tier="embedding", confidence=best_score)
+
+    def route_by_embedding(self, query: str, has_reference: bool) -> Optional[RouteDecision]:
+        """
+        Synchronous version of aroute_by_embedding, for TaskHandler.process_query.
+        """
+        if self.embeddings is None:
+            return None
+        try:
+            # 同時に初期化されても結果は同じため、非同期版のロックは使わない
+            if self._prototype_matrix is None:
+                vectors = self.embeddings.embed_documents(self._prototype_texts())
+                self._prototype_matrix = self._normalize_rows(np.asarray(vectors, dtype=np.float32))
+            query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        except Exception as e:
+            self.logger.warning(f"Embedding router unavailable: {str(e)}")
+            return None
+        return self.classify_vector(query_vector, self._prototype_matrix, has_reference)
+
+    async def aroute_by_embedding(self, query: str, has_reference: bool) -> Optional[RouteDecision]:
+        if self.embeddings is None:
+            return None
+        try:
+            prototypes = await self._prototypes()
+            query_vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        except Exception as e:
+            self.logger.warning(f"Embedding router unavailable: {str(e)}")
+            return None
+        return self.classify_vector(query_vector, prototypes, has_reference)
+
+    async def aroute(self, query: str, has_reference: bool) -> Optional[RouteDecision]:
+        decision = self.route_by_rules(query, has_reference)
+        if decision is None:
+            decision = await self.aroute_by_embedding(query, has_reference)
+        return decision
+
+
+_shared_router: Optional[TaskRouter] = None
+
+def get_router(embeddings=None) -> TaskRouter:
+    # 代表クエリの埋め込みをプロセス内で使い回す
+    global _shared_router
+    if _shared_router is None:
+        _shared_router = TaskRouter(embeddings=embeddings)
+    return _shared_router
@@ -0,0 +1,126 @@
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel
+from typing import List, Optional
+from modules.AsyncUtils import run_blocking
+import numpy as np
+import faiss
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class IndexSettings(BaseModel):
+    """
+    Vector count thresholds for switching index types, and the build/search knobs of each type.
+    """
+    # この件数以上でHNSW、さらに多ければIVF-PQに切り替える
+    hnsw_threshold: int = int(os.environ.get("VECTOR_HNSW_THRESHOLD", "20000"))
+    ivfpq_threshold: int = int(os.environ.get("VECTOR_IVFPQ_THRESHOLD", "200000"))
+    # HNSW: Mとef_constructionを大きくすると再現率とメモリ・構築時間が増える
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 80
+    hnsw_ef_search: int = 64
+    # IVF-PQ: nlistは未指定なら件数から決定、pq_dimsはサブ量子化器1つあたりの次元数
+    ivf_nlist: Optional[int] = None
+    ivf_nprobe: int = 16
+    pq_dims: int = 8
+    pq_bits: int = 8
+    train_sample: int = 100000
+
+DEFAULT_INDEX_SETTINGS = IndexSettings()
+
+def _to_matrix(vectors) -> np.ndarray:
+    return np.asarray(vectors, dtype=np.float32)
+
+def embed_texts(texts: List[str], embeddings: Embeddings) -> np.ndarray:
+    # キャッシュ付き埋め込みなら行列のまま受け取る
+    if hasattr(embeddings, "embed_matrix"):
+        return embeddings.embed_matrix(texts)
+    return _to_matrix(embeddings.embed_documents(texts))
+
+async def aembed_texts(texts: List[str], embeddings: Embeddings) -> np.ndarray:
+    if hasattr(embeddings, "aembed_matrix"):
+        return await embeddings.aembed_matrix(texts)
+    return _to_matrix(await embeddings.aembed_documents(texts))
+
+def index_type(count: int, settings: IndexSettings = DEFAULT_INDEX_SETTINGS) -> str:
+    # PQの学習には符号帳1つあたり39件以上のデータが必要
+    if count >= max(settings.ivfpq_threshold, 39 * 2 ** settings.pq_bits):
+        return "ivfpq"
+    if count >= settings.hnsw_threshold:
+        return "hnsw"
+    return "flat"
+
+def _pq_subquantizers(dim: int, pq_dims: int) -> int:
+    # 次元数を割り切れるサブ量子化器の数のうち、指定した次元幅に最も近いもの
+    candidates = [m for m in range(1, dim + 1) if dim % m == 0]
+    return min(candidates, key=lambda m: abs(dim / m - pq_dims))
+
+def apply_search_settings(index, settings: IndexSettings = DEFAULT_INDEX_SETTINGS) -> None:
+    """
+    Applies query-time knobs (efSearch / nprobe) to a built or loaded index.
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.hnsw_ef_search
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = settings.ivf_nprobe
+
+def create_index(matrix: np.ndarray, settings: IndexSettings = DEFAULT_INDEX_SETTINGS):
+    """
+    Returns an empty (trained, if needed) FAISS index suited to the number of vectors in matrix.
+    """
+    count, dim = matrix.shape
+    kind = index_type(count, settings)
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings.hnsw_m)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+    else:
+        # クラスタあたり39件以上の学習データを確保できる範囲でnlistを決める
+        nlist = settings.ivf_nlist or int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, min(count, settings.train_sample) // 39))
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim, settings.pq_dims), settings.pq_bits)
+        sample = matrix
+        if count > settings.train_sample:
+            rows = np.random.default_rng(0).choice(count, settings.train_sample, replace=False)
+            sample = matrix[np.sort(rows)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    apply_search_settings(index, settings)
+    logger.info(f"Using {kind} index for {count} vectors")
+    return index
+
+def faiss_from_matrix(documents: List[Document], matrix: np.ndarray, embeddings: Embeddings,
+                      settings: Optional[IndexSettings] = None) -> FAISS:
+    """
+    Builds a FAISS store from documents and their precomputed embedding matrix.
+    """
+    texts = [doc.page_content for doc in documents]
+    db = FAISS(
+        embedding_function=embeddings,
+        index=create_index(matrix, settings or DEFAULT_INDEX_SETTINGS),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    db.add_embeddings(list(zip(texts, matrix)), metadatas=[doc.metadata for doc in documents])
+    return db
+
+def build_faiss(documents: List[Document], embeddings: Embeddings,
+                settings: Optional[IndexSettings] = None) -> FAISS:
+    """
+    Builds a FAISS store from documents, embedding them through the batched executor.
+    The index type follows the document count (see IndexSettings).
+    """
+    matrix = embed_texts([doc.page_content for doc in documents], embeddings)
+    return faiss_from_matrix(documents, matrix, embeddings, settings)
+
+async def abuild_faiss(documents: List[Document], embeddings: Embeddings,
+                       settings: Optional[IndexSettings] = None) -> FAISS:
+    matrix = await aembed_texts([doc.page_content for doc in documents], embeddings)
+    # HNSWの構築やIVF-PQの学習はイベントループを止めないようスレッドプールで行う
+    return await run_blocking(faiss_from_matrix, documents, matrix, embeddings, settings)
@@ -0,0 +1,208 @@
+from modules.TaskRouter import normalize_query
+from modules.Metrics import record_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# 検索結果・ページの保持期間とキャッシュ全体のサイズ上限（環境変数で調整）
+WEB_SEARCH_CACHE_TTL = float(os.environ.get("WEB_SEARCH_CACHE_TTL", "3600"))
+WEB_PAGE_CACHE_TTL = float(os.environ.get("WEB_PAGE_CACHE_TTL", "86400"))
+WEB_CACHE_MAX_BYTES = int(os.environ.get("WEB_CACHE_MAX_MB", "256")) * 1024 ** 2
+
+class WebCache:
+    """
+    SQLite-backed two-level cache for web search: search results keyed by the normalized query
+    and search settings, and pages (extracted text, chunks and chunk embeddings) keyed by URL
+    with their ETag/Last-Modified. Stale pages are kept for conditional revalidation; the least
+    recently used entries are evicted once the stored size exceeds max_bytes.
+    """
+    def __init__(self, db_path: str = ".cache/web.sqlite3", search_ttl: float = WEB_SEARCH_CACHE_TTL,
+                 page_ttl: float = WEB_PAGE_CACHE_TTL, max_bytes: int = WEB_CACHE_MAX_BYTES):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.search_ttl = search_ttl
+        self.page_ttl = page_ttl
+        self.max_bytes = max_bytes
+        self.hits = {"search": 0, "page": 0}
+        self.misses = {"search": 0, "page": 0}
+        self.revalidated = 0
+        self.evicted = 0
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                title TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                chunks TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vectors BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def search_key(query: str, settings: Dict[str, Any]) -> str:
+        # 表記揺れを吸収したクエリと検索条件（地域・期間など）をまとめてハッシュ化
+        payload = json.dumps([normalize_query(query), settings], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_search(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results FROM searches WHERE key = ? AND created_at > ?", (key, now - self.search_ttl)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE searches SET last_used = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        record_cache("web_search", row is not None)
+        if row is None:
+            self.misses["search"] += 1
+            return None
+        self.hits["search"] += 1
+        return json.loads(row[0])
+
+    def put_search(self, key: str, results: List[Dict[str, Any]]) -> None:
+        data = json.dumps(results, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (key, results, created_at, last_used, size) VALUES (?, ?, ?, ?, ?)",
+                (key, data, now, now, len(data.encode("utf-8"))),
+            )
+            self._conn.commit()
+        self.evict()
+
+    def get_page(self, url: str, version: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached page for url, including stale ones (fresh=False) so they can be
+        revalidated, or None when missing or built with another chunking/embedding version.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, etag, last_modified, chunks, dim, vectors, fetched_at FROM pages WHERE url = ? AND version = ?",
+                (url, version),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE pages SET last_used = ? WHERE url = ?", (now, url))
+                self._conn.commit()
+        if row is None:
+            self.misses["page"] += 1
+            record_cache("web_page", False)
+            return None
+        title, etag, last_modified, chunks, dim, vectors, fetched_at = row
+        fresh = now - fetched_at < self.page_ttl
+        record_cache("web_page", fresh)
+        if fresh:
+            self.hits["page"] += 1
+        return {
+            "title": title,
+            "etag": etag,
+            "last_modified": last_modified,
+            "chunks": json.loads(chunks),
+            "vectors": np.frombuffer(vectors, dtype=np.float32).reshape(-1, dim) if dim else None,
+            "fresh": fresh,
+        }
+
+    def put_page(self, url: str, version: str, title: str, chunks: List[str], vectors: Optional[np.ndarray],
+                 etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        data = json.dumps(chunks, ensure_ascii=False)
+        blob = np.ascontiguousarray(vectors, dtype=np.float32).tobytes() if vectors is not None else b""
+        dim = int(vectors.shape[1]) if vectors is not None else 0
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO pages
+                   (url, version, title, etag, last_modified, chunks, dim, vectors, fetched_at, last_used, size)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (url, version, title, etag, last_modified, data, dim, blob, now, now,
+                 len(data.encode("utf-8")) + len(blob)),
+            )
+            self._conn.commit()
+        self.evict()
+
+    def touch_page(self, url: str) -> None:
+        # 304 Not Modifiedで内容が変わっていないことを確認できたページの期限を延長
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ?, last_used = ? WHERE url = ?", (now, now, url))
+            self._conn.commit()
+        self.revalidated += 1
+
+    def evict(self) -> None:
+        with self._lock:
+            # 期限切れの検索結果は再利用しないため先に削除
+            cursor = self._conn.execute("DELETE FROM searches WHERE created_at <= ?", (time.time() - self.search_ttl,))
+            self.evicted += cursor.rowcount
+            total = self._conn.execute(
+                "SELECT (SELECT COALESCE(SUM(size), 0) FROM searches) + (SELECT COALESCE(SUM(size), 0) FROM pages)"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                # 上限の9割まで、最後に使われたのが古いものから削除
+                rows = self._conn.execute(
+                    "SELECT 'searches', key, size, last_used FROM searches "
+                    "UNION ALL SELECT 'pages', url, size, last_used FROM pages ORDER BY last_used"
+                ).fetchall()
+                for table, key, size, _ in rows:
+                    if total <= self.max_bytes * 0.9:
+                        break
+                    column = "key" if table == "searches" else "url"
+                    self._conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+                    total -= size
+                    self.evicted += 1
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            searches, pages, size = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM searches), (SELECT COUNT(*) FROM pages), "
+                "(SELECT COALESCE(SUM(size), 0) FROM searches) + (SELECT COALESCE(SUM(size), 0) FROM pages)"
+            ).fetchone()
+        return {
+            "searches": searches,
+            "pages": pages,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "revalidated": self.revalidated,
+            "evicted": self.evicted,
+        }
+
+
+_shared_cache: Optional[WebCache] = None
+_shared_lock = threading.Lock()
+
+def get_web_cache() -> WebCache:
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = WebCache()
+        return _shared_cache
@@ -0,0 +1,214 @@
+from html.parser import HTMLParser
+from langchain_core.documents import Document
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+import asyncio
+import codecs
+import httpx
+import logging
+import os
+import re
+import time
+
+# ページ取得のタイムアウト・サイズ上限・同時接続数（環境変数で調整）
+WEB_CONNECT_TIMEOUT = float(os.environ.get("WEB_CONNECT_TIMEOUT", "3"))
+WEB_READ_TIMEOUT = float(os.environ.get("WEB_READ_TIMEOUT", "5"))
+WEB_MAX_BYTES = int(os.environ.get("WEB_MAX_BYTES", str(2 * 1024 ** 2)))
+WEB_PER_HOST_LIMIT = int(os.environ.get("WEB_PER_HOST_LIMIT", "2"))
+WEB_FETCH_DEADLINE = float(os.environ.get("WEB_FETCH_DEADLINE", "8"))
+
+CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_-]+)""", re.IGNORECASE)
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "head"}
+BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+              "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "header", "footer"}
+
+class TextExtractor(HTMLParser):
+    """
+    Incremental HTML to text extractor: feed() decoded chunks as they arrive and read text()
+    at any point, so a page cut off by the size cap or the deadline still yields its text so far.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.title = ""
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        # 行内の連続する空白と空行をまとめる
+        lines = (" ".join(line.split()) for line in "".join(self.parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+
+def _sniff_encoding(response: httpx.Response, head: bytes) -> str:
+    # Content-Typeのcharset、なければ<meta charset>、どちらもなければUTF-8
+    encoding = response.charset_encoding
+    if not encoding:
+        match = CHARSET_PATTERN.search(head)
+        encoding = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        codecs.lookup(encoding)
+        return encoding
+    except LookupError:
+        return "utf-8"
+
+
+class WebFetcher:
+    """
+    Concurrent page fetcher on a shared pooled httpx.AsyncClient. Each fetch is limited by
+    connect/read timeouts, max_bytes and a per-host concurrency limit, and the HTML is parsed
+    while it streams in. fetch_all() returns whatever is available when the deadline expires.
+    """
+    def __init__(self, client: httpx.AsyncClient, per_host_limit: int = WEB_PER_HOST_LIMIT,
+                 connect_timeout: float = WEB_CONNECT_TIMEOUT, read_timeout: float = WEB_READ_TIMEOUT,
+                 max_bytes: int = WEB_MAX_BYTES, deadline: float = WEB_FETCH_DEADLINE):
+        self.client = client
+        self.per_host_limit = per_host_limit
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.logger = logging.getLogger(__name__)
+        # host -> [semaphore, 待機中・実行中の取得数]
+        self._hosts: Dict[str, list] = {}
+
+    @asynccontextmanager
+    async def _host_slot(self, url: str):
+        host = urlsplit(url).netloc
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.per_host_limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            # 取得中のものがなくなったホストは取り除き、長時間の稼働で辞書が増え続けないようにする
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host]
+
+    async def _fetch(self, url: str, extractor: TextExtractor, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        async with self._host_slot(url):
+            async with self.client.stream("GET", url, headers=headers, timeout=self.timeout,
+                                          follow_redirects=True) as response:
+                info = {
+                    "status": response.status_code,
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                }
+                # 条件付きリクエストで未更新の場合は本文を受け取らない
+                if response.status_code == 304:
+                    return info
+                response.raise_for_status()
+                content_type = response.headers.get("content-type", "text/html")
+                if "html" not in content_type and not content_type.startswith("text/"):
+                    raise ValueError(f"Unsupported content type: {content_type}")
+
+                decoder = None
+                head = b""
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    chunk = chunk[:self.max_bytes - received]
+                    received += len(chunk)
+                    if decoder is None:
+                        # 文字コードは先頭部分から判定し、以降は逐次デコードしてパーサーに渡す
+                        head += chunk
+                        if len(head) < 1024 and received < self.max_bytes:
+                            continue
+                        decoder = codecs.getincrementaldecoder(_sniff_encoding(response, head))(errors="replace")
+                        chunk = head
+                    extractor.feed(decoder.decode(chunk))
+                    if received >= self.max_bytes:
+                        self.logger.info(f"Truncated {url} at {self.max_bytes} bytes")
+                        break
+
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder(_sniff_encoding(response, head))(errors="replace")
+                    extractor.feed(decoder.decode(head))
+                extractor.feed(decoder.decode(b"", final=True))
+                return info
+
+    def _document(self, url: str, extractor: TextExtractor) -> Optional[Document]:
+        text = extractor.text()
+        if not text:
+            return None
+        return Document(page_content=text, metadata={"source": url, "title": " ".join(extractor.title.split())})
+
+    async def fetch(self, url: str) -> Optional[Document]:
+        extractor = TextExtractor()
+        try:
+            await self._fetch(url, extractor)
+        except Exception as e:
+            self.logger.warning(f"Error fetching URL {url}: {str(e)}")
+            return None
+        return self._document(url, extractor)
+
+    async def fetch_all(self, urls: List[str], deadline: Optional[float] = None,
+                        validators: Optional[Dict[str, Dict[str, str]]] = None) -> List[Document]:
+        """
+        Fetches urls concurrently and returns their documents in the given order. Fetches that
+        are still running when the deadline expires are cancelled; the text parsed so far is kept
+        and marked with metadata["partial"]. validators maps a url to conditional request headers
+        (If-None-Match / If-Modified-Since); unchanged pages come back empty with
+        metadata["not_modified"].
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        if not urls:
+            return []
+        deadline = self.deadline if deadline is None else deadline
+        validators = validators or {}
+        extractors = {url: TextExtractor() for url in urls}
+        tasks = {url: asyncio.create_task(self._fetch(url, extractors[url], validators.get(url))) for url in urls}
+
+        start = time.perf_counter()
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.logger.info(f"Fetch deadline of {deadline}s reached, {len(pending)} of {len(urls)} pages incomplete")
+
+        documents = []
+        for url, task in tasks.items():
+            info = {}
+            if task in done and task.exception() is not None:
+                # 読み込み途中で失敗した場合も、それまでに解析できた本文は使う
+                self.logger.warning(f"Error fetching URL {url}: {str(task.exception())}")
+            elif task in done:
+                info = task.result()
+                if info["status"] == 304:
+                    documents.append(Document(page_content="", metadata={"source": url, "not_modified": True}))
+                    continue
+            document = self._document(url, extractors[url])
+            if document is not None:
+                document.metadata.update({
+                    "etag": info.get("etag"),
+                    "last_modified": info.get("last_modified"),
+                    "partial": not info,
+                })
+                documents.append(document)
+        self.logger.info(f"Fetched {len(documents)}/{len(urls)} pages in {time.perf_counter() - start:.2f}s")
+        return documents
@@ -1,20 +1,22 @@
-from langchain_ollama import ChatOllama
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.utilities.duckduckgo_search import DuckDuckGoSearchAPIWrapper
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.callbacks import CallbackManagerForToolRun
 from langchain.tools import BaseTool
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from pydantic import BaseModel, Field
-import os
-from fake_useragent import UserAgent
-
-os.environ['USER_AGENT'] = UserAgent().chrome
-
-from langchain_community.document_loaders import WebBaseLoader
+from modules.Clients import ClientRegistry, get_clients
+from modules.VectorStore import aembed_texts, faiss_from_matrix
+from modules.WebFetcher import WebFetcher
+from modules.WebCache import WebCache, get_web_cache
+from modules.AsyncUtils import run_blocking
+from modules.Metrics import stage
+from modules.Scheduler import SchedulerBusy
+from modules.EmbeddingExecutor import run_sync
+from modules.Chunker import get_chunker
+import numpy as np
+import httpx
+import json
 
 
 class SearchResult(BaseModel):
@@ -26,23 +28,38 @@ class WebSearchTool(BaseTool):
     name: str = "web_search"
     description: str = "Searches the web for relevant information using DuckDuckGo"
     
-    def __init__(self):
+    def __init__(self, clients: Optional[ClientRegistry] = None, search_backend: Any = None,
+                 cache: Optional[WebCache] = None, embeddings: Optional[Embeddings] = None):
         super().__init__()
-        self._wrapper = DuckDuckGoSearchAPIWrapper(
-            backend='api',
-            max_results=5,
-            region='jp-jp',
-            safesearch='moderate',
-            source='text',
-            time='y'
+        clients = clients or get_clients()
+        # search_backendはresults(query, max_results)を持つ任意のオブジェクト（オフライン確認用のスタブなど）
+        self._wrapper = search_backend or clients.search_wrapper()
+        self._fetcher = clients.web_fetcher()
+        self._embeddings = embeddings or clients.embeddings("nomic-embed-text")
+        self._text_splitter = get_chunker("web")
+        self._cache = cache or get_web_cache()
+        # 分割設定や埋め込みモデルが変わったらページのキャッシュを使わない
+        self._page_version = json.dumps(
+            [self._text_splitter.settings(), getattr(self._embeddings, "model", "")], sort_keys=True
         )
-        self._embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        self._text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=20, length_function=len)
+
+    def _search_settings(self) -> Dict[str, Any]:
+        settings = {
+            name: getattr(self._wrapper, name, None)
+            for name in ("region", "time", "safesearch", "source", "backend")
+        }
+        settings["max_results"] = 3
+        return settings
     
     def _get_search_results(self, query: str) -> List[SearchResult]:
         results = []
         try:
-            search_results = self._wrapper.results(query=query, max_results=3)
+            key = self._cache.search_key(query, self._search_settings())
+            search_results = self._cache.get_search(key)
+            if search_results is None:
+                search_results = self._wrapper.results(query=query, max_results=3)
+                if search_results:
+                    self._cache.put_search(key, search_results)
             for r in search_results:
                 results.append(SearchResult(
                     title=r.get('title', ''),
@@ -54,40 +71,110 @@ class WebSearchTool(BaseTool):
             print(f"Search error: {str(e)}")
             return []
 
-    def _process_web_content(self, urls: List[str]) -> List[Document]:
-        processed_documents = []
+    def _cached_pages(self, urls: List[str]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        fresh, stale = {}, {}
         for url in urls:
-            try:
-                loader = WebBaseLoader([url])
-                documents = loader.load()
-                processed_documents.extend(self._text_splitter.split_documents(documents))
-            except Exception as e:
-                print(f"Error processing URL {url}: {str(e)}")
+            page = self._cache.get_page(url, self._page_version)
+            if page is None:
                 continue
-        return processed_documents
+            if page["fresh"]:
+                fresh[url] = page
+            elif page["etag"] or page["last_modified"]:
+                stale[url] = page
+        return fresh, stale
 
-    def _create_vector_store(self, texts: List[Document], query: str) -> List[str]:
-        if not texts:
-            return []
+    def _store_pages(self, documents: List[Document], chunks: List[Document], matrix: Optional[np.ndarray]) -> None:
+        for document in documents:
+            # 締め切りで途中までしか取得できなかったページは保存しない
+            if document.metadata.get("partial"):
+                continue
+            url = document.metadata["source"]
+            rows = [i for i, chunk in enumerate(chunks) if chunk.metadata.get("source") == url]
+            self._cache.put_page(
+                url, self._page_version, document.metadata.get("title", ""),
+                [chunks[i].page_content for i in rows],
+                matrix[rows] if matrix is not None and rows else None,
+                etag=document.metadata.get("etag"), last_modified=document.metadata.get("last_modified"),
+            )
+
+    async def _aload_pages(self, urls: List[str], fetcher: WebFetcher) -> Tuple[List[Document], Optional[np.ndarray]]:
+        """
+        Returns the chunks of all pages and their embeddings, fetching and embedding only pages
+        that are not cached or whose cached copy changed since it was stored.
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        pages, stale = await run_blocking(self._cached_pages, urls)
+
+        missing = [url for url in urls if url not in pages]
+        validators = {
+            url: {name: value for name, value in (("If-None-Match", page["etag"]),
+                                                  ("If-Modified-Since", page["last_modified"])) if value}
+            for url, page in stale.items()
+        }
+        # 全URLを同時に取得し、締め切りまでに取得できた分だけを使う
+        with stage("web_fetch"):
+            documents = await fetcher.fetch_all(missing, validators=validators) if missing else []
+
+        fetched = []
+        for document in documents:
+            url = document.metadata["source"]
+            if document.metadata.get("not_modified"):
+                await run_blocking(self._cache.touch_page, url)
+                pages[url] = stale[url]
+            else:
+                fetched.append(document)
+
+        chunks = self._text_splitter.split_documents(fetched)
+        matrix = await aembed_texts([chunk.page_content for chunk in chunks], self._embeddings) if chunks else None
+        if fetched:
+            await run_blocking(self._store_pages, fetched, chunks, matrix)
+
+        # キャッシュ済みのページと新しく取得したページを検索結果の順に並べる
+        all_chunks, matrices = [], []
+        for url in urls:
+            if url in pages:
+                page = pages[url]
+                if page["vectors"] is None:
+                    continue
+                all_chunks.extend(
+                    Document(page_content=text, metadata={"source": url, "title": page["title"]})
+                    for text in page["chunks"]
+                )
+                matrices.append(page["vectors"])
+            else:
+                rows = [i for i, chunk in enumerate(chunks) if chunk.metadata.get("source") == url]
+                all_chunks.extend(chunks[i] for i in rows)
+                if rows:
+                    matrices.append(matrix[rows])
+        return all_chunks, (np.vstack(matrices) if matrices else None)
+
+    def _similar_contents(self, chunks: List[Document], matrix: np.ndarray, query: str) -> List[str]:
         try:
-            db = FAISS.from_documents(texts, self._embeddings)
+            db = faiss_from_matrix(chunks, matrix, self._embeddings)
             similar_docs = db.similarity_search(query, k=3)
             return [doc.page_content for doc in similar_docs]
         except Exception as e:
             print(f"Vector store error: {str(e)}")
             return []
 
-    def _run(self, query: str) -> Dict[str, Any]:
-        search_results = self._get_search_results(query)
+    async def _asearch(self, query: str, fetcher: WebFetcher) -> Dict[str, Any]:
+        # 検索APIは同期のみのためスレッドプールで実行し、ページ取得はイベントループ上で並行に行う
+        with stage("web_search"):
+            search_results = await run_blocking(self._get_search_results, query)
         if not search_results:
             return {"error": "検索結果が見つかりませんでした"}
 
         urls = [result.url for result in search_results]
-        documents = self._process_web_content(urls)
-        if not documents:
+        try:
+            chunks, matrix = await self._aload_pages(urls, fetcher)
+        except Exception as e:
+            print(f"Error processing web content: {str(e)}")
+            chunks, matrix = [], None
+        if not chunks:
             return {"error": "ウェブコンテンツの処理に失敗しました"}
 
-        similar_contents = self._create_vector_store(documents, query)
+        with stage("vector_search"):
+            similar_contents = await run_blocking(self._similar_contents, chunks, matrix, query)
         
         return {
             "search_results": [
@@ -100,11 +187,27 @@ class WebSearchTool(BaseTool):
             "relevant_contents": similar_contents
         }
 
+    def _run(self, query: str) -> Dict[str, Any]:
+        # 同期呼び出し用。共有クライアントは起動中のイベントループに属するため一時的なクライアントを使う
+        async def search():
+            async with httpx.AsyncClient(headers=self._fetcher.client.headers) as client:
+                fetcher = WebFetcher(client, per_host_limit=self._fetcher.per_host_limit,
+                                     connect_timeout=self._fetcher.timeout.connect,
+                                     read_timeout=self._fetcher.timeout.read,
+                                     max_bytes=self._fetcher.max_bytes, deadline=self._fetcher.deadline)
+                return await self._asearch(query, fetcher)
+        return run_sync(search())
+
+    async def _arun(self, query: str) -> Dict[str, Any]:
+        return await self._asearch(query, self._fetcher)
+
 
 class WebSearchAgent:
-    def __init__(self, model_name: str = "elyza:jp8b"):
-        self.search_tool = WebSearchTool()
-        self.chat_ollama = ChatOllama(model=model_name)
+    def __init__(self, model_name: str = "elyza:jp8b", clients: Optional[ClientRegistry] = None):
+        self.clients = clients or get_clients()
+        self.model_name = model_name
+        self.search_tool = WebSearchTool(self.clients)
+        self.chat_ollama = self.clients.chat(model_name)
         self.prompt_template = ChatPromptTemplate.from_template(
             """以下の情報に基づいて、ユーザーの質問に答えてください。
 情報:
@@ -115,33 +218,79 @@ class WebSearchAgent:
 できるだけ具体的に、わかりやすく説明してください。"""
         )
 
-    def answer_query(self, query: str) -> str:
-        try:
+    def _prepare(self, query: str, search_results: Optional[Dict[str, Any]] = None):
+        if search_results is None:
             search_results = self.search_tool.run(query)
-            
-            if "error" in search_results:
-                return f"【回答】\n{search_results['error']}\n"
+        
+        if "error" in search_results:
+            return None, f"【回答】\n{search_results['error']}\n"
 
-            relevant_contents = search_results.get("relevant_contents", [])
-            if not relevant_contents:
-                return "【回答】\n申し訳ありませんが、関連情報が見つかりませんでした。\n"
+        relevant_contents = search_results.get("relevant_contents", [])
+        if not relevant_contents:
+            return None, "【回答】\n申し訳ありませんが、関連情報が見つかりませんでした。\n"
 
-            messages = self.prompt_template.format_messages(
-                context="\n".join(relevant_contents),
-                query=query
-            )
+        messages = self.prompt_template.format_messages(
+            context="\n".join(relevant_contents),
+            query=query
+        )
+
+        sources = search_results["search_results"]
+        formatted_sources = "\n【情報源】\n" + "\n".join(
+            f"タイトル: {source['title']}\nURL: {source['url']}\nサマリー: {source['summary']}\n"
+            for source in sources
+        )
+        return messages, formatted_sources
+
+    def answer_query(self, query: str) -> str:
+        try:
+            messages, formatted_sources = self._prepare(query)
+            if messages is None:
+                return formatted_sources
             
             response = self.chat_ollama.generate([messages])
             llm_response = response.generations[0][0].text
 
-            sources = search_results["search_results"]
-            formatted_sources = "\n【情報源】\n" + "\n".join(
-                f"タイトル: {source['title']}\nURL: {source['url']}\nサマリー: {source['summary']}\n"
-                for source in sources
-            )
+            return f"【回答】\n{llm_response}\n{formatted_sources}"
+
+        except Exception as e:
+            return f"【回答】\nエラーが発生しました: {str(e)}\n"
+
+    async def _aprepare(self, query: str):
+        search_results = await self.search_tool.arun(query)
+        return self._prepare(query, search_results)
+
+    async def aanswer_query(self, query: str) -> str:
+        try:
+            messages, formatted_sources = await self._aprepare(query)
+            if messages is None:
+                return formatted_sources
+
+            async with self.clients.limit(self.model_name):
+                response = await self.chat_ollama.agenerate([messages])
+            llm_response = response.generations[0][0].text
 
             return f"【回答】\n{llm_response}\n{formatted_sources}"
 
+        except SchedulerBusy:
+            raise
         except Exception as e:
             return f"【回答】\nエラーが発生しました: {str(e)}\n"
 
+    async def astream_answer(self, query: str):
+        try:
+            messages, formatted_sources = await self._aprepare(query)
+            if messages is None:
+                yield formatted_sources
+                return
+
+            # 枠を確保してから書き始める（混雑時は何も返さずにSchedulerBusyを伝える）
+            async with self.clients.limit(self.model_name):
+                yield "【回答】\n"
+                async for chunk in self.chat_ollama.astream(messages):
+                    yield chunk.content
+            yield f"\n{formatted_sources}"
+
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            yield f"【回答】\nエラーが発生しました: {str(e)}\n"
@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from modules.DocLoader import DocumentLoader
+from modules.ContextQA import ContextQA
+from modules.AsyncUtils import run_blocking
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+
+# セッションの作業領域の保持期間とメモリ上限（環境変数で調整）
+WORKSPACE_IDLE_TTL = float(os.environ.get("WORKSPACE_IDLE_TTL", "1800"))
+WORKSPACE_MEMORY_BUDGET = int(os.environ.get("WORKSPACE_MEMORY_BUDGET_MB", "1024")) * 1024 ** 2
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def safe_session_id(session_id: Optional[str]) -> str:
+    # ディレクトリ名として使うため、想定外の文字を含むIDは既定のセッションにまとめる
+    if session_id and SESSION_ID_PATTERN.match(session_id):
+        return session_id
+    return "default"
+
+
+class SessionWorkspace:
+    """
+    Upload directory of one session together with its parsed documents and retrieval state.
+    The ContextQA chain is kept across turns and rebuilt only when the uploaded files change.
+    """
+    def __init__(self, session_id: str, root: str = "uploads"):
+        self.session_id = session_id
+        self.directory = os.path.join(root, session_id)
+        self.doc_loader = DocumentLoader(directory_path=self.directory)
+        self.temp_file_path: Optional[str] = None
+        self.documents_key: Optional[str] = None
+        self.qa: Optional[ContextQA] = None
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self._memory_bytes: Optional[int] = None
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+
+    def _prepare(self) -> Optional[str]:
+        if not os.path.isdir(self.directory):
+            temp_file_path = None
+        else:
+            temp_file_path = self.doc_loader.create_temp_file()
+        if temp_file_path is None and os.path.exists(self.doc_loader.temp_file_path):
+            # 全ファイルが削除された場合は古い結合ファイルを参照させない
+            os.remove(self.doc_loader.temp_file_path)
+        return temp_file_path
+
+    async def prepare(self) -> Optional[str]:
+        """
+        Parses new or changed uploads and returns the combined text path, or None without documents.
+        """
+        temp_file_path = await run_blocking(self._prepare)
+        documents_key = self.doc_loader.manifest.combined.get(self.doc_loader.temp_file_path) if temp_file_path else None
+        if documents_key != self.documents_key:
+            self.release()
+            self.documents_key = documents_key
+        self.temp_file_path = temp_file_path
+        return temp_file_path
+
+    def context_qa(self) -> ContextQA:
+        if self.qa is None:
+            self.qa = ContextQA(self.temp_file_path, doc_loader=self.doc_loader)
+        return self.qa
+
+    def memory_bytes(self) -> int:
+        # ベクトルインデックスとチャンク本文の大きさで概算
+        if self.qa is None or self.qa.db is None:
+            return 0
+        if self._memory_bytes is None:
+            index = self.qa.db.index
+            self._memory_bytes = index.ntotal * index.d * 4 + sum(
+                len(chunk.page_content.encode("utf-8")) for chunk in self.qa.chunks or []
+            )
+        return self._memory_bytes
+
+    def release(self) -> None:
+        # メモリ上の検索状態のみ破棄（インデックスはディスクのキャッシュから再読み込みできる）
+        self.qa = None
+        self._memory_bytes = None
+
+
+class WorkspaceManager:
+    """
+    Keeps one SessionWorkspace per session id. Idle workspaces are removed together with their
+    uploads after idle_ttl seconds; retrieval state of the least recently used workspaces is
+    released when the total exceeds memory_budget bytes.
+    """
+    def __init__(self, root: str = "uploads", idle_ttl: float = WORKSPACE_IDLE_TTL,
+                 memory_budget: int = WORKSPACE_MEMORY_BUDGET):
+        self.root = root
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.workspaces: "OrderedDict[str, SessionWorkspace]" = OrderedDict()
+        self.logger = logging.getLogger(__name__)
+
+    def get(self, session_id: str) -> SessionWorkspace:
+        session_id = safe_session_id(session_id)
+        workspace = self.workspaces.get(session_id)
+        if workspace is None:
+            workspace = SessionWorkspace(session_id, self.root)
+            self.workspaces[session_id] = workspace
+        self.workspaces.move_to_end(session_id)
+        workspace.touch()
+        self.evict()
+        return workspace
+
+    def remove(self, session_id: str) -> None:
+        workspace = self.workspaces.pop(session_id, None)
+        if workspace is None:
+            return
+        workspace.release()
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+        workspace.doc_loader.manifest.prune([], workspace.directory)
+        workspace.doc_loader.manifest.save()
+        self.logger.info(f"Removed idle workspace: {session_id}")
+
+    def evict(self) -> None:
+        now = time.monotonic()
+        for session_id, workspace in list(self.workspaces.items()):
+            # 処理中の作業領域は対象外
+            if now - workspace.last_used > self.idle_ttl and not workspace.lock.locked():
+                self.remove(session_id)
+
+        total = sum(workspace.memory_bytes() for workspace in self.workspaces.values())
+        # 古いものから解放し、直近に使った作業領域は残す
+        for workspace in list(self.workspaces.values())[:-1]:
+            if total <= self.memory_budget:
+                break
+            if workspace.qa is not None and not workspace.lock.locked():
+                total -= workspace.memory_bytes()
+                workspace.release()
+                self.logger.info(f"Released retrieval state of workspace: {workspace.session_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.workspaces),
+            "loaded": sum(1 for workspace in self.workspaces.values() if workspace.qa is not None),
+            "memory_bytes": sum(workspace.memory_bytes() for workspace in self.workspaces.values()),
+            "memory_budget": self.memory_budget,
+            "idle_ttl": self.idle_ttl,
+        }
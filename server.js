@@ -16,7 +16,8 @@ async function handleFiles(directory, operation = 'clean') {
         const files = await fs.readdir(directory);
         await Promise.all(files.map(file => {
             const filePath = path.join(directory, file);
-            return fs.unlink(filePath)
+            // セッションごとのサブディレクトリも含めて削除
+            return fs.rm(filePath, { recursive: true, force: true })
                 .then(() => console.log(`Deleted: ${filePath}`))
                 .catch(err => console.error(`Error deleting ${filePath}:`, err));
         }));
@@ -48,6 +49,17 @@ async function initializeUploadDirectory() {
 // 起動時にディレクトリを初期化
 initializeUploadDirectory();
 
+// セッションIDをリクエストヘッダーから取得（ディレクトリ名に使うため形式を検証）
+function getSessionId(req) {
+    const sessionId = req.get('X-Session-Id');
+    return sessionId && /^[A-Za-z0-9_-]{1,64}$/.test(sessionId) ? sessionId : 'default';
+}
+
+// セッション専用のアップロードディレクトリ
+function getSessionDir(req) {
+    return path.join(UPLOAD_DIR, getSessionId(req));
+}
+
 // ファイル名を安全な形式に変換する関数
 function sanitizeFileName(originalname) {
     const ext = path.extname(originalname);
@@ -61,10 +73,11 @@ function sanitizeFileName(originalname) {
 // multerの設定
 const storage = multer.diskStorage({
     destination: (req, file, cb) => {
-        if (!fsSync.existsSync(UPLOAD_DIR)) {
-            fsSync.mkdirSync(UPLOAD_DIR);
+        const sessionDir = getSessionDir(req);
+        if (!fsSync.existsSync(sessionDir)) {
+            fsSync.mkdirSync(sessionDir, { recursive: true });
         }
-        cb(null, UPLOAD_DIR);
+        cb(null, sessionDir);
     },
     // ファイル名を元のまま保持するように修正
     filename: (req, file, cb) => cb(null, file.originalname)
@@ -120,48 +133,106 @@ app.use(express.json());
 // ファイルリスト取得のエンドポイントを追加
 app.get("/api/files", async (req, res) => {
     try {
-        const files = await fs.readdir(UPLOAD_DIR);
-        res.json(files);
+        const files = await fs.readdir(getSessionDir(req));
+        res.json(files.filter(file => file !== 'temp_combined.txt'));
     } catch (error) {
+        if (error.code === 'ENOENT') {
+            return res.json([]);
+        }
         res.status(500).json({ error: "ファイル一覧の取得に失敗しました。" });
     }
 });
 
 // ファイル削除のエンドポイントを追加
 app.delete("/api/files/:filename", async (req, res) => {
+    const filename = path.basename(req.params.filename);
+    try {
+        await fs.unlink(path.join(getSessionDir(req), filename));
+    } catch (error) {
+        return res.status(500).json({ error: "ファイルの削除に失敗しました。" });
+    }
+    // 処理中のインデックス構築を取り消し、残りのファイルで作り直す（失敗しても削除自体は成功）
+    let ingest = null;
     try {
-        await fs.unlink(path.join(UPLOAD_DIR, req.params.filename));
-        res.json({ success: true });
+        const response = await axios.delete(`http://localhost:8501/api/files/${encodeURIComponent(filename)}`, {
+            params: { session_id: getSessionId(req) }
+        });
+        ingest = response.data.job;
     } catch (error) {
-        res.status(500).json({ error: "ファイルの削除に失敗しました。" });
+        console.error("Error cancelling ingestion:", error.message);
+    }
+    res.json({ success: true, ingest });
+});
+
+// インデックス構築ジョブの進捗（Python側にそのまま問い合わせる）
+app.get("/api/files/:id/status", async (req, res) => {
+    try {
+        const response = await axios.get(`http://localhost:8501/api/files/${encodeURIComponent(req.params.id)}/status`);
+        res.json(response.data);
+    } catch (error) {
+        const status = error.response?.status === 404 ? 404 : 502;
+        res.status(status).json({ error: "ジョブの状態を取得できませんでした。" });
     }
 });
 
 // ファイルアップロードのエンドポイントを複数ファイル対応に修正
-app.post("/api/upload", upload.array('files'), (req, res) => {
+app.post("/api/upload", upload.array('files'), async (req, res) => {
     if (!req.files || req.files.length === 0) {
         return res.status(400).json({ error: "ファイルがアップロードされていません。" });
     }
 
+    // 解析・埋め込み・インデックス構築をPython側のバックグラウンドで開始する
+    // （受け付けられなかった場合や無効な場合（204）は、従来どおり最初の質問時に構築される）
+    let ingest = null;
+    try {
+        const response = await axios.post("http://localhost:8501/api/files/ingest", {
+            session_id: getSessionId(req),
+            filenames: req.files.map(file => file.filename)
+        });
+        if (response.status === 202) {
+            ingest = { id: response.data.id, status: response.data.status };
+        }
+    } catch (error) {
+        console.error("Error starting ingestion:", error.message);
+    }
+
     res.json(req.files.map(file => ({
         originalname: file.originalname,
         filename: file.filename,
-        path: `/uploads/${file.filename}`
+        path: `/uploads/${getSessionId(req)}/${file.filename}`,
+        ingest
     })));
 });
 
+// Python側が混雑で受け付けなかった場合（429/503）は、Retry-Afterを付けてそのまま返す
+function sendBusy(error, res) {
+    const status = error.response?.status;
+    if (status !== 429 && status !== 503) return false;
+    const retryAfter = error.response.headers['retry-after'];
+    if (retryAfter) res.setHeader('Retry-After', retryAfter);
+    res.status(status).json({
+        error: "現在混雑しています。しばらくしてから再度お試しください。",
+        retryAfter: Number(retryAfter) || null
+    });
+    return true;
+}
+
 app.post("/api/send-message", async (req, res) => {
     console.log("Received message:", req.body.message);
 
     try {
         const response = await axios.post("http://localhost:8501/api/chat", {
             message: req.body.message,
+            session_id: getSessionId(req),
             attachment: req.body.attachment
         }, {
             headers: { 'Content-Type': 'application/json' }
         });
 
         console.log("Response from Python backend:", response.data);
+        // Python側の処理時間の内訳（Server-Timing）をブラウザの開発者ツールで確認できるよう中継
+        const serverTiming = response.headers['server-timing'];
+        if (serverTiming) res.setHeader('Server-Timing', serverTiming);
         res.json(response.data);
 
     } catch (error) {
@@ -170,6 +241,7 @@ app.post("/api/send-message", async (req, res) => {
             code: error.code,
             response: error.response?.data
         });
+        if (sendBusy(error, res)) return;
         
         res.status(error.code === 'ECONNREFUSED' ? 503 : 500)
            .json({ error: error.code === 'ECONNREFUSED' 
@@ -178,6 +250,50 @@ app.post("/api/send-message", async (req, res) => {
     }
 });
 
+// トークンを逐次返すストリーミング版のエンドポイント
+app.post("/api/send-message/stream", async (req, res) => {
+    console.log("Received message (stream):", req.body.message);
+
+    try {
+        const response = await axios.post("http://localhost:8501/api/chat/stream", {
+            message: req.body.message,
+            session_id: getSessionId(req),
+            attachment: req.body.attachment
+        }, {
+            headers: { 'Content-Type': 'application/json' },
+            responseType: 'stream'
+        });
+
+        res.setHeader('Content-Type', 'application/x-ndjson; charset=utf-8');
+        res.setHeader('Cache-Control', 'no-cache');
+        res.setHeader('X-Accel-Buffering', 'no');
+        res.flushHeaders();
+
+        // クライアントが切断したら上流のストリームも閉じる（reqはexpress.json()で読み終わっているためresで検知する）
+        res.on('close', () => response.data.destroy());
+        // 上流が途中で失敗した場合は、エラーを伝えてレスポンスを閉じる
+        response.data.on('error', (error) => {
+            console.error("Stream error:", error.message);
+            if (!res.writableEnded) {
+                res.end("\n" + JSON.stringify({ type: "error", message: "エラーが発生しました。" }) + "\n");
+            }
+        });
+        response.data.pipe(res);
+
+    } catch (error) {
+        console.error("Error details:", {
+            message: error.message,
+            code: error.code
+        });
+        if (sendBusy(error, res)) return;
+
+        res.status(error.code === 'ECONNREFUSED' ? 503 : 500)
+           .json({ error: error.code === 'ECONNREFUSED' 
+                         ? "Python バックエンドに接続できません。" 
+                         : "エラーが発生しました。" });
+    }
+});
+
 const server = app.listen(PORT, () => {
     console.log(`Server running at http://localhost:${PORT}`);
 });
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Sentence splitting, overlap and fallbacks of the shared JapaneseChunker.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.Chunker import JapaneseChunker, estimate_tokens
+
+
+def test_sentences_are_packed_and_overlapped():
+    sentences = [f"これは{i}番目の文です。" for i in range(10)]
+    chunker = JapaneseChunker(chunk_tokens=30, overlap_tokens=12)
+    chunks = chunker.split_text("".join(sentences))
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk) <= 30
+        # チャンクは文の途中で切れない
+        assert chunk.endswith("。")
+    # 前のチャンクの最後の文が次のチャンクの先頭に引き継がれる
+    for previous, chunk in zip(chunks, chunks[1:]):
+        last = previous.split("。")[-2] + "。"
+        assert chunk.startswith(last)
+    assert all(sentence in "".join(chunks) for sentence in sentences)
+
+
+def test_long_sentence_falls_back_to_clauses():
+    clauses = [f"{i}番目の項目を確認し、" for i in range(8)]
+    sentence = "".join(clauses) + "最後に報告する。"
+    chunker = JapaneseChunker(chunk_tokens=30, overlap_tokens=0)
+    chunks = chunker.split_text(sentence)
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == sentence
+    # 読点の直後で区切られ、語の途中では切れない
+    assert all(chunk.endswith("、") for chunk in chunks[:-1])
+
+
+def test_unbreakable_text_is_cut_by_tokens():
+    chunker = JapaneseChunker(chunk_tokens=10, overlap_tokens=0)
+    text = "あ" * 35
+    chunks = chunker.split_text(text)
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 10, 5]
+    assert "".join(chunks) == text
+
+
+def test_closing_brackets_stay_with_their_sentence():
+    chunker = JapaneseChunker(chunk_tokens=12, overlap_tokens=0)
+    chunks = chunker.split_text("彼は「分かりました。」と答えた。（注記あり。）次の文。")
+
+    assert chunks[0] == "彼は「分かりました。」"
+    assert chunks[1:] == ["と答えた。（注記あり。）", "次の文。"]
+    assert not any(chunk.startswith(("」", "）")) for chunk in chunks)
+
+
+def test_english_sentences_split_at_periods_and_keep_spaces():
+    text = "The pump must be checked daily. Replace the filter every 3.5 months! Call support if it fails."
+    chunker = JapaneseChunker(chunk_tokens=10, overlap_tokens=0)
+    chunks = chunker.split_text(text)
+
+    assert chunks == [
+        "The pump must be checked daily.",
+        "Replace the filter every 3.5 months!",
+        "Call support if it fails.",
+    ]
+    # 小さなチャンクに収まらない場合以外は、元の空白を保ったまま一つにまとめる
+    assert JapaneseChunker(chunk_tokens=400).split_text(text) == [text]
+    assert JapaneseChunker(chunk_tokens=400).split_text("Hello! World") == ["Hello! World"]
+
+
+def test_mixed_script_text_is_joined_like_the_source():
+    text = "設定はconfig.yamlに書く。Set the timeout to 30s.\nその後、再起動する。\nRestart\nthe service."
+    chunks = JapaneseChunker(chunk_tokens=400).split_text(text)
+
+    # 日本語の行は詰めてつなぎ、英語の行や文は空白で区切る（ファイル名の「.」では区切らない）
+    assert chunks == ["設定はconfig.yamlに書く。Set the timeout to 30s.その後、再起動する。Restart the service."]
@@ -0,0 +1,104 @@
+"""
+Prometheus text exposition output of modules.Metrics, checked with a small parser of the format.
+
+    python -m pytest tests
+"""
+import math
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.Metrics import MetricsRegistry, _Metric
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\[\\"n])*)"(,|$)')
+
+
+def unescape(value):
+    return re.sub(r'\\(.)', lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+def parse_labels(text):
+    labels, position = {}, 0
+    while position < len(text):
+        match = LABEL.match(text, position)
+        assert match, f"invalid labels: {text[position:]}"
+        labels[match.group(1)] = unescape(match.group(2))
+        position = match.end()
+    return labels
+
+
+def parse(exposition):
+    """
+    Returns {family: {"type", "help", "samples": [(name, labels, value)]}}; fails on malformed lines.
+    """
+    assert exposition.endswith("\n")
+    families, current = {}, None
+    for line in exposition.rstrip("\n").split("\n"):
+        if line.startswith("# HELP "):
+            name, _, help_text = line[7:].partition(" ")
+            assert name not in families, f"duplicate family {name}"
+            current = families[name] = {"help": unescape(help_text), "type": None, "samples": []}
+        elif line.startswith("# TYPE "):
+            name, _, kind = line[7:].partition(" ")
+            assert current is families.get(name) and kind in ("counter", "gauge", "histogram", "untyped")
+            current["type"] = kind
+        else:
+            match = SAMPLE.match(line)
+            assert match, f"invalid sample line: {line!r}"
+            name, labels, value = match.group(1), parse_labels(match.group(2) or ""), match.group(3)
+            family = [f for f in families if name in (f, f"{f}_bucket", f"{f}_sum", f"{f}_count")]
+            assert family and families[family[0]] is current, f"sample {name} outside its family"
+            current["samples"].append((name, labels, float(value)))
+    return families
+
+
+def test_metric_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("elyza_test", "help")
+
+
+def test_exposition_parses_and_escapes_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter("elyza_test_requests_total", "Requests with a \\ backslash\nand newline.", ("path",))
+    gauge = registry.gauge("elyza_test_in_flight", "In-flight calls.")
+    odd = 'a "quoted" \\ value\nnext line'
+    counter.inc(path=odd)
+    counter.inc(2, path="/api/chat")
+    gauge.set(1.5)
+
+    families = parse(registry.render())
+    requests = families["elyza_test_requests_total"]
+    assert requests["type"] == "counter"
+    assert requests["help"] == "Requests with a \\ backslash\nand newline."
+    assert {labels["path"]: value for _, labels, value in requests["samples"]} == {odd: 1, "/api/chat": 2}
+    assert families["elyza_test_in_flight"]["samples"] == [("elyza_test_in_flight", {}, 1.5)]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("elyza_test_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0, 10.0))
+    values = [0.05, 0.1, 0.5, 2.0, 20.0, 30.0]
+    for value in values:
+        histogram.observe(value, stage="llm")
+    histogram.observe(1.0, stage="embed")
+
+    family = parse(registry.render())["elyza_test_seconds"]
+    assert family["type"] == "histogram"
+    for stage, observed in (("llm", values), ("embed", [1.0])):
+        samples = [(name, labels, value) for name, labels, value in family["samples"] if labels["stage"] == stage]
+        buckets = [(float(labels["le"]), value) for name, labels, value in samples if name.endswith("_bucket")]
+        bounds = [bound for bound, _ in buckets]
+        counts = [count for _, count in buckets]
+
+        assert bounds == sorted(bounds) and math.isinf(bounds[-1])
+        assert counts == sorted(counts)
+        # 各区切りの件数はその値以下の観測数（区切りちょうどの値を含む）
+        assert counts == [sum(value <= bound for value in observed) for bound in bounds]
+        totals = {name: value for name, _, value in samples if not name.endswith("_bucket")}
+        assert totals["elyza_test_seconds_count"] == counts[-1] == len(observed)
+        assert totals["elyza_test_seconds_sum"] == pytest.approx(sum(observed))
@@ -0,0 +1,143 @@
+"""
+Regression tests for LLMScheduler slot accounting.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.Scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerBusy
+
+
+def test_release_skips_waiter_cancelled_in_the_same_iteration():
+    async def scenario():
+        scheduler = LLMScheduler(default_limit=1, queue_timeout=5)
+        hold = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("m", session_id="a"):
+                await hold.wait()
+                # 切断で待ちが取り消された直後、後始末が動く前に同じ周回で枠を解放する
+                scheduler._queues["m"].waiting[INTERACTIVE]["b"][0].cancel()
+
+        async def waiter():
+            async with scheduler.slot("m", session_id="b"):
+                pass
+
+        held = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        hold.set()
+
+        await held
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        queue = scheduler._queues["m"]
+        assert queue.in_flight == 0
+        assert queue.queued() == 0
+
+        # 枠が漏れていなければ次の呼び出しはすぐに実行される
+        async with scheduler.slot("m", session_id="c"):
+            assert queue.in_flight == 1
+        assert queue.in_flight == 0
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_queue_limit_applies_to_all_priorities():
+    async def scenario():
+        scheduler = LLMScheduler(default_limit=1, max_queue=2, max_queue_per_session=10, queue_timeout=5)
+        hold = asyncio.Event()
+
+        async def call(priority, session_id):
+            async with scheduler.slot("m", priority=priority, session_id=session_id):
+                await hold.wait()
+
+        tasks = [asyncio.create_task(call(INTERACTIVE, "a"))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(call(BATCH, "b")), asyncio.create_task(call(INTERACTIVE, "c"))]
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerBusy) as busy:
+            scheduler.check_admission("m", "d", INTERACTIVE)
+        assert busy.value.status_code == 503
+
+        hold.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def _saturated_clients(**scheduler_settings):
+    # 1枠のみで、待ち行列に入れない設定のクライアント（呼び出しは受け付け制御で即座に拒否される）
+    from modules.Clients import ClientRegistry
+
+    clients = ClientRegistry(search_backend=object())
+    clients.scheduler = LLMScheduler(default_limit=1, queue_timeout=5, **scheduler_settings)
+    return clients
+
+
+async def _while_slot_held(clients, call):
+    hold = asyncio.Event()
+
+    async def holder():
+        async with clients.scheduler.slot("elyza:jp8b", session_id="other"):
+            await hold.wait()
+
+    held = asyncio.create_task(holder())
+    await asyncio.sleep(0)
+    try:
+        return await call()
+    finally:
+        hold.set()
+        await held
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_summary_raises_scheduler_busy_instead_of_answering(tmp_path, stream):
+    pytest.importorskip("langchain.prompts")
+    from modules.Summarize import DocumentSummarizer
+
+    document = tmp_path / "temp_combined.txt"
+    document.write_text("要約する文書です。", encoding="utf-8")
+    clients = _saturated_clients(max_queue=0)
+    summarizer = DocumentSummarizer(str(document), clients=clients)
+
+    async def call():
+        if stream:
+            return [chunk async for chunk in summarizer.astream_summary("要約してください")]
+        return await summarizer.asummarize("要約してください")
+
+    with pytest.raises(SchedulerBusy) as busy:
+        asyncio.run(asyncio.wait_for(_while_slot_held(clients, call), 10))
+    assert busy.value.status_code == 503
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_web_answer_raises_scheduler_busy_instead_of_answering(tmp_path, monkeypatch, stream):
+    pytest.importorskip("langchain.prompts")
+    from modules.WebSearch import WebSearchAgent
+
+    monkeypatch.chdir(tmp_path)
+    clients = _saturated_clients(max_queue_per_session=0)
+    agent = WebSearchAgent(clients=clients)
+
+    async def prepared(query):
+        return agent.prompt_template.format_messages(context="検索結果", query=query), "\n【情報源】\n"
+
+    monkeypatch.setattr(agent, "_aprepare", prepared)
+
+    async def call():
+        if stream:
+            return [chunk async for chunk in agent.astream_answer("今日のニュース")]
+        return await agent.aanswer_query("今日のニュース")
+
+    with pytest.raises(SchedulerBusy) as busy:
+        asyncio.run(asyncio.wait_for(_while_slot_held(clients, call), 10))
+    assert busy.value.status_code == 429
@@ -0,0 +1,143 @@
+"""
+Optimistic versioning, retry and TTL purge of the shared session stores, against a SQLite
+file and fakeredis standing in for a Redis server.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.SessionMemory import ASSISTANT, USER, ChatMessage, SessionMemory, SessionMemoryStore
+from modules.SessionStore import RedisSessionStore, SQLiteSessionStore
+
+
+def sqlite_store(tmp_path, idle_ttl):
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), idle_ttl=idle_ttl)
+
+
+def redis_store(tmp_path, idle_ttl):
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisSessionStore(idle_ttl=idle_ttl, client=fakeredis.FakeAsyncRedis())
+
+
+@pytest.fixture(params=[sqlite_store, redis_store], ids=["sqlite", "redis"])
+def make_store(request, tmp_path):
+    return lambda idle_ttl=3600: request.param(tmp_path, idle_ttl)
+
+
+def turn(text):
+    return [ChatMessage(USER, text), ChatMessage(ASSISTANT, f"{text}への回答")]
+
+
+class RacingBackend:
+    """
+    Lets another writer save the session between the first load and save, as a second worker would.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.raced = False
+
+    async def load(self, session_id):
+        return await self.backend.load(session_id)
+
+    async def save(self, session_id, memory, version):
+        if not self.raced:
+            self.raced = True
+            other, other_version = await self.backend.load(session_id)
+            other = other or SessionMemory()
+            other.messages.extend(turn("別のワーカー"))
+            assert await self.backend.save(session_id, other, other_version)
+        return await self.backend.save(session_id, memory, version)
+
+
+def test_save_rejects_a_stale_version(make_store):
+    async def scenario():
+        store = make_store()
+        memory, version = await store.load("s")
+        assert memory is None and version == 0
+
+        assert await store.save("s", SessionMemory(messages=turn("一つ目")), version)
+        # 同じ版からの2回目の保存は、先の保存を上書きせずに失敗する
+        assert not await store.save("s", SessionMemory(messages=turn("上書き")), version)
+
+        memory, version = await store.load("s")
+        assert version == 1
+        assert [m.content for m in memory.messages] == ["一つ目", "一つ目への回答"]
+        assert await store.save("s", memory, version)
+        assert (await store.load("s"))[1] == 2
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_add_turn_reloads_and_retries_after_a_conflict(make_store):
+    async def scenario():
+        backend = RacingBackend(make_store())
+        memories = SessionMemoryStore(backend=backend)
+        await memories.add_turn("s", "質問", "回答")
+
+        assert memories.conflicts == 1
+        memory, version = await backend.backend.load("s")
+        assert version == 2
+        assert [m.content for m in memory.messages] == ["別のワーカー", "別のワーカーへの回答", "質問", "回答"]
+        await backend.backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_turns_are_not_lost(make_store):
+    async def scenario():
+        store = make_store()
+        # 別々のワーカーに見立てて、書き込みごとに別のSessionMemoryStoreを使う
+        workers = [SessionMemoryStore(backend=store, max_retries=64) for _ in range(40)]
+        await asyncio.gather(*(worker.add_turn("s", f"質問{i}", f"回答{i}") for i, worker in enumerate(workers)))
+
+        memory, version = await store.load("s")
+        assert version == 40
+        questions = {m.content for m in memory.messages if m.role == USER}
+        assert questions == {f"質問{i}" for i in range(40)}
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_sessions_are_purged(make_store):
+    async def scenario():
+        store = make_store(idle_ttl=0.05)
+        assert await store.save("s", SessionMemory(messages=turn("古い")), 0)
+        await asyncio.sleep(0.1)
+
+        memory, _ = await store.load("s")
+        assert memory is None
+        await store.evict()
+        if isinstance(store, SQLiteSessionStore):
+            assert store.evicted == 1
+            assert store.stats()["sessions"] == 0
+        # 失効後は新しいセッションとして保存し直せる
+        memory, version = await store.load("s")
+        assert version == 0
+        assert await store.save("s", SessionMemory(messages=turn("新しい")), version)
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_keeps_the_version_of_an_expired_row_until_it_is_purged(tmp_path):
+    async def scenario():
+        store = sqlite_store(tmp_path, idle_ttl=0.05)
+        assert await store.save("s", SessionMemory(messages=turn("古い")), 0)
+        await asyncio.sleep(0.1)
+
+        memory, version = await store.load("s")
+        assert memory is None and version == 1
+        # 削除前の古い版（0）では上書きできない
+        assert not await store.save("s", SessionMemory(), 0)
+        assert await store.save("s", SessionMemory(messages=turn("新しい")), version)
+        await store.close()
+
+    asyncio.run(scenario())
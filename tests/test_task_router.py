@@ -0,0 +1,84 @@
+"""
+The synchronous and asynchronous TaskHandler entry points route through the same local tiers.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.Cache import LRUCache
+from modules.TaskRouter import TASK_PROTOTYPES, TaskRouter
+
+
+class PrototypeEmbeddings:
+    """
+    One-hot vectors per prototype query, so a prototype used as a query matches only itself.
+    """
+    def __init__(self):
+        self.texts = [text for texts in TASK_PROTOTYPES.values() for text in texts]
+
+    def _vector(self, text):
+        vector = np.zeros(len(self.texts), dtype=np.float32)
+        vector[self.texts.index(text)] = 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+class NoLLM:
+    """
+    Instructor client stand-in that fails the test if the LLM tier is reached.
+    """
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        raise AssertionError("LLM tier reached")
+
+    async def acreate(self, **kwargs):
+        raise AssertionError("LLM tier reached")
+
+
+def handler(tmp_path):
+    pytest.importorskip("instructor")
+    from modules.Clients import ClientRegistry
+    from modules.TaskHandler import TaskHandler
+
+    router = TaskRouter(embeddings=PrototypeEmbeddings())
+    task_handler = TaskHandler(directory=str(tmp_path), clients=ClientRegistry(search_backend=object()),
+                               router=router, route_cache=LRUCache())
+    task_handler.client = NoLLM()
+    task_handler.async_client = NoLLM()
+    return task_handler
+
+
+def test_sync_and_async_routing_use_the_embedding_tier(tmp_path):
+    (tmp_path / "temp_combined.txt").write_text("参照する文書", encoding="utf-8")
+    router = TaskRouter()
+    # ルールでは判定できない代表クエリだけを使い、埋め込みの段で判定されることを確かめる
+    cases = [(task, text) for task, texts in TASK_PROTOTYPES.items() for text in texts
+             if router.route_by_rules(text, True) is None]
+    assert cases
+
+    sync_handler, async_handler = handler(tmp_path), handler(tmp_path)
+    for task, text in cases:
+        sync_task = sync_handler.process_query(text)
+        async_task = asyncio.run(async_handler.aprocess_query(text))
+        assert sync_task == async_task == task